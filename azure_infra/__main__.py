@@ -6,6 +6,8 @@
 # debugpy.wait_for_client()
 
 import pulumi
+from azure_infra import providers
 from azure_infra.main import main
 
 main()
+providers.log_report()
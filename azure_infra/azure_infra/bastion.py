@@ -1,31 +1,38 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 import pulumi
-import pulumi_azure_native as azure_native
-from pulumi_azure_native.network import (
-    BastionHost,
-    BastionHostSkuName,
-    PublicIPAddress,
-    Subnet,
-)
-from pulumi_azure_native.resources import ResourceGroup
 
-from azure_infra import names
+from azure_infra import names, providers
+
+if TYPE_CHECKING:
+    from pulumi_azure_native.network import BastionHost, Subnet
+    from pulumi_azure_native.resources import ResourceGroup
 
 
 def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> BastionHost:
-    ip = PublicIPAddress(
+    # In retain-IP mode only the bastion host is destroyed between reservations,
+    # so the static IP is protected from being deleted with the rest.
+    network = providers.network
+    config = pulumi.Config()
+    retain_ip = config.get_bool("bastion_retain_ip") or False
+
+    ip = network.PublicIPAddress(
         names.BASTION_IP_NAME,
         resource_group_name=rg.name,
         location=rg.location,
         public_ip_allocation_method="Static",
         public_ip_address_version="IPv4",
         sku={
-            "name": azure_native.network.PublicIPAddressSkuName.STANDARD,
-            "tier": azure_native.network.PublicIPAddressSkuTier.REGIONAL,
+            "name": network.PublicIPAddressSkuName.STANDARD,
+            "tier": network.PublicIPAddressSkuTier.REGIONAL,
         },
         tags=tags,
         public_ip_address_name=names.BASTION_IP_NAME,
+        opts=pulumi.ResourceOptions(protect=retain_ip),
     )
-    bastion = BastionHost(
+    bastion = network.BastionHost(
         names.BASTION_RESOURCE_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -39,7 +46,7 @@ def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> BastionHos
         enable_ip_connect=True,
         enable_kerberos=True,
         enable_tunneling=True,
-        sku={"name": BastionHostSkuName.STANDARD},
+        sku={"name": network.BastionHostSkuName.STANDARD},
         tags=tags,
         bastion_host_name=names.BASTION_RESOURCE_NAME,
     )
@@ -1,14 +1,17 @@
-from typing import TypedDict
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, TypedDict
 
 import pulumi
-import pulumi_azure_native as azure_native
-from pulumi_azure_native.compute import VirtualMachine
-from pulumi_azure_native.documentdb import DatabaseAccount
-from pulumi_azure_native.network import NetworkInterface, Subnet
-from pulumi_azure_native.resources import ResourceGroup
-from pulumi_azure_native.storage import StorageAccount
 
-from azure_infra import misc, names
+from azure_infra import misc, names, providers
+
+if TYPE_CHECKING:
+    from pulumi_azure_native.compute import VirtualMachine
+    from pulumi_azure_native.documentdb import DatabaseAccount
+    from pulumi_azure_native.network import NetworkInterface, Subnet
+    from pulumi_azure_native.resources import ResourceGroup
+    from pulumi_azure_native.storage import StorageAccount
 
 
 class DefinedResources(TypedDict):
@@ -21,14 +24,14 @@ class DefinedResources(TypedDict):
 
 def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> DefinedResources:
     # Azure storage v2
-    storage001 = StorageAccount(
+    storage001 = providers.storage.StorageAccount(
         names.COMMON_SYSAD_STORAGE_ACCOUNT_NAME,
         resource_group_name=rg.name,
-        kind=azure_native.storage.Kind.STORAGE_V2,
-        sku={"name": azure_native.storage.SkuName.STANDARD_LRS},
-        access_tier=azure_native.storage.AccessTier.HOT,
+        kind=providers.storage.Kind.STORAGE_V2,
+        sku={"name": providers.storage.SkuName.STANDARD_LRS},
+        access_tier=providers.storage.AccessTier.HOT,
         enable_https_traffic_only=True,
-        public_network_access=azure_native.storage.PublicNetworkAccess.ENABLED,
+        public_network_access=providers.storage.PublicNetworkAccess.ENABLED,
         location=rg.location,
         tags=tags,
         # account_name=names.IMPORTED_COMMON_SYSAD_STORAGE_ACCOUNT_NAME,
@@ -37,31 +40,31 @@ def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> DefinedRes
         # ),
     )
     # Azure file storage
-    file001 = StorageAccount(
+    file001 = providers.storage.StorageAccount(
         names.COMMON_SYSAD_FILE_ACCOUNT_NAME,
         resource_group_name=rg.name,
-        kind=azure_native.storage.Kind.FILE_STORAGE,
-        sku={"name": azure_native.storage.SkuName.PREMIUM_LRS},
-        access_tier=azure_native.storage.AccessTier.HOT,
+        kind=providers.storage.Kind.FILE_STORAGE,
+        sku={"name": providers.storage.SkuName.PREMIUM_LRS},
+        access_tier=providers.storage.AccessTier.HOT,
         enable_https_traffic_only=True,
-        public_network_access=azure_native.storage.PublicNetworkAccess.ENABLED,
+        public_network_access=providers.storage.PublicNetworkAccess.ENABLED,
         location=rg.location,
         tags=tags,
     )
 
     # Cosmos DB
-    cosmosdb = DatabaseAccount(
+    cosmosdb = providers.documentdb.DatabaseAccount(
         names.COMMON_SYSAD_COSMOSDB_NAME,
         resource_group_name=rg.name,
         location=rg.location,
         locations=[{"location_name": rg.location, "failover_priority": 0}],
-        kind=azure_native.documentdb.DatabaseAccountKind.GLOBAL_DOCUMENT_DB,
-        database_account_offer_type=azure_native.documentdb.DatabaseAccountOfferType.STANDARD,
+        kind=providers.documentdb.DatabaseAccountKind.GLOBAL_DOCUMENT_DB,
+        database_account_offer_type=providers.documentdb.DatabaseAccountOfferType.STANDARD,
         tags=tags,
     )
 
     # Network interface for vm001
-    nic = NetworkInterface(
+    nic = providers.network.NetworkInterface(
         names.NIC_COMMON_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -75,12 +78,12 @@ def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> DefinedRes
     )
 
     # SSH public key
-    # azure_native.compute.SshPublicKey(
+    # providers.compute.SshPublicKey(
 
     # )
 
     # Virtual machine
-    vm = VirtualMachine(
+    vm = providers.compute.VirtualMachine(
         names.VM_COMMON_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -101,10 +104,10 @@ def apply(rg: ResourceGroup, subnet: Subnet, tags: dict[str, str]) -> DefinedRes
                 "version": "latest",
             },
             "os_disk": {
-                "caching": azure_native.compute.CachingTypes.READ_WRITE,
-                "create_option": azure_native.compute.DiskCreateOptionTypes.FROM_IMAGE,
+                "caching": providers.compute.CachingTypes.READ_WRITE,
+                "create_option": providers.compute.DiskCreateOptionTypes.FROM_IMAGE,
                 "managed_disk": {
-                    "storage_account_type": azure_native.compute.StorageAccountTypes.PREMIUM_LRS,
+                    "storage_account_type": providers.compute.StorageAccountTypes.PREMIUM_LRS,
                 },
                 "name": names.VM_COMMON_DISK_NAME,
             },
@@ -1,7 +1,6 @@
 import pulumi
-from pulumi_azure_native.resources import ResourceGroup
 
-from azure_infra import bastion, common, names, network
+from azure_infra import bastion, common, names, network, providers
 
 # from bastion_app import bastion_management
 
@@ -14,7 +13,7 @@ def main():
         "agg": "common",
     }
     # Create resource group
-    rg = ResourceGroup(
+    rg = providers.resources.ResourceGroup(
         names.RG_COMMON_NAME,
         location=location,
         tags=tags,
@@ -27,7 +26,7 @@ def main():
     networks = network.apply(rg, tags)
 
     # Create bastion
-    rg_bastion = ResourceGroup(
+    rg_bastion = providers.resources.ResourceGroup(
         names.RG_BASTION_NAME,
         location=location,
         tags=tags,
@@ -1,10 +1,34 @@
-import pulumi_azure_native as azure_native
-from pulumi_azure_native.documentdb import DatabaseAccount
-from pulumi_azure_native.resources import ResourceGroup
-from pulumi_azure_native.storage import StorageAccount
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 import pulumi
 
+from azure_infra import providers
+
+if TYPE_CHECKING:
+    from pulumi_azure_native.documentdb import DatabaseAccount
+    from pulumi_azure_native.resources import ResourceGroup
+    from pulumi_azure_native.storage import StorageAccount
+
+
+# Invoke results are memoized per deployment, keyed by resource group and
+# account, since a key and its connection string each look the keys up.
+# The results are only ever exposed through secret outputs.
+@lru_cache(maxsize=None)
+def _list_storage_account_keys(resource_group_name: str, account_name: str):
+    return providers.storage.list_storage_account_keys(
+        account_name, resource_group_name=resource_group_name
+    )
+
+
+@lru_cache(maxsize=None)
+def _list_database_account_keys(resource_group_name: str, account_name: str):
+    return providers.documentdb.list_database_account_keys(
+        account_name, resource_group_name=resource_group_name
+    )
+
 
 def get_storage_primary_key(
     rg: ResourceGroup, storage: StorageAccount
@@ -25,19 +49,14 @@ def get_storage_primary_key(
     """
     return (
         pulumi.Output.all(rg.name, storage.name)
-        .apply(
-            lambda args: azure_native.storage.list_storage_account_keys(
-                args[1],
-                resource_group_name=args[0],
-            )
-        )
+        .apply(lambda args: _list_storage_account_keys(args[0], args[1]))
         .apply(lambda x: pulumi.Output.secret(x.keys[0].value))
     )
 
 
 def get_storage_connection_string(
     rg: ResourceGroup,
-    storage: azure_native.storage.StorageAccount,
+    storage: StorageAccount,
 ) -> pulumi.Output[str]:
     """Get a connection string for a storage account.
 
@@ -79,12 +98,7 @@ def get_documentdb_primary_key(
     """
     return (
         pulumi.Output.all(cosmosdb.name, rg.name, cosmosdb)
-        .apply(
-            lambda args: azure_native.documentdb.list_database_account_keys(
-                args[0],
-                resource_group_name=args[1],
-            )
-        )
+        .apply(lambda args: _list_database_account_keys(args[1], args[0]))
         .apply(lambda x: pulumi.Output.secret(x.primary_master_key))
     )
 
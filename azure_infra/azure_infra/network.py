@@ -1,11 +1,18 @@
-from typing import TypedDict
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, TypedDict
 
 import pulumi
-from pulumi_azure_native import network
-from pulumi_azure_native.network import NetworkSecurityGroup, Subnet, VirtualNetwork
-from pulumi_azure_native.resources import ResourceGroup
 
-from azure_infra import names
+from azure_infra import names, providers
+
+if TYPE_CHECKING:
+    from pulumi_azure_native.network import (
+        NetworkSecurityGroup,
+        Subnet,
+        VirtualNetwork,
+    )
+    from pulumi_azure_native.resources import ResourceGroup
 
 
 class DefinedNetworks(TypedDict):
@@ -20,7 +27,8 @@ class DefinedNsgs(TypedDict):
 
 
 def apply(rg: ResourceGroup, tags: dict[str, str]) -> DefinedNetworks:
-    root = VirtualNetwork(
+    network = providers.network
+    root = network.VirtualNetwork(
         names.VNET_COMMON_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -30,14 +38,14 @@ def apply(rg: ResourceGroup, tags: dict[str, str]) -> DefinedNetworks:
 
     nsgs = apply_nsgs(rg)
 
-    subnet_vm = Subnet(
+    subnet_vm = network.Subnet(
         names.SUBNET_COMMON_VM_NAME,
         resource_group_name=rg.name,
         address_prefix="10.0.1.0/28",
         network_security_group={"id": nsgs["common_vm"].id},
         virtual_network_name=root.name,
     )
-    subnet_bastion = Subnet(
+    subnet_bastion = network.Subnet(
         names.SUBNET_BASTION_NAME,
         resource_group_name=rg.name,
         address_prefix="10.0.2.0/25",
@@ -58,7 +66,8 @@ def apply(rg: ResourceGroup, tags: dict[str, str]) -> DefinedNetworks:
 
 
 def apply_nsgs(rg: ResourceGroup) -> DefinedNsgs:
-    nsg_bastion = NetworkSecurityGroup(
+    network = providers.network
+    nsg_bastion = network.NetworkSecurityGroup(
         names.NSG_BASTION_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -157,7 +166,7 @@ def apply_nsgs(rg: ResourceGroup) -> DefinedNsgs:
         ],
     )
 
-    nsg_common_vm = NetworkSecurityGroup(
+    nsg_common_vm = network.NetworkSecurityGroup(
         names.NSG_COMMON_VM_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -0,0 +1,70 @@
+"""Provider submodules of ``pulumi_azure_native``, imported on first use.
+
+``pulumi_azure_native`` is very large, and importing it is a significant
+share of the start-up of every ``pulumi up``. Programs access the
+submodules they use as attributes of this module, e.g.
+``providers.network.BastionHost``, so that only those are imported, when
+they are first needed. The time each import took is kept for the import
+report, logged when ``PULUMI_IMPORT_REPORT`` is set.
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+import sys
+import time
+from types import ModuleType
+
+import pulumi
+
+PACKAGE = "pulumi_azure_native"
+SUBMODULES = (
+    "app",
+    "compute",
+    "documentdb",
+    "logic",
+    "network",
+    "resources",
+    "storage",
+    "web",
+)
+
+import_times: dict[str, float] = {}
+
+
+def _import(name: str) -> ModuleType:
+    module = sys.modules.get(name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        import_times[name] = time.perf_counter() - started
+    return module
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name not in SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Import the package first, so its own import time is reported apart
+    _import(PACKAGE)
+    module = _import(f"{PACKAGE}.{name}")
+    globals()[name] = module
+    return module
+
+
+def report() -> str:
+    """Import times of the provider modules, slowest first."""
+    lines = [
+        f"{seconds * 1000:8.1f} ms  {name}"
+        for name, seconds in sorted(
+            import_times.items(), key=lambda item: item[1], reverse=True
+        )
+    ]
+    total = sum(import_times.values())
+    return "\n".join(lines + [f"{total * 1000:8.1f} ms  total"])
+
+
+def log_report():
+    """Log the import report if ``PULUMI_IMPORT_REPORT`` is set."""
+    if os.getenv("PULUMI_IMPORT_REPORT", "").lower() in ("1", "true"):
+        pulumi.log.info(f"Provider import times:\n{report()}")
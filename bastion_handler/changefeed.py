@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Callable, Optional, Union
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+
+from bastion_handler.telemetry import phase
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient, BlobLeaseClient, ContainerClient
+
+logger = getLogger(__name__)
+
+
+def feed_range_key(feed_range: dict[str, Any]) -> str:
+    """Stable name of a feed range, for its lease."""
+    encoded = json.dumps(feed_range, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def covers(outer: dict[str, Any], inner: dict[str, Any]) -> bool:
+    """Whether the feed range ``outer`` contains ``inner``, e.g. its parent."""
+    outer, inner = outer["Range"], inner["Range"]
+    return outer["min"] <= inner["min"] and inner["max"] <= outer["max"]
+
+
+@dataclass
+class FeedLease:
+    """Lease on a feed range, holding its last checkpointed continuation token."""
+
+    blob: BlobClient
+    lease: BlobLeaseClient
+    token: Optional[str]
+    feed_range: Optional[dict[str, Any]] = None
+
+    def checkpoint(self, token: str):
+        # The range is kept so that its children can resume from it after a split
+        metadata = {"range": json.dumps(self.feed_range)} if self.feed_range else None
+        self.blob.upload_blob(
+            token, overwrite=True, lease=self.lease, metadata=metadata
+        )
+        self.token = token
+
+    def renew(self):
+        self.lease.renew()
+
+    def release(self):
+        self.lease.release()
+
+
+class BlobLeaseStore:
+    """Feed range leases and checkpoints in ``<prefix>/<range>.lease`` blobs.
+
+    A feed range is processed by whoever holds the lease on its blob, so
+    several function instances never process the same range at once, and
+    the blob's content is the continuation token to resume from.
+
+    Parameters
+    ----------
+    container : ContainerClient
+        Blob container of the leases.
+    prefix : str, optional
+        Prefix of the lease blobs, by default "change-feed"
+    lease_duration : int, optional
+        Lease duration in seconds (15-60), renewed while processing, by default 60
+    """
+
+    def __init__(
+        self,
+        container: ContainerClient,
+        prefix: str = "change-feed",
+        lease_duration: int = 60,
+    ):
+        self.container = container
+        self.prefix = prefix
+        self.lease_duration = lease_duration
+        self._created = False
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, key: str, feed_range: Optional[dict[str, Any]] = None
+    ) -> Optional[FeedLease]:
+        """Lease of the feed range ``key``, or None if another owner holds it."""
+        blob = self.container.get_blob_client(f"{self.prefix}/{key}.lease")
+        with self._lock:
+            self._ensure_container()
+        try:
+            blob.upload_blob(b"", overwrite=False)
+        except HttpResponseError as e:
+            # Already created, possibly leased by another owner
+            if e.status_code not in (409, 412):
+                raise
+        try:
+            lease = blob.acquire_lease(lease_duration=self.lease_duration)
+        except HttpResponseError as e:
+            if e.status_code == 409:
+                return None
+            raise
+        token = blob.download_blob().readall().decode() or None
+        return FeedLease(blob, lease, token, feed_range)
+
+    def last_checkpoint(self, feed_range: dict[str, Any]) -> Optional[datetime]:
+        """Time of the last checkpoint of another range covering ``feed_range``.
+
+        A range without a checkpoint of its own, like a child range after a
+        split, resumes from the last checkpoint of its parent.
+        """
+        times = [
+            blob.last_modified
+            for blob in self.container.list_blobs(
+                name_starts_with=f"{self.prefix}/", include=["metadata"]
+            )
+            if (blob.metadata or {}).get("range")
+            and json.loads(blob.metadata["range"]) != feed_range
+            and covers(json.loads(blob.metadata["range"]), feed_range)
+        ]
+        return max(times, default=None)
+
+    def _ensure_container(self):
+        if self._created:
+            return
+        try:
+            self.container.create_container()
+        except ResourceExistsError:
+            pass
+        self._created = True
+
+
+class ChangeFeedProcessor:
+    """Pull-model processor of a container's change feed.
+
+    Each feed range of the container is read on its own thread, from its own
+    container client since the continuation token of a read is taken from
+    the client's last response. The clients are created once per range and
+    kept for the lifetime of the processor; those of ranges gone after a
+    split are dropped. Changes are handed to ``handler`` in batches
+    of at most ``max_items``. A partial batch is held for up to ``max_wait``
+    seconds for more changes to arrive. The continuation token is
+    checkpointed in the range's lease once the handler returns, so a failed
+    batch is read again on the next run.
+
+    Parameters
+    ----------
+    container_factory : Callable[[], Any]
+        Creates a cosmos ``ContainerProxy`` of the monitored container, with a
+        connection of its own.
+    leases : BlobLeaseStore
+        Store of the feed range leases.
+    handler : Callable[[list[dict]], Any]
+        Processes a batch of changed documents.
+    max_items : int, optional
+        Maximum number of documents in a batch, by default 100
+    max_wait : float, optional
+        Seconds to hold a partial batch for more changes, by default 0
+    max_workers : int, optional
+        Maximum number of feed ranges read in parallel, by default 4
+    start_time : Union[str, Any], optional
+        Where to start reading ranges without a checkpoint of their own or of
+        a parent range, "Beginning", "Now" or a datetime, by default "Now"
+    poll_interval : float, optional
+        Seconds between reads while holding a partial batch, by default 1
+    """
+
+    def __init__(
+        self,
+        container_factory: Callable[[], Any],
+        leases: BlobLeaseStore,
+        handler: Callable[[list[dict]], Any],
+        max_items: int = 100,
+        max_wait: float = 0.0,
+        max_workers: int = 4,
+        start_time: Union[str, Any] = "Now",
+        poll_interval: float = 1.0,
+    ):
+        self.container_factory = container_factory
+        self.leases = leases
+        self.handler = handler
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self.max_workers = max_workers
+        self.start_time = start_time
+        self.poll_interval = poll_interval
+        self._container: Any = None
+        self._range_containers: dict[str, Any] = {}
+
+    def run_once(self, max_duration: Optional[float] = None) -> int:
+        """Process the pending changes of every feed range not leased elsewhere.
+
+        Ranges are read until they are caught up, or until ``max_duration``
+        seconds have passed, after which the batches in progress are handed
+        over and checkpointed.
+
+        Returns
+        -------
+        int
+            Number of documents processed.
+        """
+        deadline = None if max_duration is None else time.monotonic() + max_duration
+        if self._container is None:
+            self._container = self.container_factory()
+        feed_ranges = list(self._container.read_feed_ranges())
+        keys = {feed_range_key(fr) for fr in feed_ranges}
+        for key in set(self._range_containers) - keys:
+            del self._range_containers[key]
+        for key in keys - set(self._range_containers):
+            self._range_containers[key] = self.container_factory()
+        with ThreadPoolExecutor(
+            max_workers=max(min(self.max_workers, len(feed_ranges)), 1)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, self._process, fr, deadline
+                )
+                for fr in feed_ranges
+            ]
+        return sum(future.result() for future in futures)
+
+    def _process(self, feed_range: dict[str, Any], deadline: Optional[float]) -> int:
+        key = feed_range_key(feed_range)
+        lease = self.leases.acquire(key, feed_range)
+        if lease is None:
+            logger.info(f"Feed range {key} is leased by another owner")
+            return 0
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(lease, stop), daemon=True)
+        renewer.start()
+        try:
+            with phase("change_feed.range", feed_range=key) as span:
+                processed = self._drain(feed_range, lease, deadline)
+                span.set_attribute("processed", processed)
+                return processed
+        finally:
+            stop.set()
+            renewer.join()
+            lease.release()
+
+    def _drain(
+        self, feed_range: dict[str, Any], lease: FeedLease, deadline: Optional[float]
+    ) -> int:
+        container = self._range_containers[feed_range_key(feed_range)]
+        token = lease.token
+        start_time = self.start_time
+        if token is None:
+            start_time = self.leases.last_checkpoint(feed_range) or start_time
+        batch: list[dict] = []
+        batch_started = 0.0
+        processed = 0
+        while True:
+            items = self._read(
+                container, feed_range, token, start_time, self.max_items - len(batch)
+            )
+            token = (
+                container.client_connection.last_response_headers.get("etag") or token
+            )
+            now = time.monotonic()
+            if items:
+                if not batch:
+                    batch_started = now
+                batch.extend(items)
+            expired = deadline is not None and now >= deadline
+            if batch and (
+                len(batch) >= self.max_items
+                or now - batch_started >= self.max_wait
+                or expired
+            ):
+                self.handler(batch)
+                lease.checkpoint(token)
+                processed += len(batch)
+                batch = []
+            elif not items and token and token != lease.token and not batch:
+                # Nothing new, but keep the position of a fresh range
+                lease.checkpoint(token)
+            if expired or (not items and not batch):
+                return processed
+            if not items:
+                time.sleep(
+                    min(self.poll_interval, self.max_wait - (now - batch_started))
+                )
+
+    def _read(
+        self,
+        container: Any,
+        feed_range: dict[str, Any],
+        token: Optional[str],
+        start_time: Union[str, Any],
+        max_items: int,
+    ) -> list[dict]:
+        if token:
+            options: dict[str, Any] = dict(continuation=token)
+        else:
+            options = dict(feed_range=feed_range, start_time=start_time)
+        pages = container.query_items_change_feed(
+            max_item_count=max_items, **options
+        ).by_page()
+        try:
+            return list(next(pages))
+        except StopIteration:
+            return []
+
+    def _renew(self, lease: FeedLease, stop: threading.Event):
+        while not stop.wait(self.leases.lease_duration / 2):
+            try:
+                lease.renew()
+            except HttpResponseError as e:
+                logger.warning(f"Failed to renew a feed range lease: {e}")
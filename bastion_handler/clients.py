@@ -0,0 +1,70 @@
+import threading
+import time
+from logging import getLogger
+from typing import Any, Callable, Iterable, Optional
+
+from bastion_handler.telemetry import phase
+
+logger = getLogger(__name__)
+
+
+class ClientRegistry:
+    """Registry of lazily initialised clients.
+
+    Each client is created by its factory on first use and cached for the life
+    of the worker. Factories may depend on other clients of the registry.
+    """
+
+    def __init__(self):
+        self._factories: dict[str, Callable[[], Any]] = {}
+        self._clients: dict[str, Any] = {}
+        self._timings: dict[str, float] = {}
+        self._nested: list[float] = []
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """Register a factory creating the client ``name``."""
+        with self._lock:
+            self._factories[name] = factory
+            self._clients.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """Get the client ``name``, creating it on first use."""
+        try:
+            return self._clients[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._clients:
+                # Time spent creating dependencies is accounted to them only
+                self._nested.append(0.0)
+                started = time.perf_counter()
+                try:
+                    with phase("client.init", client=name):
+                        client = self._factories[name]()
+                finally:
+                    elapsed = time.perf_counter() - started
+                    dependencies = self._nested.pop()
+                    if self._nested:
+                        self._nested[-1] += elapsed
+                self._timings[name] = elapsed - dependencies
+                self._clients[name] = client
+                logger.info(f"Initialised client {name} in {self._timings[name]:.3f}s")
+            return self._clients[name]
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> dict[str, float]:
+        """Create the given clients (all by default) ahead of their first use.
+
+        Returns
+        -------
+        dict[str, float]
+            Initialisation time of each client in seconds.
+        """
+        for name in list(names if names is not None else self._factories):
+            self.get(name)
+        return self.timings
+
+    @property
+    def timings(self) -> dict[str, float]:
+        """Initialisation time in seconds of each created client."""
+        return dict(self._timings)
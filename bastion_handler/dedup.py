@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from logging import getLogger
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Union
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+
+from bastion_handler.schedule import is_reservation
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient
+
+logger = getLogger(__name__)
+
+Version = Union[int, str]
+
+
+def document_version(record: dict) -> Optional[Version]:
+    """Version of a change-feed document: its ``_lsn``, or else its ``_etag``."""
+    if isinstance(record.get("_lsn"), int):
+        return record["_lsn"]
+    return record.get("_etag")
+
+
+class ChangeFeedDeduplicator:
+    """Filters change-feed documents that were already processed.
+
+    The trigger redelivers a batch when an invocation fails, and the same
+    version of a document can arrive again. The last processed version of
+    each document is kept in a bounded LRU cache, and a delivery that is not
+    newer is dropped. Documents which are not reservations, like the state
+    documents the trigger writes itself, are dropped without being cached.
+    Documents deleted by the trigger itself, like expired reservations, are
+    remembered with the time of the deletion, so that a late delivery of
+    them does not bring them back.
+
+    The cache can be persisted to a blob, read once per worker. Writes are
+    conditional on the blob's ETag: when another instance wrote it in the
+    meantime, its entries are merged into this cache and the write is
+    retried, so that instances add to the cache instead of erasing each
+    other's entries. Entries other instances write later are only seen at
+    the next write of this one.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        Number of documents and deletions to remember, by default 10000
+    blob : Optional[BlobClient], optional
+        Blob to persist the cache to, so that it survives worker restarts and
+        is shared between instances, by default kept in memory only
+    flush_interval : float, optional
+        Minimum seconds between writes of the blob, by default 0, writing it
+        on every change. Changes made in between are written with the next
+        one after the interval, and lost if the worker stops before.
+    clock : Callable[[], float], optional
+        Monotonic clock, by default time.monotonic
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        blob: Optional[BlobClient] = None,
+        flush_interval: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.blob = blob
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._seen: OrderedDict[str, Version] = OrderedDict()
+        self._deleted: OrderedDict[str, float] = OrderedDict()
+        self._etag: Optional[str] = None
+        self._flushed: Optional[float] = None
+        self._loaded = blob is None
+        self._lock = threading.Lock()
+
+    def fresh(self, records: Iterable[dict]) -> list[dict]:
+        """Reservation records of a batch that were not processed before.
+
+        Records without an id or a version are always fresh.
+        """
+        with self._lock:
+            self._load()
+            fresh = [
+                record
+                for record in records
+                if is_reservation(record) and self._is_fresh(record)
+            ]
+        return fresh
+
+    def remember(self, records: Iterable[dict]):
+        """Remember the versions of processed records."""
+        with self._lock:
+            self._load()
+            for record in records:
+                version = document_version(record)
+                if "id" in record and version is not None:
+                    self._put(self._seen, record["id"], version)
+            self._save()
+
+    def mark_deleted(self, ids: Iterable[str], at: datetime):
+        """Remember documents deleted by the trigger at ``at``."""
+        with self._lock:
+            self._load()
+            for document_id in ids:
+                self._put(self._deleted, document_id, at.timestamp())
+            self._save()
+
+    def _is_fresh(self, record: dict) -> bool:
+        document_id = record.get("id")
+        version = document_version(record)
+        if document_id is None or version is None:
+            return True
+        seen = self._seen.get(document_id)
+        if seen is not None:
+            self._seen.move_to_end(document_id)
+            if seen == version or (
+                isinstance(seen, int) and isinstance(version, int) and version < seen
+            ):
+                return False
+        deleted = self._deleted.get(document_id)
+        if deleted is not None and record.get("_ts", 0) <= deleted:
+            return False
+        return True
+
+    def _put(self, cache: OrderedDict, key: str, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._seen, self._deleted = self._download()
+        self._loaded = True
+
+    def _download(self) -> tuple[OrderedDict, OrderedDict]:
+        assert self.blob is not None
+        try:
+            download = self.blob.download_blob()
+        except ResourceNotFoundError:
+            self._etag = None
+            return OrderedDict(), OrderedDict()
+        data = json.loads(download.readall())
+        self._etag = download.properties.etag
+        return OrderedDict(data.get("seen", [])), OrderedDict(data.get("deleted", []))
+
+    def _save(self):
+        if self.blob is None:
+            return
+        now = self.clock()
+        if self._flushed is not None and now - self._flushed < self.flush_interval:
+            return
+        while True:
+            data = json.dumps(
+                {
+                    "seen": list(self._seen.items()),
+                    "deleted": list(self._deleted.items()),
+                }
+            )
+            try:
+                if self._etag is None:
+                    result = self.blob.upload_blob(data, overwrite=False)
+                else:
+                    result = self.blob.upload_blob(
+                        data,
+                        overwrite=True,
+                        etag=self._etag,
+                        match_condition=MatchConditions.IfNotModified,
+                    )
+            except (ResourceExistsError, ResourceModifiedError):
+                # Written by another instance, merge its entries and retry
+                self._merge(*self._download())
+                continue
+            self._etag = result["etag"]
+            self._flushed = now
+            return
+
+    def _merge(self, seen: OrderedDict, deleted: OrderedDict):
+        """Merge entries of another instance, this instance's being more recent."""
+        for cache, theirs in ((self._seen, seen), (self._deleted, deleted)):
+            merged = OrderedDict(theirs)
+            for key, value in cache.items():
+                other = merged.pop(key, None)
+                if isinstance(value, (int, float)) and isinstance(other, (int, float)):
+                    value = max(value, other)
+                merged[key] = value
+            while len(merged) > self.max_size:
+                merged.popitem(last=False)
+            cache.clear()
+            cache.update(merged)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import os
+import signal
+import threading
+import time
+import uuid
+from logging import getLogger
+from typing import TYPE_CHECKING, Callable, Optional
+
+from bastion_handler.telemetry import meter
+
+if TYPE_CHECKING:
+    from pulumi.automation import events
+
+logger = getLogger(__name__)
+
+# Environment variable marking the CLI processes of a workspace
+RUN_MARKER = "BASTION_PULUMI_RUN"
+
+step_duration = meter.create_histogram(
+    "bastion.provisioning.step.duration",
+    unit="s",
+    description="Duration of the resource steps of pulumi runs",
+)
+
+
+class CommandCanceller:
+    """Cancels the pulumi CLI processes of one workspace.
+
+    The workspace runs the stock :class:`pulumi.automation.PulumiCommand`
+    with :attr:`env` added to the environment of its CLI processes, so that
+    they can be told apart from the processes of other workspaces among the
+    children of this process. They are found through ``/proc``, and so can
+    only be cancelled on Linux.
+    """
+
+    def __init__(self):
+        self._marker = f"{RUN_MARKER}={uuid.uuid4().hex}".encode()
+
+    @property
+    def env(self) -> dict[str, str]:
+        """Environment variables marking the CLI processes of the workspace."""
+        name, _, value = self._marker.decode().partition("=")
+        return {name: value}
+
+    def processes(self) -> list[int]:
+        """Ids of the running CLI processes of the workspace."""
+        try:
+            entries = os.listdir("/proc")
+        except FileNotFoundError:
+            logger.warning("Cannot find the pulumi processes without /proc")
+            return []
+        parent = os.getpid()
+        pids = []
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name in parentheses may contain spaces
+                    state, ppid = f.read().rpartition(")")[2].split()[:2]
+                if int(ppid) != parent or state == "Z":
+                    continue
+                with open(f"/proc/{entry}/environ", "rb") as f:
+                    environ = f.read().split(b"\0")
+            except OSError:
+                # Exited in the meantime
+                continue
+            if self._marker in environ:
+                pids.append(int(entry))
+        return pids
+
+    def cancel(self, grace: float = 10.0):
+        """Interrupt the running commands, and kill those still running after ``grace``.
+
+        Pulumi handles the interrupt by finishing the steps in flight and
+        releasing the stack lock, which a kill would leave behind.
+        """
+        pids = self.processes()
+        self._signal(pids, signal.SIGINT)
+        deadline = time.monotonic() + grace
+        while pids and time.monotonic() < deadline:
+            time.sleep(0.1)
+            pids = [pid for pid in self.processes() if pid in pids]
+        if pids:
+            logger.warning(f"pulumi did not stop within {grace}s, killing it")
+            self._signal(pids, signal.SIGKILL)
+
+    def _signal(self, pids: list[int], signum: int):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+class RunMonitor:
+    """Consumes the engine events of a pulumi run and enforces its deadlines.
+
+    Resource steps are logged and their durations recorded as they complete.
+    The run is aborted through ``abort`` on the first error diagnostic, when
+    a step takes longer than ``step_timeout`` or when the run takes longer
+    than ``timeout``.
+
+    Parameters
+    ----------
+    abort : Callable[[], None]
+        Cancels the run.
+    operation : str
+        Operation of the run, for the logs and metrics.
+    timeout : Optional[float], optional
+        Deadline of the whole run in seconds, by default none
+    step_timeout : Optional[float], optional
+        Deadline of each resource step in seconds, by default none
+    clock : Callable[[], float], optional
+        Monotonic clock, by default time.monotonic
+    """
+
+    def __init__(
+        self,
+        abort: Callable[[], None],
+        operation: str,
+        timeout: Optional[float] = None,
+        step_timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.abort = abort
+        self.operation = operation
+        self.timeout = timeout
+        self.step_timeout = step_timeout
+        self.clock = clock
+        self.started = clock()
+        self.reason: Optional[str] = None
+        self.completed = 0
+        self._steps: dict[str, tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "RunMonitor":
+        if self.timeout is not None or self.step_timeout is not None:
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    @property
+    def aborted(self) -> bool:
+        return self.reason is not None
+
+    def on_event(self, event: events.EngineEvent):
+        """Handle an engine event of the run."""
+        now = self.clock()
+        if event.resource_pre_event is not None:
+            metadata = event.resource_pre_event.metadata
+            if metadata.op.value != "same":
+                with self._lock:
+                    self._steps[metadata.urn] = (metadata.op.value, now)
+                logger.info(f"pulumi {metadata.op.value} {metadata.urn} started")
+        elif event.res_outputs_event is not None:
+            self._finish(event.res_outputs_event.metadata.urn, now, "succeeded")
+        elif event.diagnostic_event is not None:
+            diagnostic = event.diagnostic_event
+            if diagnostic.severity == "error":
+                if diagnostic.urn:
+                    self._finish(diagnostic.urn, now, "failed")
+                self._abort(f"error diagnostic: {diagnostic.message.strip()}")
+
+    def _finish(self, urn: str, now: float, outcome: str):
+        with self._lock:
+            step = self._steps.pop(urn, None)
+        if step is None:
+            return
+        op, started = step
+        self.completed += 1
+        step_duration.record(
+            now - started,
+            attributes={"operation": self.operation, "op": op, "outcome": outcome},
+        )
+        logger.info(f"pulumi {op} {urn} {outcome} in {now - started:.1f}s")
+
+    def _watch(self):
+        while not self._done.wait(1.0):
+            now = self.clock()
+            if self.timeout is not None and now - self.started > self.timeout:
+                self._abort(f"run exceeded {self.timeout}s")
+                return
+            if self.step_timeout is not None:
+                with self._lock:
+                    stuck = [
+                        urn
+                        for urn, (_, started) in self._steps.items()
+                        if now - started > self.step_timeout
+                    ]
+                if stuck:
+                    self._abort(f"step {stuck[0]} exceeded {self.step_timeout}s")
+                    return
+
+    def _abort(self, reason: str):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        logger.error(f"Aborting pulumi {self.operation}: {reason}")
+        threading.Thread(target=self.abort, daemon=True).start()
@@ -0,0 +1,161 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Any, Iterable
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+from bastion_handler.schedule import Reservation
+
+logger = getLogger(__name__)
+
+# Maximum number of operations in a cosmos db transactional batch
+MAX_BATCH_OPERATIONS = 100
+
+
+@dataclass
+class ExpiryReport:
+    """Outcome of a bulk deletion of expired reservations."""
+
+    deleted: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+
+    def merge(self, other: "ExpiryReport"):
+        self.deleted.extend(other.deleted)
+        self.failed.update(other.failed)
+
+
+def group_by_partition(
+    reservations: Iterable[Reservation],
+) -> dict[str, list[str]]:
+    """Group reservation ids by their partition key (``/title``)."""
+    groups: dict[str, list[str]] = {}
+    for reservation in reservations:
+        groups.setdefault(reservation.title, []).append(reservation.id)
+    return groups
+
+
+def delete_expired(
+    container: Any,
+    reservations: Iterable[Reservation],
+    max_workers: int = 4,
+) -> ExpiryReport:
+    """Delete expired reservations with transactional batches per partition.
+
+    Batches run concurrently on at most ``max_workers`` threads. A failed batch
+    is retried item by item so that one bad record does not keep the others,
+    and failures are reported instead of raised.
+
+    Parameters
+    ----------
+    container : ContainerProxy
+        Cosmos container of the reservations.
+    reservations : Iterable[Reservation]
+        Expired reservations.
+    max_workers : int, optional
+        Maximum number of concurrent batches, by default 4
+
+    Returns
+    -------
+    ExpiryReport
+        Deleted ids and the error of each id that could not be deleted.
+    """
+    batches = _split_batches(reservations)
+    report = ExpiryReport()
+    if not batches:
+        return report
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        for result in executor.map(
+            lambda batch: _delete_batch(container, *batch), batches
+        ):
+            report.merge(result)
+    if report.failed:
+        logger.warning(f"Failed to delete expired reservations: {report.failed}")
+    return report
+
+
+async def delete_expired_async(
+    container: Any,
+    reservations: Iterable[Reservation],
+    max_concurrency: int = 4,
+) -> ExpiryReport:
+    """Asynchronous variant of :func:`delete_expired`.
+
+    ``container`` is an ``azure.cosmos.aio`` container client, and at most
+    ``max_concurrency`` batches are in flight at once.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(partition_key: str, ids: list[str]) -> ExpiryReport:
+        async with semaphore:
+            return await _delete_batch_async(container, partition_key, ids)
+
+    report = ExpiryReport()
+    for result in await asyncio.gather(
+        *(run(*batch) for batch in _split_batches(reservations))
+    ):
+        report.merge(result)
+    if report.failed:
+        logger.warning(f"Failed to delete expired reservations: {report.failed}")
+    return report
+
+
+def _split_batches(
+    reservations: Iterable[Reservation],
+) -> list[tuple[str, list[str]]]:
+    return [
+        (partition_key, ids[i : i + MAX_BATCH_OPERATIONS])
+        for partition_key, ids in group_by_partition(reservations).items()
+        for i in range(0, len(ids), MAX_BATCH_OPERATIONS)
+    ]
+
+
+def _batch_operations(ids: list[str]) -> list[tuple[str, tuple[str]]]:
+    return [("delete", (item_id,)) for item_id in ids]
+
+
+def _delete_batch(container: Any, partition_key: str, ids: list[str]) -> ExpiryReport:
+    try:
+        container.execute_item_batch(
+            _batch_operations(ids), partition_key=partition_key
+        )
+        return ExpiryReport(deleted=list(ids))
+    except HttpResponseError as e:
+        logger.info(f"Batch delete in partition {partition_key} failed: {e}")
+
+    # The batch was rolled back, so delete its items one by one
+    report = ExpiryReport()
+    for item_id in ids:
+        try:
+            container.delete_item(item_id, partition_key)
+            report.deleted.append(item_id)
+        except ResourceNotFoundError:
+            report.deleted.append(item_id)
+        except HttpResponseError as e:
+            report.failed[item_id] = str(e)
+    return report
+
+
+async def _delete_batch_async(
+    container: Any, partition_key: str, ids: list[str]
+) -> ExpiryReport:
+    try:
+        await container.execute_item_batch(
+            _batch_operations(ids), partition_key=partition_key
+        )
+        return ExpiryReport(deleted=list(ids))
+    except HttpResponseError as e:
+        logger.info(f"Batch delete in partition {partition_key} failed: {e}")
+
+    # The batch was rolled back, so delete its items one by one
+    report = ExpiryReport()
+    for item_id in ids:
+        try:
+            await container.delete_item(item_id, partition_key)
+            report.deleted.append(item_id)
+        except ResourceNotFoundError:
+            report.deleted.append(item_id)
+        except HttpResponseError as e:
+            report.failed[item_id] = str(e)
+    return report
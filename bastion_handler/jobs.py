@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import json
+import threading
+import uuid
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Callable, Literal, Optional, Sequence
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+from bastion_handler.schedule import parse_timestamp, utcnow
+
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+    from azure.storage.queue import QueueClient
+
+    from bastion_handler.lock import SingleFlight
+
+logger = getLogger(__name__)
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+
+class VerificationError(RuntimeError):
+    """Raised by a step whose outcome is not observed yet, to retry the job."""
+
+
+class JobDeferred(RuntimeError):
+    """Raised by a step waiting on a run outside the job.
+
+    The job is run again after the retry delay, without counting an attempt.
+    """
+
+
+# A job step returns the fields to merge into the job's result
+Step = tuple[str, Callable[[], Optional[dict[str, Any]]]]
+
+
+@dataclass(frozen=True)
+class Job:
+    """Provisioning job of a target, checkpointed after each completed step."""
+
+    id: str
+    target: str
+    state: str
+    status: JobStatus
+    created: datetime
+    updated: datetime
+    attempts: int = 0
+    completed: tuple[str, ...] = ()
+    result: Optional[dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["created"] = self.created.isoformat()
+        data["updated"] = self.updated.isoformat()
+        data["completed"] = list(self.completed)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        data = dict(data)
+        data["created"] = parse_timestamp(data["created"])
+        data["updated"] = parse_timestamp(data["updated"])
+        data["completed"] = tuple(data.get("completed") or ())
+        return cls(**data)
+
+
+def new_job_id(now: datetime) -> str:
+    """Job id sorting by creation time."""
+    return f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+class JobStore:
+    """Provisioning jobs stored as ``<id>.json`` blobs.
+
+    Parameters
+    ----------
+    container : ContainerClient
+        Blob container of the jobs.
+    """
+
+    def __init__(self, container: ContainerClient):
+        self.container = container
+        self._created = False
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        try:
+            content = self._blob(job_id).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+        return Job.from_dict(json.loads(content))
+
+    def save(self, job: Job):
+        with self._lock:
+            self._ensure_container()
+        self._blob(job.id).upload_blob(json.dumps(job.to_dict()), overwrite=True)
+
+    def recent(self, limit: int = 10, target: Optional[str] = None) -> list[Job]:
+        """Latest jobs, newest first, optionally only those of ``target``."""
+        try:
+            names = sorted(
+                (blob.name for blob in self.container.list_blobs()), reverse=True
+            )
+        except ResourceNotFoundError:
+            return []
+        jobs = []
+        for name in names:
+            job = self.get(name.removesuffix(".json"))
+            if job is not None and (target is None or job.target == target):
+                jobs.append(job)
+                if len(jobs) == limit:
+                    break
+        return jobs
+
+    def _blob(self, job_id: str):
+        return self.container.get_blob_client(f"{job_id}.json")
+
+    def _ensure_container(self):
+        if self._created:
+            return
+        try:
+            self.container.create_container()
+        except ResourceExistsError:
+            pass
+        self._created = True
+
+
+class JobQueue:
+    """Enqueues provisioning jobs for the queue-triggered worker.
+
+    The job is saved as queued before its message is sent, so its status can
+    be read as soon as the id is returned.
+
+    Parameters
+    ----------
+    queue : QueueClient
+        Queue consumed by the provisioning worker.
+    store : JobStore
+        Store of the jobs.
+    """
+
+    def __init__(self, queue: QueueClient, store: JobStore):
+        self.queue = queue
+        self.store = store
+        self._created = False
+        self._lock = threading.Lock()
+
+    def enqueue(self, target: str, state: str) -> Job:
+        now = utcnow()
+        job = Job(
+            id=new_job_id(now),
+            target=target,
+            state=state,
+            status="queued",
+            created=now,
+            updated=now,
+        )
+        self.store.save(job)
+        with self._lock:
+            self._ensure_queue()
+        self.queue.send_message(json.dumps({"job": job.id}), time_to_live=-1)
+        logger.info(f"Enqueued {state} of {target} as job {job.id}")
+        return job
+
+    def requeue(self, job_id: str, delay: float):
+        """Send the message of a job again, visible after ``delay`` seconds."""
+        self.queue.send_message(
+            json.dumps({"job": job_id}),
+            visibility_timeout=int(delay),
+            time_to_live=-1,
+        )
+        logger.info(f"Requeued job {job_id} in {delay:.0f}s")
+
+    def _ensure_queue(self):
+        if self._created:
+            return
+        try:
+            self.queue.create_queue()
+        except ResourceExistsError:
+            pass
+        self._created = True
+
+
+class JobRunner:
+    """Runs the steps of a job, checkpointing it after each one.
+
+    A redelivered message resumes the job after its last completed step, and
+    the message of a finished job is acknowledged without running anything.
+    Exceptions of the ``fatal`` types fail the job; others leave it queued
+    and retry it until it has been attempted ``max_attempts`` times. With a
+    ``queue`` the job is requeued after an exponential backoff, otherwise the
+    exception is raised so that the queue redelivers the message.
+    :class:`JobDeferred` requeues the job without counting the attempt.
+
+    Parameters
+    ----------
+    store : JobStore
+        Store of the jobs.
+    fatal : tuple[type[BaseException], ...], optional
+        Exceptions failing the job without a retry, by default none
+    max_attempts : int, optional
+        Attempts before the job is failed, by default 5, the dequeue count of
+        the Functions host after which a message goes to the poison queue
+    queue : Optional[JobQueue], optional
+        Queue to requeue retried jobs to, by default None
+    retry_delay : float, optional
+        Seconds before the first retry, doubled by each attempt, and before
+        a deferred job runs again, by default 30
+    max_retry_delay : float, optional
+        Upper bound of the retry delay in seconds, by default 600
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        fatal: tuple[type[BaseException], ...] = (),
+        max_attempts: int = 5,
+        queue: Optional[JobQueue] = None,
+        retry_delay: float = 30.0,
+        max_retry_delay: float = 600.0,
+    ):
+        self.store = store
+        self.fatal = fatal
+        self.max_attempts = max_attempts
+        self.queue = queue
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+    def run(self, job_id: str, steps: Callable[[Job], Sequence[Step]]) -> Optional[Job]:
+        """Run the remaining steps of the job ``job_id``.
+
+        Returns
+        -------
+        Optional[Job]
+            The job as checkpointed last, or None if it does not exist.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            logger.warning(f"Job {job_id} does not exist")
+            return None
+        if job.done:
+            logger.info(f"Job {job_id} already {job.status}")
+            return job
+        job = self._checkpoint(
+            job, status="running", attempts=job.attempts + 1, error=None
+        )
+        try:
+            for name, step in steps(job):
+                if name in job.completed:
+                    continue
+                output = step()
+                job = self._checkpoint(
+                    job,
+                    completed=job.completed + (name,),
+                    result={**(job.result or {}), **(output or {})},
+                )
+        except self.fatal as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            return self._checkpoint(job, status="failed", error=str(e))
+        except JobDeferred as e:
+            logger.info(f"Job {job_id} deferred: {e}")
+            job = self._checkpoint(
+                job, status="queued", attempts=job.attempts - 1, error=str(e)
+            )
+            if self.queue is None:
+                raise
+            self.queue.requeue(job_id, self.retry_delay)
+            return job
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                logger.error(f"Job {job_id} failed after {job.attempts} attempts: {e}")
+                return self._checkpoint(job, status="failed", error=str(e))
+            job = self._checkpoint(job, status="queued", error=str(e))
+            if self.queue is None:
+                raise
+            self.queue.requeue(
+                job_id,
+                min(self.retry_delay * 2 ** (job.attempts - 1), self.max_retry_delay),
+            )
+            return job
+        return self._checkpoint(job, status="succeeded")
+
+    def _checkpoint(self, job: Job, **changes) -> Job:
+        job = replace(job, updated=utcnow(), **changes)
+        self.store.save(job)
+        return job
+
+
+def verify(
+    job: Job, flight: SingleFlight, exists: Callable[[], bool]
+) -> dict[str, Any]:
+    """Verify step of a job: whether the resource is in the job's state.
+
+    A job superseded by a later request of the other state is not verified,
+    and one whose request was merged into a run still in flight waits for it.
+
+    Raises
+    ------
+    JobDeferred
+        While a run reconciling the job's request is in flight.
+    VerificationError
+        If the resource is not in the job's state although no run is.
+    """
+    status = flight.status()
+    if status.desired.state != job.state:
+        logger.info(f"Job {job.id} superseded by {status.desired.state}")
+        return {"superseded": True}
+    if status.applied < status.desired.generation and status.in_flight:
+        raise JobDeferred(f"{job.target} is still reconciling")
+    found = exists()
+    if found != (job.state == "up"):
+        raise VerificationError(
+            f"{job.target} {'does not exist' if job.state == 'up' else 'still exists'} "
+            f"after {job.state}"
+        )
+    return {"exists": found}
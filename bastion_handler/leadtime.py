@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+from datetime import timedelta
+from logging import getLogger
+from typing import TYPE_CHECKING, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobClient
+
+logger = getLogger(__name__)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` for ``q`` in [0, 1]."""
+    ordered = sorted(values)
+    rank = max(math.ceil(q * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class LeadTimeEstimator:
+    """Lead time to start provisioning ahead of a reservation.
+
+    Durations of past successful provisioning runs are kept in a JSON blob.
+    Once ``min_samples`` runs are recorded, the lead time is a high percentile
+    of them with a safety margin; until then the configured default is used.
+
+    Parameters
+    ----------
+    blob : BlobClient
+        Blob holding the recent provisioning durations.
+    default : timedelta
+        Lead time used until enough durations are recorded.
+    learn : bool, optional
+        Whether to learn the lead time from the durations, by default True
+    window : int, optional
+        Number of recent durations to keep, by default 20
+    q : float, optional
+        Percentile of the durations to use, by default 0.9
+    margin : float, optional
+        Factor applied to the percentile, by default 1.2
+    min_samples : int, optional
+        Durations required before learning, by default 3
+    """
+
+    def __init__(
+        self,
+        blob: BlobClient,
+        default: timedelta,
+        learn: bool = True,
+        window: int = 20,
+        q: float = 0.9,
+        margin: float = 1.2,
+        min_samples: int = 3,
+    ):
+        self.blob = blob
+        self.default = default
+        self.learn = learn
+        self.window = window
+        self.q = q
+        self.margin = margin
+        self.min_samples = min_samples
+        self._durations: Optional[list[float]] = None
+        self._lock = threading.Lock()
+
+    def lead_time(self) -> timedelta:
+        """Current lead time."""
+        if not self.learn:
+            return self.default
+        durations = self.durations()
+        if len(durations) < self.min_samples:
+            return self.default
+        return timedelta(seconds=percentile(durations, self.q) * self.margin)
+
+    def record(self, seconds: float):
+        """Record the duration of a successful provisioning run."""
+        with self._lock:
+            durations = (self._read() + [seconds])[-self.window :]
+            self.blob.upload_blob(json.dumps(durations), overwrite=True)
+            self._durations = durations
+        logger.info(f"Recorded provisioning duration {seconds:.1f}s")
+
+    def durations(self) -> list[float]:
+        """Recent provisioning durations in seconds."""
+        with self._lock:
+            if self._durations is None:
+                self._durations = self._read()
+            return list(self._durations)
+
+    def _read(self) -> list[float]:
+        try:
+            return json.loads(self.blob.download_blob().readall())
+        except ResourceNotFoundError:
+            return []
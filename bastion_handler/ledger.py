@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import json
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import TYPE_CHECKING, Iterable, Literal, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+from bastion_handler.leadtime import percentile
+from bastion_handler.schedule import Reservation, parse_timestamp
+
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+
+logger = getLogger(__name__)
+
+EntryKind = Literal["up", "destroy", "reservation"]
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    """One line of the run ledger.
+
+    ``up`` and ``destroy`` entries record a provisioning decision, with the
+    outcome and duration of the pulumi run, or ``merged`` when the request was
+    merged into a run in flight. ``reservation`` entries record the window of
+    a reservation once it has expired.
+    """
+
+    kind: EntryKind
+    at: datetime
+    succeeded: Optional[bool] = None
+    duration: Optional[float] = None
+    merged: bool = False
+    reservation_id: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    @classmethod
+    def from_reservation(cls, reservation: Reservation, at: datetime) -> "LedgerEntry":
+        return cls(
+            kind="reservation",
+            at=at,
+            reservation_id=reservation.id,
+            start=reservation.start,
+            end=reservation.end,
+        )
+
+    def to_json(self) -> str:
+        data = {
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in asdict(self).items()
+            if value is not None and not (key == "merged" and not value)
+        }
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> "LedgerEntry":
+        data = json.loads(line)
+        for key in ("at", "start", "end"):
+            if key in data:
+                data[key] = parse_timestamp(data[key])
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class LedgerSummary:
+    """Provisioning latency, utilisation and cost derived from the ledger."""
+
+    provision_p50: Optional[float]
+    provision_p95: Optional[float]
+    deprovision_p50: Optional[float]
+    deprovision_p95: Optional[float]
+    runs: int
+    failed_runs: int
+    uptime_minutes: float
+    reserved_minutes: float
+    idle_minutes: float
+    reservations: int
+    cost: float
+    cost_per_reservation: Optional[float]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class RunLedger:
+    """Append-only ledger of provisioning runs in an append blob.
+
+    Each entry is a JSON line appended as one block, so concurrent writers
+    never overwrite each other.
+
+    Parameters
+    ----------
+    container : ContainerClient
+        Blob container of the ledger.
+    name : str
+        Name of the ledger, stored in the append blob ``<name>.ledger``.
+    """
+
+    def __init__(self, container: ContainerClient, name: str):
+        self.container = container
+        self.blob = container.get_blob_client(f"{name}.ledger")
+        self._created = False
+        self._lock = threading.Lock()
+
+    def append(self, entries: Iterable[LedgerEntry]):
+        """Append ``entries`` to the ledger."""
+        lines = "".join(f"{entry.to_json()}\n" for entry in entries)
+        if not lines:
+            return
+        with self._lock:
+            self._ensure_blob()
+        self.blob.append_block(lines.encode())
+
+    def entries(self, since: Optional[datetime] = None) -> list[LedgerEntry]:
+        """Entries of the ledger, optionally only those at or after ``since``."""
+        try:
+            content = self.blob.download_blob().readall().decode()
+        except ResourceNotFoundError:
+            return []
+        entries = [LedgerEntry.from_json(line) for line in content.splitlines() if line]
+        if since is not None:
+            entries = [entry for entry in entries if entry.at >= since]
+        return entries
+
+    def _ensure_blob(self):
+        if self._created:
+            return
+        try:
+            self.blob.create_append_blob(
+                etag="*", match_condition=MatchConditions.IfMissing
+            )
+        except ResourceNotFoundError:
+            # The container does not exist yet
+            self.container.create_container()
+            self.blob.create_append_blob()
+        except HttpResponseError as e:
+            # Already created by another invocation
+            if e.status_code not in (409, 412):
+                raise
+        self._created = True
+
+
+def uptime_intervals(
+    entries: Iterable[LedgerEntry], until: datetime
+) -> list[tuple[datetime, datetime]]:
+    """Intervals the target resource existed, from successful up to destroy runs.
+
+    A run's resource is billed from the start of the run, i.e. its entry time
+    minus its duration.
+    """
+    intervals = []
+    up_since: Optional[datetime] = None
+    for entry in sorted(entries, key=lambda e: e.at):
+        if entry.kind not in ("up", "destroy") or not entry.succeeded:
+            continue
+        started = entry.at - timedelta(seconds=entry.duration or 0)
+        if entry.kind == "up" and up_since is None:
+            up_since = started
+        elif entry.kind == "destroy" and up_since is not None:
+            intervals.append((up_since, entry.at))
+            up_since = None
+    if up_since is not None and up_since < until:
+        intervals.append((up_since, until))
+    return intervals
+
+
+def merge_intervals(
+    intervals: Iterable[tuple[datetime, datetime]],
+) -> list[tuple[datetime, datetime]]:
+    """Merge overlapping intervals into disjoint ones."""
+    merged: list[tuple[datetime, datetime]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def overlap_minutes(
+    a: list[tuple[datetime, datetime]], b: list[tuple[datetime, datetime]]
+) -> float:
+    """Minutes covered by both sets of disjoint, sorted intervals."""
+    total = timedelta(0)
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if start < end:
+            total += end - start
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total.total_seconds() / 60
+
+
+def summarize(
+    entries: list[LedgerEntry], until: datetime, hourly_cost: float
+) -> LedgerSummary:
+    """Summarise the ledger up to ``until``.
+
+    Parameters
+    ----------
+    entries : list[LedgerEntry]
+        Entries of the ledger.
+    until : datetime
+        End of the period, e.g. now.
+    hourly_cost : float
+        Cost of one hour of the target resource.
+
+    Returns
+    -------
+    LedgerSummary
+        Percentiles of the run durations in seconds, minutes the resource
+        existed, was reserved and sat idle, and the cost per reservation.
+    """
+    runs = [e for e in entries if e.kind in ("up", "destroy") and not e.merged]
+    durations = {
+        kind: [e.duration for e in runs if e.kind == kind and e.succeeded]
+        for kind in ("up", "destroy")
+    }
+    uptime = merge_intervals(uptime_intervals(entries, until))
+    reserved = merge_intervals(
+        (e.start, e.end)
+        for e in entries
+        if e.kind == "reservation" and e.start is not None and e.end is not None
+    )
+    uptime_minutes = sum((end - start).total_seconds() for start, end in uptime) / 60
+    reserved_minutes = overlap_minutes(uptime, reserved)
+    reservations = sum(1 for e in entries if e.kind == "reservation")
+    cost = uptime_minutes / 60 * hourly_cost
+    return LedgerSummary(
+        provision_p50=_percentile(durations["up"], 0.5),
+        provision_p95=_percentile(durations["up"], 0.95),
+        deprovision_p50=_percentile(durations["destroy"], 0.5),
+        deprovision_p95=_percentile(durations["destroy"], 0.95),
+        runs=len(runs),
+        failed_runs=sum(1 for e in runs if not e.succeeded),
+        uptime_minutes=uptime_minutes,
+        reserved_minutes=reserved_minutes,
+        idle_minutes=uptime_minutes - reserved_minutes,
+        reservations=reservations,
+        cost=cost,
+        cost_per_reservation=cost / reservations if reservations else None,
+    )
+
+
+def _percentile(values: list, q: float) -> Optional[float]:
+    return percentile(values, q) if values else None
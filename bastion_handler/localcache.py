@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+
+if TYPE_CHECKING:
+    from azure.storage.blob import ContainerClient
+
+logger = getLogger(__name__)
+
+# Optional checksum file on the share, lines of "<sha256>  <relative path>"
+CHECKSUM_FILE = "SHA256SUMS"
+MANIFEST_FILE = ".manifest.json"
+
+
+def sha256sum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DirectoryMirror:
+    """Worker-local mirror of a directory on a network share.
+
+    Files are copied only when their fingerprint changes. The fingerprint is
+    the checksum listed in the share's ``SHA256SUMS`` file when present, so
+    that unchanged files are never read; otherwise it is the size and
+    modification time. Copies are verified against the listed checksum.
+
+    Only the paths matching ``include`` are listed and copied, so the first
+    sync of a new worker reads just those files from the share, once; later
+    syncs only compare their fingerprints.
+
+    Parameters
+    ----------
+    source : Path
+        Directory on the share, e.g. the Azure Files mount.
+    target : Path
+        Local directory to mirror into.
+    include : Optional[list[str]], optional
+        Glob patterns, relative to ``source``, of the files and directories to
+        mirror, directories with all their files, by default everything
+    """
+
+    def __init__(self, source: Path, target: Path, include: Optional[list[str]] = None):
+        self.source = source
+        self.target = target
+        self.include = include
+
+    def sync(self) -> Path:
+        """Bring the mirror up to date and return its directory."""
+        if not self.source.is_dir():
+            logger.warning(f"{self.source} is not a directory, not mirroring it")
+            return self.source
+        checksums = self._read_checksums()
+        manifest_path = self.target / MANIFEST_FILE
+        try:
+            manifest: dict[str, str] = json.loads(manifest_path.read_text())
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+
+        current: dict[str, str] = {}
+        copied = 0
+        for path in self._files():
+            if path.name == CHECKSUM_FILE:
+                continue
+            relative = path.relative_to(self.source).as_posix()
+            if relative in checksums:
+                fingerprint = checksums[relative]
+            else:
+                stat = path.stat()
+                fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+            current[relative] = fingerprint
+            local = self.target / relative
+            if manifest.get(relative) == fingerprint and local.exists():
+                continue
+            self._copy(path, local, checksums.get(relative))
+            copied += 1
+
+        for relative in set(manifest) - set(current):
+            (self.target / relative).unlink(missing_ok=True)
+
+        self.target.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(current))
+        logger.info(f"Mirrored {self.source} to {self.target}: {copied} files copied")
+        return self.target
+
+    def _files(self) -> Iterator[Path]:
+        """Files of the share to mirror."""
+        if self.include is None:
+            matches = [self.source]
+        else:
+            matches = {
+                path for pattern in self.include for path in self.source.glob(pattern)
+            }
+        for match in sorted(matches):
+            if match.is_file():
+                yield match
+            elif match.is_dir():
+                yield from (path for path in match.rglob("*") if path.is_file())
+
+    def _copy(self, source: Path, local: Path, checksum: Optional[str]):
+        local.parent.mkdir(parents=True, exist_ok=True)
+        partial = local.with_name(f".{local.name}.partial")
+        shutil.copy2(source, partial)
+        if checksum is not None and sha256sum(partial) != checksum:
+            partial.unlink()
+            raise ValueError(f"Checksum mismatch for {source}")
+        os.replace(partial, local)
+
+    def _read_checksums(self) -> dict[str, str]:
+        try:
+            lines = (self.source / CHECKSUM_FILE).read_text().splitlines()
+        except FileNotFoundError:
+            return {}
+        checksums = {}
+        for line in lines:
+            checksum, _, relative = line.strip().partition("  ")
+            if relative:
+                checksums[relative.lstrip("*./")] = checksum
+        return checksums
+
+
+class BlobSnapshotCache:
+    """Worker-local copies of blobs, revalidated by ETag.
+
+    Parameters
+    ----------
+    container : ContainerClient
+        Container holding the blobs.
+    directory : Path
+        Local directory of the copies.
+    """
+
+    def __init__(self, container: ContainerClient, directory: Path):
+        self.container = container
+        self.directory = directory
+
+    def get(self, name: str) -> Optional[bytes]:
+        """Content of blob ``name``, downloaded only if it changed."""
+        local = self.directory / name
+        etag_path = local.with_name(f"{local.name}.etag")
+        etag = etag_path.read_text() if etag_path.exists() and local.exists() else None
+        kwargs = {}
+        if etag is not None:
+            kwargs = {"etag": etag, "match_condition": MatchConditions.IfModified}
+        try:
+            download = self.container.get_blob_client(name).download_blob(**kwargs)
+            data = download.readall()
+        except ResourceNotModifiedError:
+            return local.read_bytes()
+        except ResourceNotFoundError:
+            return None
+        local.parent.mkdir(parents=True, exist_ok=True)
+        local.write_bytes(data)
+        etag_path.write_text(download.properties.etag)
+        return data
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import json
+import threading
+from dataclasses import dataclass
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceModifiedError,
+)
+
+if TYPE_CHECKING:
+    from azure.storage.blob import BlobLeaseClient, ContainerClient
+
+logger = getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DesiredState:
+    state: str
+    generation: int
+
+
+@dataclass(frozen=True)
+class FlightStatus:
+    """Desired and applied state of a :class:`SingleFlight` resource."""
+
+    desired: DesiredState
+    applied: int
+    # Whether an invocation holds the lease, reconciling the desired state
+    in_flight: bool
+
+
+class SingleFlight:
+    """Distributed single-flight runner backed by a blob lease.
+
+    Callers publish the state they want in a ``<name>.desired`` blob. Whoever
+    holds the lease on the ``<name>.lock`` blob reconciles until the applied
+    generation catches up with the desired one, so requests arriving while a
+    run is in flight are merged into it instead of starting their own run.
+
+    Parameters
+    ----------
+    container : ContainerClient
+        Blob container holding the lock and desired-state blobs.
+    name : str
+        Name of the guarded resource, e.g. the stack name.
+    lease_duration : int, optional
+        Lease duration in seconds (15-60), renewed while reconciling, by default 60
+    """
+
+    def __init__(self, container: ContainerClient, name: str, lease_duration: int = 60):
+        self.container = container
+        self.name = name
+        self.lease_duration = lease_duration
+        self.lock_blob = container.get_blob_client(f"{name}.lock")
+        self.desired_blob = container.get_blob_client(f"{name}.desired")
+        self._initialised = False
+
+    def submit(self, state: str, reconcile: Callable[[str], Any]) -> bool:
+        """Request ``state`` and reconcile it unless a run is already in flight.
+
+        Returns
+        -------
+        bool
+            True if this call ran the reconcile loop, False if the request was
+            merged into the run of another invocation.
+        """
+        self._ensure_blobs()
+        self._publish(state)
+        ran = False
+        while True:
+            lease = self._try_acquire()
+            if lease is None:
+                logger.info(f"Merged {state} of {self.name} into the in-flight run")
+                return ran
+            try:
+                self._drain(lease, reconcile)
+                ran = True
+            finally:
+                lease.release()
+            # A request published while releasing may have missed the lease
+            if self._read_desired().generation == self._applied_generation():
+                return ran
+
+    def _drain(self, lease: BlobLeaseClient, reconcile: Callable[[str], Any]):
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(lease, stop), daemon=True)
+        renewer.start()
+        try:
+            applied = self._applied_generation()
+            while True:
+                desired = self._read_desired()
+                if desired.generation == applied:
+                    return
+                logger.info(
+                    f"Reconciling {self.name} to {desired.state} "
+                    f"(generation {desired.generation})"
+                )
+                reconcile(desired.state)
+                applied = desired.generation
+                self.lock_blob.set_blob_metadata(
+                    {"generation": str(applied), "state": desired.state}, lease=lease
+                )
+        finally:
+            stop.set()
+            renewer.join()
+
+    def _renew(self, lease: BlobLeaseClient, stop: threading.Event):
+        while not stop.wait(self.lease_duration / 2):
+            try:
+                lease.renew()
+            except HttpResponseError as e:
+                logger.warning(f"Failed to renew the lease of {self.name}: {e}")
+
+    def _try_acquire(self) -> Optional[BlobLeaseClient]:
+        try:
+            return self.lock_blob.acquire_lease(lease_duration=self.lease_duration)
+        except HttpResponseError as e:
+            # The lease is held by another invocation
+            if e.status_code == 409:
+                return None
+            raise
+
+    def _publish(self, state: str):
+        """Bump the desired generation with optimistic concurrency."""
+        while True:
+            download = self.desired_blob.download_blob()
+            current = DesiredState(**json.loads(download.readall()))
+            try:
+                self.desired_blob.upload_blob(
+                    json.dumps({"state": state, "generation": current.generation + 1}),
+                    overwrite=True,
+                    etag=download.properties.etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+                return
+            except ResourceModifiedError:
+                continue
+
+    def status(self) -> FlightStatus:
+        """Desired state, applied generation and whether a run is in flight."""
+        properties = self.lock_blob.get_blob_properties()
+        return FlightStatus(
+            desired=self._read_desired(),
+            applied=int(properties.metadata.get("generation", "0")),
+            in_flight=properties.lease.state == "leased",
+        )
+
+    def _read_desired(self) -> DesiredState:
+        return DesiredState(**json.loads(self.desired_blob.download_blob().readall()))
+
+    def _applied_generation(self) -> int:
+        metadata = self.lock_blob.get_blob_properties().metadata
+        return int(metadata.get("generation", "0"))
+
+    def _ensure_blobs(self):
+        if self._initialised:
+            return
+        try:
+            self.container.create_container()
+        except ResourceExistsError:
+            pass
+        for blob, data in (
+            (self.lock_blob, b""),
+            (self.desired_blob, json.dumps({"state": "", "generation": 0})),
+        ):
+            try:
+                blob.upload_blob(data, overwrite=False)
+            except HttpResponseError as e:
+                # Already created, possibly leased by a running reconcile
+                if e.status_code not in (409, 412):
+                    raise
+        self._initialised = True
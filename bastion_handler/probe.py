@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Callable, Optional
+
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+
+from bastion_handler.telemetry import phase
+
+logger = getLogger(__name__)
+
+
+def format_resource_id(
+    subscription_id: str, resource_group: str, resource_type: str, name: str
+) -> str:
+    """Format the ARM resource id of a resource."""
+    return (
+        f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}"
+        f"/providers/{resource_type}/{name}"
+    )
+
+
+@dataclass(frozen=True)
+class ResourceState:
+    """Last known state of a resource."""
+
+    exists: bool
+    provisioning_state: Optional[str]
+    etag: Optional[str]
+    checked_at: float
+
+
+class ResourceProbe:
+    """Existence and state probe addressing one resource by id.
+
+    The state is fetched with a single GET and cached for ``ttl`` seconds. Once
+    the cache expires the GET is conditional on the cached ETag, so an unchanged
+    resource only refreshes the cache.
+
+    Parameters
+    ----------
+    client_factory : Callable[[], Any]
+        Returns the ``ResourceManagementClient`` to use.
+    resource_id : str
+        ARM id of the resource.
+    api_version : str
+        API version of the resource provider.
+    ttl : float, optional
+        Lifetime of the cached state in seconds, by default 30.0
+    clock : Callable[[], float], optional
+        Monotonic clock in seconds, by default time.monotonic
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        resource_id: str,
+        api_version: str,
+        ttl: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client_factory = client_factory
+        self.resource_id = resource_id
+        self.api_version = api_version
+        self.ttl = ttl
+        self.clock = clock
+        self._state: Optional[ResourceState] = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        """Whether the resource exists."""
+        return self.state().exists
+
+    def state(self, force: bool = False) -> ResourceState:
+        """Get the state of the resource, from the cache if it is fresh."""
+        with self._lock:
+            now = self.clock()
+            if not force and self._is_fresh(now):
+                return self._state  # type: ignore
+            cached = self._state
+            with phase("arm.get_resource", resource_id=self.resource_id) as span:
+                try:
+                    response = self.client_factory().resources.get_by_id(
+                        self.resource_id, self.api_version, **self._request_kwargs()
+                    )
+                except HttpResponseError as e:
+                    self._state = self._state_from_error(e, cached, now)
+                else:
+                    self._state = self._state_from_response(response, now)
+                span.set_attribute("exists", self._state.exists)
+            return self._state
+
+    def invalidate(self):
+        """Drop the cached state, e.g. after the resource was created or deleted."""
+        self._state = None
+
+    def _is_fresh(self, now: float) -> bool:
+        return self._state is not None and now - self._state.checked_at < self.ttl
+
+    def _request_kwargs(self) -> dict[str, Any]:
+        headers = {}
+        cached = self._state
+        if cached is not None and cached.exists and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        return {
+            "headers": headers,
+            "cls": lambda response, deserialized, _: (
+                deserialized,
+                response.http_response.headers.get("ETag"),
+            ),
+        }
+
+    def _state_from_response(
+        self, response: tuple[Any, Optional[str]], now: float
+    ) -> ResourceState:
+        resource, etag = response
+        properties = resource.properties or {}
+        return ResourceState(
+            exists=True,
+            provisioning_state=properties.get("provisioningState"),
+            etag=etag,
+            checked_at=now,
+        )
+
+    def _state_from_error(
+        self, error: HttpResponseError, cached: Optional[ResourceState], now: float
+    ) -> ResourceState:
+        if isinstance(error, ResourceNotModifiedError) and cached is not None:
+            return ResourceState(
+                exists=cached.exists,
+                provisioning_state=cached.provisioning_state,
+                etag=cached.etag,
+                checked_at=now,
+            )
+        if isinstance(error, ResourceNotFoundError):
+            logger.info(f"Resource not found: {self.resource_id}")
+            return ResourceState(
+                exists=False, provisioning_state=None, etag=None, checked_at=now
+            )
+        raise error
+
+
+class AsyncResourceProbe(ResourceProbe):
+    """Asynchronous variant of :class:`ResourceProbe`.
+
+    ``client_factory`` returns the ``azure.mgmt.resource.aio`` client.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_lock = asyncio.Lock()
+
+    async def exists(self) -> bool:  # type: ignore[override]
+        """Whether the resource exists."""
+        return (await self.state()).exists
+
+    async def state(self, force: bool = False) -> ResourceState:  # type: ignore[override]
+        """Get the state of the resource, from the cache if it is fresh."""
+        async with self._async_lock:
+            now = self.clock()
+            if not force and self._is_fresh(now):
+                return self._state  # type: ignore
+            cached = self._state
+            with phase("arm.get_resource", resource_id=self.resource_id) as span:
+                try:
+                    response = await self.client_factory().resources.get_by_id(
+                        self.resource_id, self.api_version, **self._request_kwargs()
+                    )
+                except HttpResponseError as e:
+                    self._state = self._state_from_error(e, cached, now)
+                else:
+                    self._state = self._state_from_response(response, now)
+                span.set_attribute("exists", self._state.exists)
+            return self._state
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from logging import getLogger
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Literal, Optional
+
+from bastion_handler.events import CommandCanceller, RunMonitor
+from bastion_handler.telemetry import phase, record_provisioning
+
+if TYPE_CHECKING:
+    from pulumi import automation as auto
+
+logger = getLogger(__name__)
+
+Operation = Literal["up", "destroy", "preview"]
+
+
+class ProvisioningError(RuntimeError):
+    """Raised when a provisioning run did not succeed."""
+
+
+@dataclass(frozen=True)
+class TargetSpec:
+    """Top-level resource to restrict provisioning runs to."""
+
+    type: str
+    name: str
+
+    @classmethod
+    def parse(cls, value: str) -> "TargetSpec":
+        """Parse a ``<type>::<logical name>`` specification."""
+        type_, _, name = value.rpartition("::")
+        return cls(type=type_, name=name)
+
+    def urn(self, stack: str, project: str) -> str:
+        return f"urn:pulumi:{stack}::{project}::{self.type}::{self.name}"
+
+
+def compute_targets(
+    resources: list[dict[str, Any]],
+    specs: list[TargetSpec],
+    stack: str,
+    project: str,
+) -> list[str]:
+    """Minimal URN target set for ``specs`` in a stack's state.
+
+    The URNs of resources matching the specs are taken from the state (or
+    built from the spec when the resource does not exist yet), together with
+    every resource that depends on them, directly or transitively.
+    """
+    wanted = {(spec.type, spec.name) for spec in specs}
+    found: dict[tuple[str, str], str] = {}
+    dependents: dict[str, list[str]] = {}
+    for resource in resources:
+        urn = resource["urn"]
+        key = (resource["type"], urn.rsplit("::", 1)[-1])
+        if key in wanted:
+            found[key] = urn
+        for dependency in set(resource.get("dependencies") or []) | (
+            {resource["parent"]} if resource.get("parent") else set()
+        ):
+            dependents.setdefault(dependency, []).append(urn)
+
+    targets = {
+        found.get((spec.type, spec.name)) or spec.urn(stack, project) for spec in specs
+    }
+    pending = list(targets)
+    while pending:
+        for dependent in dependents.get(pending.pop(), []):
+            if dependent not in targets:
+                targets.add(dependent)
+                pending.append(dependent)
+    return sorted(targets)
+
+
+@dataclass
+class ProvisioningResult:
+    """Structured result of a provisioning run."""
+
+    operation: Operation
+    succeeded: bool
+    duration: float
+    resource_changes: dict[str, int] = field(default_factory=dict)
+    outputs: dict[str, Any] = field(default_factory=dict)
+    stdout: str = ""
+    # Why the run failed, when it was aborted or the CLI failed
+    error: Optional[str] = None
+
+
+class ProvisioningDriver:
+    """In-process Pulumi driver built on the Automation API.
+
+    The workspace and the selected stack are created once and reused by every
+    run of the function instance, so the backend given by
+    ``PULUMI_BACKEND_URL`` is only logged into on the first run.
+
+    Parameters
+    ----------
+    work_dir : Path
+        Directory of the Pulumi program.
+    stack_name : str
+        Name of the stack to operate on.
+    pulumi_root : Optional[str], optional
+        Directory containing the ``pulumi`` executable, by default None
+    targets : Optional[list[str]], optional
+        URNs to restrict the runs to, by default None
+    target_resources : Optional[list[TargetSpec]], optional
+        Resources to derive the URN targets from the stack state when
+        ``targets`` is empty, by default None
+    parallel : Optional[int], optional
+        Number of resource operations to run in parallel, by default unbounded
+    pulumi_home : Optional[str], optional
+        Pulumi home directory holding the provider plugins, by default the
+        CLI's own default
+    state_snapshot : Optional[Callable[[str], Optional[dict]]], optional
+        Returns the deployment of the stack's last state snapshot for a
+        project name, used instead of ``pulumi stack export`` to derive the
+        targets, by default None
+    timeout : Optional[float], optional
+        Seconds after which a run is cancelled, by default no deadline
+    step_timeout : Optional[float], optional
+        Seconds after which a run with a resource step still in progress is
+        cancelled, by default no deadline
+    abort_grace : float, optional
+        Seconds a cancelled run is given to release the stack lock before the
+        CLI is killed, by default 10
+    expected_config : Optional[dict[str, bool]], optional
+        Boolean stack config the function's settings depend on, checked when
+        the stack is selected. A stack whose config disagrees fails every run
+        with a ProvisioningError, by default None
+    """
+
+    def __init__(
+        self,
+        work_dir: Path,
+        stack_name: str,
+        pulumi_root: Optional[str] = None,
+        targets: Optional[list[str]] = None,
+        target_resources: Optional[list[TargetSpec]] = None,
+        parallel: Optional[int] = None,
+        pulumi_home: Optional[str] = None,
+        state_snapshot: Optional[Callable[[str], Optional[dict]]] = None,
+        timeout: Optional[float] = None,
+        step_timeout: Optional[float] = None,
+        abort_grace: float = 10.0,
+        expected_config: Optional[dict[str, bool]] = None,
+    ):
+        self.work_dir = work_dir
+        self.stack_name = stack_name
+        self.pulumi_root = pulumi_root
+        self.targets = [target for target in targets or [] if target]
+        self.target_resources = target_resources or []
+        self.parallel = parallel
+        self.pulumi_home = pulumi_home
+        self.state_snapshot = state_snapshot
+        self.timeout = timeout
+        self.step_timeout = step_timeout
+        self.abort_grace = abort_grace
+        self.expected_config = expected_config or {}
+        self._canceller = CommandCanceller()
+        self._stack: Optional[auto.Stack] = None
+        self._resolved_targets: Optional[list[str]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def stack(self) -> auto.Stack:
+        """Warm stack of the workspace, selected on first use."""
+        if self._stack is None:
+            with phase("pulumi.select_stack", stack=self.stack_name):
+                self._stack = self._select_stack()
+        return self._stack
+
+    def _select_stack(self) -> auto.Stack:
+        # The Automation API is imported by the first run, not with the module
+        from pulumi import automation as auto
+
+        if self.pulumi_root:
+            path = os.environ.get("PATH", "")
+            if self.pulumi_root not in path.split(os.pathsep):
+                os.environ["PATH"] = os.pathsep.join([self.pulumi_root, path])
+        stack = auto.select_stack(
+            stack_name=self.stack_name,
+            work_dir=str(self.work_dir),
+            opts=auto.LocalWorkspaceOptions(
+                pulumi_home=self.pulumi_home, env_vars=self._canceller.env
+            ),
+        )
+        self._check_config(stack)
+        return stack
+
+    def _check_config(self, stack: auto.Stack) -> None:
+        """Raise a ProvisioningError if the stack config disagrees.
+
+        The stack is not kept on a mismatch, so it is checked again by the
+        next run, after the config or the setting is fixed.
+        """
+        from pulumi import automation as auto
+
+        for key, expected in self.expected_config.items():
+            try:
+                value = stack.get_config(key).value
+            except auto.CommandError:
+                # Unset keys are reported as an error by ``pulumi config get``
+                value = "false"
+            if (value.lower() == "true") != expected:
+                raise ProvisioningError(
+                    f"Stack {self.stack_name} has config {key}={value}, but the "
+                    f"function expects {str(expected).lower()}; set the stack "
+                    f"config and the function setting to the same value"
+                )
+
+    def create(self) -> ProvisioningResult:
+        """Create resources with ``pulumi up``."""
+        return self._run("up")
+
+    def destroy(self) -> ProvisioningResult:
+        """Delete resources with ``pulumi destroy``."""
+        return self._run("destroy")
+
+    def preview(self) -> ProvisioningResult:
+        """Preview the changes of ``pulumi up``."""
+        return self._run("preview")
+
+    def resolve_targets(self) -> Optional[list[str]]:
+        """URNs the runs are restricted to, or None for the whole stack.
+
+        Targets derived from the stack state are computed once per worker.
+        """
+        if self.targets:
+            return self.targets
+        if not self.target_resources:
+            return None
+        if self._resolved_targets is None:
+            stack = self.stack
+            project = stack.workspace.project_settings().name
+            deployment = None
+            if self.state_snapshot is not None:
+                deployment = self.state_snapshot(project)
+            if deployment is None:
+                deployment = stack.export_stack().deployment or {}
+            self._resolved_targets = compute_targets(
+                list(deployment.get("resources") or []),
+                self.target_resources,
+                self.stack_name,
+                project,
+            )
+            logger.info(f"Resolved pulumi targets: {self._resolved_targets}")
+        return self._resolved_targets
+
+    def _run(self, operation: Operation) -> ProvisioningResult:
+        from pulumi import automation as auto
+
+        with self._lock, phase(f"pulumi.{operation}", stack=self.stack_name) as span:
+            started = time.perf_counter()
+            monitor = RunMonitor(
+                self._cancel,
+                operation,
+                timeout=self.timeout,
+                step_timeout=self.step_timeout,
+            )
+            try:
+                with monitor:
+                    result = self._invoke(operation, monitor.on_event)
+            except auto.CommandError as e:
+                logger.error(f"pulumi {operation} failed: {monitor.reason or e}")
+                result = ProvisioningResult(
+                    operation=operation,
+                    succeeded=False,
+                    duration=time.perf_counter() - started,
+                    stdout=str(e),
+                    error=monitor.reason or e.__class__.__name__,
+                )
+            else:
+                if monitor.aborted:
+                    result.succeeded = False
+                    result.error = monitor.reason
+                result.duration = time.perf_counter() - started
+                logger.info(
+                    f"pulumi {operation} finished in {result.duration:.1f}s: "
+                    f"{result.resource_changes}"
+                )
+            span.set_attribute("succeeded", result.succeeded)
+            span.set_attribute("steps_completed", monitor.completed)
+            if result.error:
+                span.set_attribute("error", result.error)
+            for change, count in result.resource_changes.items():
+                span.set_attribute(f"resource_changes.{change}", count)
+            if operation != "preview":
+                record_provisioning(operation, result.duration, result.succeeded)
+            return result
+
+    def _cancel(self):
+        self._canceller.cancel(self.abort_grace)
+
+    def _invoke(
+        self, operation: Operation, on_event: Callable[[Any], None]
+    ) -> ProvisioningResult:
+        stack = self.stack
+        targets = self.resolve_targets()
+        # Skip refresh and progress output, and let dependents of the targets
+        # be updated instead of failing the run
+        options: dict[str, Any] = dict(
+            target=targets,
+            target_dependents=targets is not None,
+            parallel=self.parallel,
+            refresh=False,
+            suppress_progress=True,
+            on_event=on_event,
+        )
+        if operation == "up":
+            up_result = stack.up(on_output=logger.debug, **options)
+            return ProvisioningResult(
+                operation=operation,
+                succeeded=up_result.summary.result == "succeeded",
+                duration=0.0,
+                resource_changes=dict(up_result.summary.resource_changes or {}),
+                outputs={key: out.value for key, out in up_result.outputs.items()},
+                stdout=up_result.stdout,
+            )
+        elif operation == "destroy":
+            destroy_result = stack.destroy(on_output=logger.debug, **options)
+            return ProvisioningResult(
+                operation=operation,
+                succeeded=destroy_result.summary.result == "succeeded",
+                duration=0.0,
+                resource_changes=dict(destroy_result.summary.resource_changes or {}),
+                stdout=destroy_result.stdout,
+            )
+        else:
+            preview_result = stack.preview(**options)
+            return ProvisioningResult(
+                operation=operation,
+                succeeded=True,
+                duration=0.0,
+                resource_changes={
+                    str(op.value): count
+                    for op, count in preview_result.change_summary.items()
+                },
+                stdout=preview_result.stdout,
+            )
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterator, Optional
+
+from bastion_handler.schedule import Record
+
+# ``start`` and ``end`` are compared as strings, which orders ISO-8601
+# timestamps correctly as long as they share the same format and offset.
+# ``target`` is omitted from the result when the reservation has none.
+RESERVATION_WINDOW_QUERY = (
+    'SELECT VALUE {"id": c.id, "title": c.title, '
+    '"start": c["start"], "end": c["end"], "target": c.target} '
+    'FROM c WHERE c["end"] >= @now AND c["start"] <= @horizon'
+)
+
+
+@dataclass(frozen=True)
+class ReservationPage:
+    """One page of a reservation query."""
+
+    records: list[Record]
+    continuation_token: Optional[str]
+
+
+def format_query_timestamp(t: datetime) -> str:
+    """Format a timestamp like the naive UTC timestamps stored by the Logic App."""
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t.isoformat()
+
+
+def query_reservations(
+    container: Any,
+    now: datetime,
+    horizon: datetime,
+    max_item_count: int = 100,
+    continuation_token: Optional[str] = None,
+) -> Iterator[ReservationPage]:
+    """Stream the reservations overlapping ``[now, horizon]`` page by page.
+
+    The time window is evaluated by cosmos db and only the reservation fields
+    are projected. Each page carries the continuation token of the next one,
+    so an interrupted sweep can be resumed by passing it back.
+
+    Parameters
+    ----------
+    container : ContainerProxy
+        Cosmos container of the reservations.
+    now : datetime
+        Reservations ending before this time are skipped.
+    horizon : datetime
+        Reservations starting after this time are skipped.
+    max_item_count : int, optional
+        Maximum number of records per page, by default 100
+    continuation_token : Optional[str], optional
+        Token to resume a previous sweep from, by default None
+
+    Yields
+    ------
+    ReservationPage
+        Records of the page and the token to resume after it.
+    """
+    pager = container.query_items(
+        query=RESERVATION_WINDOW_QUERY,
+        parameters=[
+            {"name": "@now", "value": format_query_timestamp(now)},
+            {"name": "@horizon", "value": format_query_timestamp(horizon)},
+        ],
+        enable_cross_partition_query=True,
+        max_item_count=max_item_count,
+    ).by_page(continuation_token)
+    for page in pager:
+        yield ReservationPage(
+            records=list(page), continuation_token=pager.continuation_token
+        )
+
+
+def iter_reservations(
+    container: Any, now: datetime, horizon: datetime, max_item_count: int = 100
+) -> Iterator[Record]:
+    """Stream the reservations overlapping ``[now, horizon]`` one by one."""
+    for page in query_reservations(container, now, horizon, max_item_count):
+        yield from page.records
@@ -0,0 +1,196 @@
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional, TypedDict
+
+# Sorts after every reservation id, to bisect past all entries at one time
+_MAX_ID = chr(0x10FFFF)
+
+
+class Record(TypedDict):
+    id: str
+    title: str
+    start: str
+    end: str
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO-8601 timestamp as a timezone-aware datetime.
+
+    Naive timestamps are interpreted as UTC, which is the local time of the
+    function worker.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def is_reservation(record: dict) -> bool:
+    """Whether a document of the container is a reservation record."""
+    return all(isinstance(record.get(key), str) for key in Record.__annotations__)
+
+
+def utcnow() -> datetime:
+    """Current time as a timezone-aware datetime."""
+    return datetime.now(timezone.utc)
+
+
+@dataclass(frozen=True)
+class Reservation:
+    id: str
+    title: str
+    start: datetime
+    end: datetime
+
+    @classmethod
+    def from_record(cls, record: Record) -> "Reservation":
+        return cls(
+            id=record["id"],
+            title=record["title"],
+            start=parse_timestamp(record["start"]),
+            end=parse_timestamp(record["end"]),
+        )
+
+    def to_record(self) -> Record:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+        }
+
+
+class ReservationIndex:
+    """Sorted interval index over reservations.
+
+    Reservations are half-open intervals ``[start, end)``. Timestamps are
+    parsed once on insertion, and the index keeps the start and end points
+    sorted so that point queries are answered with binary search.
+
+    Parameters
+    ----------
+    records : Iterable[Record], optional
+        Initial records of the index.
+    """
+
+    def __init__(self, records: Iterable[Record] = ()):
+        self._reservations: dict[str, Reservation] = {}
+        self._starts: list[tuple[datetime, str]] = []
+        self._ends: list[tuple[datetime, str]] = []
+        self._merged: Optional[list[tuple[datetime, datetime]]] = None
+        self.update(records)
+
+    def __len__(self) -> int:
+        return len(self._reservations)
+
+    def __contains__(self, reservation_id: str) -> bool:
+        return reservation_id in self._reservations
+
+    def __iter__(self) -> Iterator[Reservation]:
+        return iter(self._reservations.values())
+
+    def get(self, reservation_id: str) -> Optional[Reservation]:
+        return self._reservations.get(reservation_id)
+
+    def add(self, reservation: Reservation) -> bool:
+        """Insert or replace a reservation.
+
+        Returns
+        -------
+        bool
+            Whether the index changed.
+        """
+        if self._reservations.get(reservation.id) == reservation:
+            return False
+        self.remove(reservation.id)
+        if reservation.end <= reservation.start:
+            return True
+        self._reservations[reservation.id] = reservation
+        insort(self._starts, (reservation.start, reservation.id))
+        insort(self._ends, (reservation.end, reservation.id))
+        self._merged = None
+        return True
+
+    def update(self, records: Iterable[dict]) -> int:
+        """Insert or replace reservations from raw records.
+
+        Documents which are not reservations are ignored.
+
+        Returns
+        -------
+        int
+            Number of reservations that changed.
+        """
+        changed = 0
+        for record in records:
+            if is_reservation(record):
+                changed += self.add(Reservation.from_record(record))  # type: ignore
+        return changed
+
+    def remove(self, reservation_id: str) -> Optional[Reservation]:
+        """Remove a reservation from the index if it exists."""
+        reservation = self._reservations.pop(reservation_id, None)
+        if reservation is None:
+            return None
+        self._starts.pop(bisect_left(self._starts, (reservation.start, reservation.id)))
+        self._ends.pop(bisect_left(self._ends, (reservation.end, reservation.id)))
+        self._merged = None
+        return reservation
+
+    def count_active(self, t: datetime) -> int:
+        """Number of reservations active at ``t``."""
+        started = bisect_right(self._starts, (t, _MAX_ID))
+        ended = bisect_right(self._ends, (t, _MAX_ID))
+        return started - ended
+
+    def is_active(self, t: datetime) -> bool:
+        """Whether any reservation is active at ``t``."""
+        return self.count_active(t) > 0
+
+    def next_start(self, t: datetime) -> Optional[datetime]:
+        """Earliest reservation start after ``t``."""
+        i = bisect_right(self._starts, (t, _MAX_ID))
+        return self._starts[i][0] if i < len(self._starts) else None
+
+    def next_end(self, t: datetime) -> Optional[datetime]:
+        """Earliest reservation end after ``t``."""
+        i = bisect_right(self._ends, (t, _MAX_ID))
+        return self._ends[i][0] if i < len(self._ends) else None
+
+    def next_transition(self, t: datetime) -> Optional[tuple[datetime, bool]]:
+        """Next time after ``t`` when the active state changes.
+
+        Returns
+        -------
+        Optional[tuple[datetime, bool]]
+            Time of the transition and the active state after it, or ``None``
+            if the state never changes again.
+        """
+        merged = self._merged_intervals()
+        i = bisect_right(merged, (t, t))
+        if i > 0 and merged[i - 1][0] <= t < merged[i - 1][1]:
+            return merged[i - 1][1], False
+        if i < len(merged):
+            if merged[i][0] > t:
+                return merged[i][0], True
+            return merged[i][1], False
+        return None
+
+    def expired(self, t: datetime) -> list[Reservation]:
+        """Reservations whose end is at or before ``t``."""
+        i = bisect_right(self._ends, (t, _MAX_ID))
+        return [self._reservations[rid] for _, rid in self._ends[:i]]
+
+    def _merged_intervals(self) -> list[tuple[datetime, datetime]]:
+        if self._merged is None:
+            merged: list[tuple[datetime, datetime]] = []
+            for start, rid in self._starts:
+                end = self._reservations[rid].end
+                if merged and start <= merged[-1][1]:
+                    if end > merged[-1][1]:
+                        merged[-1] = (merged[-1][0], end)
+                else:
+                    merged.append((start, end))
+            self._merged = merged
+        return self._merged
@@ -0,0 +1,345 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import Any, Callable, Iterable, Literal, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+from bastion_handler.schedule import (
+    Reservation,
+    ReservationIndex,
+    is_reservation,
+    parse_timestamp,
+)
+
+logger = getLogger(__name__)
+
+# The state document shares the reservations container, so its partition key
+# (/title) is set to its id to keep it in a partition of its own.
+STATE_DOCUMENT_ID = "__reconciler_state__"
+
+DesiredState = Literal["up", "destroy"]
+
+
+@dataclass(frozen=True)
+class Summary:
+    """Summary of the schedule the create/destroy decision is made from."""
+
+    active_count: int
+    next_start: Optional[datetime]
+    next_end: Optional[datetime]
+    # Whether a reservation starts within the pre-provisioning lead time
+    upcoming: bool = False
+
+    @property
+    def desired(self) -> DesiredState:
+        return "up" if self.active_count > 0 or self.upcoming else "destroy"
+
+
+@dataclass(frozen=True)
+class Decision:
+    """Outcome of applying one change-feed batch."""
+
+    summary: Summary
+    previous: Optional[Summary]
+    expired: list[Reservation]
+
+    @property
+    def transitioned(self) -> bool:
+        """Whether the desired state changed with this batch."""
+        return self.previous is None or self.previous.desired != self.summary.desired
+
+    @property
+    def bootstrapped(self) -> bool:
+        """Whether the state document was created by this batch.
+
+        The desired state is then new, but says nothing about the resource,
+        which has to be probed before it is deleted.
+        """
+        return self.previous is None
+
+
+@dataclass
+class ScheduleState:
+    """What the summary of the schedule is maintained from.
+
+    Only the reservations active at the last update are kept, together with
+    the ids of the reservations the next start and end are taken from. A
+    changed reservation updates them in place. When the last reservation of
+    the next start or end changes or goes away, the state is
+    :attr:`incomplete`. It has to be recomputed from the container, like it
+    does once the next start or end has passed.
+    """
+
+    computed_at: datetime
+    active: dict[str, Reservation] = field(default_factory=dict)
+    next_start: Optional[datetime] = None
+    start_ids: set[str] = field(default_factory=set)
+    next_end: Optional[datetime] = None
+    end_ids: set[str] = field(default_factory=set)
+
+    @classmethod
+    def from_index(cls, index: ReservationIndex, now: datetime) -> "ScheduleState":
+        """State of the reservations of ``index`` that have not ended at ``now``."""
+        next_start = index.next_start(now)
+        next_end = index.next_end(now)
+        return cls(
+            computed_at=now,
+            active={r.id: r for r in index if r.start <= now < r.end},
+            next_start=next_start,
+            start_ids={r.id for r in index if r.start == next_start},
+            next_end=next_end,
+            end_ids={r.id for r in index if r.end == next_end},
+        )
+
+    @property
+    def incomplete(self) -> bool:
+        """Whether the next start or end is no longer known."""
+        return (self.next_start is not None and not self.start_ids) or (
+            self.next_end is not None and not self.end_ids
+        )
+
+    def stale(self, now: datetime) -> bool:
+        """Whether a reservation started or ended since the state was updated."""
+        return (self.next_start is not None and self.next_start <= now) or (
+            self.next_end is not None and self.next_end <= now
+        )
+
+    def update(self, records: Iterable[dict], now: datetime) -> list[Reservation]:
+        """Apply changed documents at ``now``, returning the expired reservations.
+
+        Documents which are not reservations are ignored.
+        """
+        expired = []
+        for record in records:
+            if not is_reservation(record):
+                continue
+            reservation = Reservation.from_record(record)  # type: ignore
+            self.active.pop(reservation.id, None)
+            self.start_ids.discard(reservation.id)
+            self.end_ids.discard(reservation.id)
+            if reservation.end <= reservation.start:
+                continue
+            if reservation.end <= now:
+                expired.append(reservation)
+                continue
+            if reservation.start <= now:
+                self.active[reservation.id] = reservation
+            else:
+                self.next_start, self.start_ids = _earliest(
+                    self.next_start, self.start_ids, reservation
+                )
+            self.next_end, self.end_ids = _earliest(
+                self.next_end, self.end_ids, reservation, end=True
+            )
+        return expired
+
+    def summary(self, now: datetime, lead_time: timedelta) -> Summary:
+        return Summary(
+            active_count=len(self.active),
+            next_start=self.next_start,
+            next_end=self.next_end,
+            upcoming=self.next_start is not None and self.next_start <= now + lead_time,
+        )
+
+    def to_document(self) -> dict[str, Any]:
+        return {
+            "computed_at": self.computed_at.isoformat(),
+            "active": {
+                r.id: [r.title, r.start.isoformat(), r.end.isoformat()]
+                for r in self.active.values()
+            },
+            "next_start_ids": sorted(self.start_ids),
+            "next_end_ids": sorted(self.end_ids),
+        }
+
+    @classmethod
+    def from_document(cls, document: dict[str, Any]) -> "ScheduleState":
+        return cls(
+            computed_at=parse_timestamp(document["computed_at"]),
+            active={
+                reservation_id: Reservation(
+                    id=reservation_id,
+                    title=title,
+                    start=parse_timestamp(start),
+                    end=parse_timestamp(end),
+                )
+                for reservation_id, (title, start, end) in document["active"].items()
+            },
+            next_start=_parse_optional(document["next_start"]),
+            start_ids=set(document["next_start_ids"]),
+            next_end=_parse_optional(document["next_end"]),
+            end_ids=set(document["next_end_ids"]),
+        )
+
+
+def _earliest(
+    current: Optional[datetime],
+    ids: set[str],
+    reservation: Reservation,
+    end: bool = False,
+) -> tuple[Optional[datetime], set[str]]:
+    """Earliest of ``current`` and the start (or end) of ``reservation``."""
+    t = reservation.end if end else reservation.start
+    if current is None or t < current:
+        return t, {reservation.id}
+    if t == current:
+        return current, ids | {reservation.id}
+    return current, ids
+
+
+class Reconciler:
+    """Desired-state reconciler backed by a small state document.
+
+    The document holds the summary of the schedule: the active reservation
+    count and the next start and end. Each change-feed batch is applied to it
+    incrementally, and a batch of unrelated documents leaves it untouched.
+    The reservations are only queried from the container, within their time
+    window, when the document does not exist yet, once the next start or end
+    has passed, or when a change leaves them unknown.
+
+    Parameters
+    ----------
+    container : ContainerProxy
+        Cosmos container of the reservations.
+    query : Callable[[datetime], Iterable[dict]], optional
+        Returns the records of the reservations ending at or after the given
+        time, to recompute the state from, by default no records.
+    document_id : str, optional
+        Id of the state document, by default STATE_DOCUMENT_ID
+    max_retries : int, optional
+        Times a batch is applied again after the document was modified by
+        another invocation, before the conflict is raised, by default 10
+    """
+
+    def __init__(
+        self,
+        container: Any,
+        query: Callable[[datetime], Iterable[dict]] = lambda since: (),
+        document_id: str = STATE_DOCUMENT_ID,
+        max_retries: int = 10,
+    ):
+        self.container = container
+        self.query = query
+        self.document_id = document_id
+        self.max_retries = max_retries
+        self._summary: Optional[Summary] = None
+        self._lock = threading.Lock()
+
+    def apply(
+        self,
+        records: Iterable[dict],
+        now: datetime,
+        lead_time: timedelta = timedelta(0),
+    ) -> Decision:
+        """Apply a batch of changed documents and summarise the schedule at ``now``.
+
+        Expired reservations are returned for the caller to delete them from
+        the container. Reservations starting within ``lead_time`` make the
+        desired state "up" ahead of their start.
+        """
+        records = list(records)
+        retries = 0
+        with self._lock:
+            while True:
+                document = self._read()
+                state = None
+                previous = None
+                if document is not None:
+                    previous = _summary_of(document)
+                    # Documents of older versions are recomputed
+                    if "computed_at" in document:
+                        state = ScheduleState.from_document(document)
+                expired: list[Reservation] = []
+                if state is not None and not state.stale(now):
+                    expired = state.update(records, now)
+                if state is None or state.stale(now) or state.incomplete:
+                    state, expired = self._recompute(
+                        records, now, state.computed_at if state else now
+                    )
+                summary = state.summary(now, lead_time)
+                body = {
+                    "id": self.document_id,
+                    "title": self.document_id,
+                    "active_count": summary.active_count,
+                    "next_start": _format_optional(summary.next_start),
+                    "next_end": _format_optional(summary.next_end),
+                    "upcoming": summary.upcoming,
+                    **state.to_document(),
+                }
+                if document is not None and _unchanged(document, body):
+                    self._summary = summary
+                    return Decision(summary, previous, expired)
+                try:
+                    self._save(body, document)
+                except (CosmosAccessConditionFailedError, ResourceExistsError):
+                    # Updated by another invocation, apply the batch on top of it
+                    retries += 1
+                    if retries > self.max_retries:
+                        raise
+                    logger.info(f"State document was modified, retry {retries}")
+                    continue
+                self._summary = summary
+                return Decision(summary, previous, expired)
+
+    def summary(self) -> Optional[Summary]:
+        """Last known summary of the schedule."""
+        return self._summary
+
+    def _recompute(
+        self, records: list[dict], now: datetime, since: datetime
+    ) -> tuple[ScheduleState, list[Reservation]]:
+        """State at ``now`` of the reservations ending since ``since``.
+
+        The batch is applied first, so that the container, read after it,
+        has the last word.
+        """
+        logger.info(f"Recomputing the schedule state from reservations since {since}")
+        index = ReservationIndex(records)
+        index.update(self.query(since))
+        expired = index.expired(now)
+        for reservation in expired:
+            index.remove(reservation.id)
+        return ScheduleState.from_index(index, now), expired
+
+    def _read(self) -> Optional[dict]:
+        try:
+            return self.container.read_item(self.document_id, self.document_id)
+        except ResourceNotFoundError:
+            logger.info("State document does not exist, bootstrapping it")
+            return None
+
+    def _save(self, body: dict, document: Optional[dict]):
+        if document is None:
+            self.container.create_item(body)
+        else:
+            self.container.replace_item(
+                self.document_id,
+                body,
+                etag=document["_etag"],
+                match_condition=MatchConditions.IfNotModified,
+            )
+
+
+def _summary_of(document: dict) -> Summary:
+    return Summary(
+        active_count=document["active_count"],
+        next_start=_parse_optional(document["next_start"]),
+        next_end=_parse_optional(document["next_end"]),
+        upcoming=document.get("upcoming", False),
+    )
+
+
+def _unchanged(document: dict, body: dict) -> bool:
+    return all(document.get(key) == value for key, value in body.items())
+
+
+def _parse_optional(value: Optional[str]) -> Optional[datetime]:
+    return parse_timestamp(value) if value is not None else None
+
+
+def _format_optional(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
@@ -0,0 +1,131 @@
+import json
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Iterable, Iterator, Optional
+
+from bastion_handler.probe import format_resource_id
+from bastion_handler.schedule import is_reservation
+from bastion_handler.state import STATE_DOCUMENT_ID
+
+logger = getLogger(__name__)
+
+DEFAULT_TARGET = "default"
+
+
+class ReconcileError(RuntimeError):
+    """Raised when reconciling some of the targets failed."""
+
+    def __init__(self, errors: dict[str, BaseException]):
+        super().__init__(
+            "; ".join(f"{name}: {error}" for name, error in errors.items())
+        )
+        self.errors = errors
+
+
+@dataclass(frozen=True)
+class Target:
+    """A bastion host reconciled from the reservations routed to it.
+
+    Reservations are routed by their optional ``target`` field, and those
+    without one go to the default target.
+    """
+
+    name: str
+    subscription_id: str
+    resource_group: str
+    resource_name: str
+    resource_type: str = "Microsoft.Network/bastionHosts"
+    api_version: str = "2024-01-01"
+    stack_name: str = "dev"
+    # Directory of the pulumi program, relative to the function app
+    pulumi_dir: str = "pulumi"
+    target_resources: tuple[str, ...] = ()
+    targets: tuple[str, ...] = ()
+    # Whether the stack keeps the public IP, checked against its config
+    retain_ip: bool = False
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Target":
+        data = dict(data)
+        for key in ("target_resources", "targets"):
+            if key in data:
+                data[key] = tuple(data[key])
+        return cls(**data)
+
+    @property
+    def resource_id(self) -> str:
+        return format_resource_id(
+            self.subscription_id,
+            self.resource_group,
+            self.resource_type,
+            self.resource_name,
+        )
+
+    @property
+    def state_document_id(self) -> str:
+        """Id of the target's reconciler state document."""
+        if self.name == DEFAULT_TARGET:
+            return STATE_DOCUMENT_ID
+        return f"{STATE_DOCUMENT_ID}:{self.name}"
+
+
+class TargetRegistry:
+    """Targets by name, and the routing of reservations to them.
+
+    Parameters
+    ----------
+    targets : Iterable[Target]
+        Targets to reconcile. Names and pulumi stacks must be unique, since
+        the stack name keys the target's lock, lead time and ledger.
+    default : str, optional
+        Target of reservations without a ``target`` field, by default
+        DEFAULT_TARGET
+    """
+
+    def __init__(self, targets: Iterable[Target], default: str = DEFAULT_TARGET):
+        self._targets: dict[str, Target] = {}
+        stacks = set()
+        for target in targets:
+            if target.name in self._targets or target.stack_name in stacks:
+                raise ValueError(f"Duplicate target or stack: {target.name}")
+            self._targets[target.name] = target
+            stacks.add(target.stack_name)
+        self.default = default
+
+    @classmethod
+    def from_json(cls, text: str, default: str = DEFAULT_TARGET) -> "TargetRegistry":
+        """Registry from a JSON list of target objects."""
+        return cls(map(Target.from_dict, json.loads(text)), default=default)
+
+    def __iter__(self) -> Iterator[Target]:
+        return iter(self._targets.values())
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def get(self, name: str) -> Optional[Target]:
+        return self._targets.get(name)
+
+    def route(self, record: dict) -> Optional[Target]:
+        """Target of a record, or None if it names an unknown target."""
+        return self._targets.get(record.get("target") or self.default)
+
+    def group(self, records: Iterable[dict]) -> dict[str, list[dict]]:
+        """Group reservation records by the name of their target.
+
+        Other documents, like the reconciler state documents, are skipped, and
+        so are records of unknown targets, with a warning.
+        """
+        groups: dict[str, list[dict]] = {}
+        for record in records:
+            if not is_reservation(record):
+                continue
+            target = self.route(record)
+            if target is None:
+                logger.warning(
+                    f"Skipping {record.get('id')} of unknown target "
+                    f"{record.get('target')}"
+                )
+                continue
+            groups.setdefault(target.name, []).append(record)
+        return groups
@@ -0,0 +1,165 @@
+import os
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Any, Callable, Iterator, Optional
+
+from opentelemetry import metrics, trace
+from opentelemetry.trace import Span
+
+logger = getLogger(__name__)
+
+INSTRUMENTATION_NAME = "bastion_handler"
+
+tracer = trace.get_tracer(INSTRUMENTATION_NAME)
+meter = metrics.get_meter(INSTRUMENTATION_NAME)
+
+provisioning_duration = meter.create_histogram(
+    "bastion.provisioning.duration",
+    unit="s",
+    description="Duration of pulumi runs creating or deleting the target resource",
+)
+
+# Exporter factories selectable by name through OTEL_TRACES_EXPORTER and
+# OTEL_METRICS_EXPORTER. Exporters are imported on use only.
+SpanExporterFactory = Callable[[], Any]
+MetricReaderFactory = Callable[[], Any]
+_span_exporters: dict[str, SpanExporterFactory] = {}
+_metric_readers: dict[str, MetricReaderFactory] = {}
+
+
+def register_span_exporter(name: str, factory: SpanExporterFactory):
+    """Register a span exporter selectable with ``OTEL_TRACES_EXPORTER``."""
+    _span_exporters[name] = factory
+
+
+def register_metric_reader(name: str, factory: MetricReaderFactory):
+    """Register a metric reader selectable with ``OTEL_METRICS_EXPORTER``."""
+    _metric_readers[name] = factory
+
+
+def _console_span_exporter():
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    return ConsoleSpanExporter()
+
+
+def _otlp_span_exporter():
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+        OTLPSpanExporter,
+    )
+
+    return OTLPSpanExporter()
+
+
+def _console_metric_reader():
+    from opentelemetry.sdk.metrics.export import (
+        ConsoleMetricExporter,
+        PeriodicExportingMetricReader,
+    )
+
+    return PeriodicExportingMetricReader(ConsoleMetricExporter())
+
+
+def _otlp_metric_reader():
+    from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import (
+        OTLPMetricExporter,
+    )
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+    return PeriodicExportingMetricReader(OTLPMetricExporter())
+
+
+register_span_exporter("console", _console_span_exporter)
+register_span_exporter("otlp", _otlp_span_exporter)
+register_metric_reader("console", _console_metric_reader)
+register_metric_reader("otlp", _otlp_metric_reader)
+
+
+def configure_telemetry(
+    span_exporter: Optional[Any] = None,
+    metric_reader: Optional[Any] = None,
+    service_name: str = "bastion-auto-shutdown",
+) -> bool:
+    """Install the tracer and meter providers of the OpenTelemetry SDK.
+
+    Exporters default to the ones named by ``OTEL_TRACES_EXPORTER`` and
+    ``OTEL_METRICS_EXPORTER`` ("console", "otlp" or a registered name). When
+    neither is given nor configured, nothing is installed and the
+    instrumentation stays a no-op.
+
+    Parameters
+    ----------
+    span_exporter : Optional[SpanExporter], optional
+        Exporter of the spans, e.g. an ``InMemorySpanExporter``, by default None
+    metric_reader : Optional[MetricReader], optional
+        Reader of the metrics, e.g. an ``InMemoryMetricReader``, by default None
+    service_name : str, optional
+        Service name of the resource, by default "bastion-auto-shutdown"
+
+    Returns
+    -------
+    bool
+        Whether a provider was installed.
+    """
+    if span_exporter is None:
+        span_exporter = _from_env("OTEL_TRACES_EXPORTER", _span_exporters)
+    if metric_reader is None:
+        metric_reader = _from_env("OTEL_METRICS_EXPORTER", _metric_readers)
+    if span_exporter is None and metric_reader is None:
+        return False
+
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    resource = Resource.create({"service.name": service_name})
+    if span_exporter is not None:
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(tracer_provider)
+    if metric_reader is not None:
+        metrics.set_meter_provider(
+            MeterProvider(resource=resource, metric_readers=[metric_reader])
+        )
+    logger.info(
+        f"Telemetry configured: spans {type(span_exporter).__name__}, "
+        f"metrics {type(metric_reader).__name__}"
+    )
+    return True
+
+
+def _from_env(variable: str, factories: dict[str, Callable[[], Any]]):
+    name = os.getenv(variable, "none").lower()
+    if name == "none":
+        return None
+    try:
+        return factories[name]()
+    except KeyError:
+        logger.warning(f"Unknown {variable} {name}, not exporting")
+        return None
+
+
+@contextmanager
+def phase(name: str, **attributes: Any) -> Iterator[Span]:
+    """Trace a phase of an invocation as a span.
+
+    Exceptions are recorded on the span and re-raised. Attributes known only
+    at the end of the phase, like record counts or outcomes, can be set on the
+    yielded span.
+    """
+    with tracer.start_as_current_span(
+        name, attributes=attributes, record_exception=True, set_status_on_exception=True
+    ) as span:
+        yield span
+
+
+def record_provisioning(operation: str, duration: float, succeeded: bool):
+    """Record the duration of a provisioning (``up``) or deprovisioning run."""
+    provisioning_duration.record(
+        duration,
+        attributes={
+            "operation": operation,
+            "outcome": "succeeded" if succeeded else "failed",
+        },
+    )
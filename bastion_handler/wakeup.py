@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import TYPE_CHECKING, Optional
+
+from azure.core.exceptions import ResourceExistsError
+
+from bastion_handler.state import Summary
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+logger = getLogger(__name__)
+
+# Longest visibility timeout of a storage queue message
+MAX_VISIBILITY_TIMEOUT = timedelta(days=7)
+
+
+def next_wakeup(
+    summary: Summary, now: datetime, lead_time: timedelta = timedelta(0)
+) -> Optional[datetime]:
+    """Next time after ``now`` when the desired state may change.
+
+    That is either when the next reservation enters its pre-provisioning lead
+    time or when the next reservation ends.
+    """
+    candidates = []
+    if summary.next_start is not None and summary.next_start - lead_time > now:
+        candidates.append(summary.next_start - lead_time)
+    if summary.next_end is not None and summary.next_end > now:
+        candidates.append(summary.next_end)
+    return min(candidates, default=None)
+
+
+class WakeupScheduler:
+    """Schedules a reconcile at an exact time through a storage queue.
+
+    A message is sent with its visibility timeout set to the time left until
+    the wake-up, so the queue-triggered function only runs when it is due. A
+    wake-up that is already scheduled by this worker is not sent again.
+
+    Parameters
+    ----------
+    queue : QueueClient
+        Queue consumed by the wake-up function.
+    target : Optional[str], optional
+        Name of the target to reconcile on wake-up, by default all targets
+    """
+
+    def __init__(self, queue: QueueClient, target: Optional[str] = None):
+        self.queue = queue
+        self.target = target
+        self._scheduled: Optional[datetime] = None
+        self._created = False
+        self._lock = threading.Lock()
+
+    def schedule(self, at: datetime, now: datetime) -> bool:
+        """Schedule a wake-up at ``at``.
+
+        Wake-ups further away than the longest visibility timeout are sent for
+        that timeout instead, and the reconcile they trigger schedules the next.
+
+        Returns
+        -------
+        bool
+            Whether a message was sent.
+        """
+        with self._lock:
+            if at == self._scheduled:
+                return False
+            delay = min(max(at - now, timedelta(0)), MAX_VISIBILITY_TIMEOUT)
+            self._ensure_queue()
+            message = {"at": at.isoformat()}
+            if self.target is not None:
+                message["target"] = self.target
+            self.queue.send_message(
+                json.dumps(message),
+                visibility_timeout=math.ceil(delay.total_seconds()),
+                time_to_live=-1,
+            )
+            self._scheduled = at
+        logger.info(f"Scheduled a wake-up at {at.isoformat()}")
+        return True
+
+    def _ensure_queue(self):
+        if self._created:
+            return
+        try:
+            self.queue.create_queue()
+        except ResourceExistsError:
+            pass
+        self._created = True
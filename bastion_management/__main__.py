@@ -2,6 +2,8 @@
 
 import pulumi
 
+from azure_infra import providers
 from bastion_management.main import main
 
 main()
+providers.log_report()
@@ -1,21 +1,22 @@
-import json
+from __future__ import annotations
+
 from pathlib import Path
-from typing import Literal, TypedDict
+from typing import TYPE_CHECKING, TypedDict
 
-import azure_infra.names as common_names
-import jinja2
 import pulumi
-import pulumi_azure_native as azure_native
-from pulumi_azure_native.app import LogicApp
-from pulumi_azure_native.documentdb import DatabaseAccount
-from pulumi_azure_native.logic import Workflow
-from pulumi_azure_native.resources import ResourceGroup
-from pulumi_azure_native.storage import StorageAccount
-from pulumi_azure_native.web import AppServicePlan, AzureStorageType, WebApp
 
+import azure_infra.names as common_names
+from azure_infra import providers
 from bastion_management import names
+from bastion_management.workflows import RenderedWorkflow, TemplateRegistry
 
 current_dir = Path(__file__).parent
+templates = TemplateRegistry(current_dir / "templates")
+
+if TYPE_CHECKING:
+    from pulumi_azure_native.app import LogicApp
+    from pulumi_azure_native.resources import ResourceGroup
+    from pulumi_azure_native.web import WebApp
 
 
 class DefinedResources(TypedDict):
@@ -57,15 +58,17 @@ def apply_bastion_management(
     #     logic_app_name=names.BM_LOGIC_REGISTER_NAME,
     #     resource_group_name=rg.name,
     # )
-    register_logic_app = Workflow(
+    register_workflow = render_workflow(rg, "register")
+    register_logic_app = providers.logic.Workflow(
         names.BM_LOGIC_REGISTER_NAME,
         resource_group_name=rg.name,
         location=rg.location,
-        definition=read_logicapp_template(rg, "register"),
+        definition=register_workflow.apply(lambda workflow: workflow.definition),
+        parameters=register_workflow.apply(lambda workflow: workflow.parameters),
         workflow_name=names.BM_LOGIC_REGISTER_NAME,
     )
 
-    handler_service_plan = AppServicePlan(
+    handler_service_plan = providers.web.AppServicePlan(
         names.BM_APPSERVICE_PLAN_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -103,7 +106,7 @@ def apply_bastion_management(
         "AZURE_STORAGE_CONNECTION_STRING": blob_connection_string,  # For pulumi
         "NO_COLOR": "true",
     }
-    handler_app = WebApp(
+    handler_app = providers.web.WebApp(
         names.BM_FUNC_HANDLER_NAME,
         resource_group_name=rg.name,
         location=rg.location,
@@ -116,12 +119,12 @@ def apply_bastion_management(
                 {
                     "name": "DOCUMENTDB",
                     "connection_string": cosmosdb_connection_string,
-                    "type": azure_native.web.ConnectionStringType.DOC_DB,
+                    "type": providers.web.ConnectionStringType.DOC_DB,
                 }
             ],
             "azure_storage_accounts": {
                 "pulumi-root": {
-                    "type": AzureStorageType.AZURE_FILES,
+                    "type": providers.web.AzureStorageType.AZURE_FILES,
                     "name": "AzureWebJobsStorage",
                     "account_name": common_names.COMMON_SYSAD_FILE_ACCOUNT_NAME,
                     "share_name": "iac",
@@ -142,26 +145,18 @@ def apply_bastion_management(
 apply = apply_bastion_management
 
 
-def read_logicapp_template(
-    rg: ResourceGroup,
-    name: str,
-    key: Literal["definition", "properties", None] = "definition",
-) -> dict:
-    template_path = current_dir / "templates" / f"{name}.json.j2"
+def render_workflow(rg: ResourceGroup, name: str) -> pulumi.Output[RenderedWorkflow]:
+    """Render the Logic App template ``name`` for a resource group.
+
+    The definition and parameters of the workflow are taken from the one
+    rendered output, so the template is rendered and parsed once.
+    """
     subscription_id = rg.id.apply(lambda rg_id: rg_id.split("/")[2])
-    result = (
-        pulumi.Output.all(rg.name, rg.location, subscription_id)
-        .apply(
-            lambda args: jinja2.Template(template_path.read_text()).render(
-                resource_group_name=args[0],
-                location=args[1],
-                subscription_id=args[2],
-            )
-        )
-        .apply(
-            lambda content: (
-                json.loads(content)[key] if key is not None else json.loads(content)
-            )
+    return pulumi.Output.all(rg.name, rg.location, subscription_id).apply(
+        lambda args: templates.render(
+            name,
+            resource_group=args[0],
+            location=args[1],
+            subscription_id=args[2],
         )
     )
-    return result
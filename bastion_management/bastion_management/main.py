@@ -1,6 +1,6 @@
 import azure_infra.names as common_names
 import pulumi
-from pulumi_azure_native.resources import ResourceGroup
+from azure_infra import providers
 
 from bastion_management import app
 
@@ -15,7 +15,7 @@ def main():
         "env": "dev",
         "agg": "common",
     }
-    rg_bastion = ResourceGroup.get(
+    rg_bastion = providers.resources.ResourceGroup.get(
         common_names.RG_BASTION_NAME,
         id=stack.get_output(common_names.EXPORT_RG_BASTION_ID),
     )
@@ -0,0 +1,111 @@
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import jinja2
+
+TEMPLATE_SUFFIX = ".json.j2"
+WORKFLOW_SCHEMA = (
+    "https://schema.management.azure.com/providers/Microsoft.Logic/schemas/"
+    "2016-06-01/workflowdefinition.json#"
+)
+# Keys of the definition required by the workflow definition schema
+DEFINITION_KEYS = {
+    "$schema": str,
+    "contentVersion": str,
+    "triggers": dict,
+    "actions": dict,
+}
+CONNECTION_KEYS = ("connectionId", "connectionName", "id")
+CONNECTION_REFERENCE = re.compile(r"parameters\('\$connections'\)\['([^']+)'\]")
+
+
+class TemplateError(ValueError):
+    """Raised when a rendered Logic App template is not a valid workflow."""
+
+
+@dataclass(frozen=True)
+class RenderedWorkflow:
+    """Definition and parameters of a workflow, rendered from one template."""
+
+    definition: dict[str, Any]
+    parameters: dict[str, Any]
+
+    @property
+    def connections(self) -> dict[str, Any]:
+        return self.parameters.get("$connections", {}).get("value", {})
+
+
+class TemplateRegistry:
+    """Logic App templates of a directory, compiled once.
+
+    Every ``<name>.json.j2`` template is loaded and compiled when the registry
+    is created. A template rendered again with the same variables is parsed
+    only once, and the definition and the ``$connections`` parameter come from
+    that one parse.
+
+    Parameters
+    ----------
+    directory : Path
+        Directory of the templates.
+    """
+
+    def __init__(self, directory: Path):
+        self.environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(directory),
+            undefined=jinja2.StrictUndefined,
+            auto_reload=False,
+        )
+        self.templates = {
+            path.name[: -len(TEMPLATE_SUFFIX)]: self.environment.get_template(path.name)
+            for path in sorted(directory.glob(f"*{TEMPLATE_SUFFIX}"))
+        }
+        self._rendered: dict[tuple, RenderedWorkflow] = {}
+
+    def render(self, name: str, **variables: str) -> RenderedWorkflow:
+        """Render and validate the template ``name``."""
+        key = (name, tuple(sorted(variables.items())))
+        if key not in self._rendered:
+            try:
+                template = self.templates[name]
+            except KeyError:
+                raise TemplateError(f"Unknown workflow template {name}") from None
+            content = json.loads(template.render(**variables))
+            workflow = RenderedWorkflow(
+                definition=content.get("definition"),
+                parameters=content.get("parameters") or {},
+            )
+            validate_workflow(name, workflow)
+            self._rendered[key] = workflow
+        return self._rendered[key]
+
+
+def validate_workflow(name: str, workflow: RenderedWorkflow):
+    """Check a rendered workflow against the workflow definition schema.
+
+    The definition must have the schema's required keys, every connection
+    must be complete, and every connection the definition refers to must be
+    given in ``$connections``.
+    """
+    definition = workflow.definition
+    if not isinstance(definition, dict):
+        raise TemplateError(f"{name}: the template has no definition")
+    if definition.get("$schema") != WORKFLOW_SCHEMA:
+        raise TemplateError(f"{name}: unexpected schema {definition.get('$schema')}")
+    for key, type_ in DEFINITION_KEYS.items():
+        if not isinstance(definition.get(key), type_):
+            raise TemplateError(f"{name}: {key} must be a {type_.__name__}")
+    connections = workflow.connections
+    for connection_name, connection in connections.items():
+        missing = [key for key in CONNECTION_KEYS if not connection.get(key)]
+        if missing:
+            raise TemplateError(
+                f"{name}: connection {connection_name} has no {missing}"
+            )
+    referenced = set(CONNECTION_REFERENCE.findall(json.dumps(definition)))
+    if referenced - connections.keys():
+        raise TemplateError(
+            f"{name}: missing connections {sorted(referenced - connections.keys())}"
+        )
@@ -0,0 +1,428 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, Optional
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+
+class FakeContainer:
+    """In-process stand-in for a cosmos ``ContainerProxy`` partitioned by ``/title``.
+
+    Documents are serialized on every write and read, like they are on the
+    wire, so that the benchmarks account for the size of the documents.
+    Writes are appended to the change feed of one of ``feed_ranges`` ranges,
+    chosen by the partition key, and stamped with ``_ts`` from ``clock``.
+    """
+
+    def __init__(
+        self,
+        items: Optional[list[dict]] = None,
+        feed_ranges: int = 1,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._items: dict[tuple[str, str], str] = {}
+        self._etags = itertools.count(1)
+        self._changes: list[list[str]] = [[] for _ in range(feed_ranges)]
+        self.client_connection = FakeConnection()
+        self.clock = clock
+        for item in items or []:
+            self.create_item(item)
+
+    def read_item(self, item: str, partition_key: str) -> dict:
+        try:
+            return json.loads(self._items[(partition_key, item)])
+        except KeyError:
+            raise ResourceNotFoundError(f"{item} not found") from None
+
+    def create_item(self, body: dict) -> dict:
+        key = (body["title"], body["id"])
+        if key in self._items:
+            raise ResourceExistsError(f"{body['id']} exists")
+        return self._write(key, body)
+
+    def replace_item(
+        self,
+        item: str,
+        body: dict,
+        etag: Optional[str] = None,
+        match_condition: Optional[MatchConditions] = None,
+    ) -> dict:
+        key = (body["title"], item)
+        if match_condition == MatchConditions.IfNotModified:
+            if key not in self._items or self.read_item(item, key[0])["_etag"] != etag:
+                raise CosmosAccessConditionFailedError(
+                    status_code=412, message=f"{item} was modified"
+                )
+        return self._write(key, body)
+
+    def delete_item(self, item: str, partition_key: str):
+        try:
+            del self._items[(partition_key, item)]
+        except KeyError:
+            raise ResourceNotFoundError(f"{item} not found") from None
+
+    def execute_item_batch(
+        self, batch_operations: list[tuple[str, tuple[str]]], partition_key: str
+    ) -> list[dict]:
+        for _, (item_id,) in batch_operations:
+            self._items.pop((partition_key, item_id), None)
+        return [{"statusCode": 204} for _ in batch_operations]
+
+    def query_items(
+        self,
+        query: str,
+        parameters: list[dict[str, Any]],
+        max_item_count: int = 100,
+        **kwargs,
+    ) -> "FakeItemPaged":
+        values = {parameter["name"]: parameter["value"] for parameter in parameters}
+        records = [
+            {
+                key: item[key]
+                for key in ("id", "title", "start", "end", "target")
+                if key in item
+            }
+            for item in map(json.loads, self._items.values())
+            if "start" in item
+            and item["end"] >= values["@now"]
+            and item["start"] <= values["@horizon"]
+        ]
+        return FakeItemPaged(records, max_item_count)
+
+    def read_feed_ranges(self) -> list[dict]:
+        return [{"Range": {"min": i, "max": i + 1}} for i in range(len(self._changes))]
+
+    def query_items_change_feed(
+        self,
+        max_item_count: int = 100,
+        continuation: Optional[str] = None,
+        feed_range: Optional[dict] = None,
+        start_time: Any = "Now",
+        **kwargs,
+    ) -> "FakeChangeFeed":
+        if continuation is not None:
+            position = json.loads(continuation)
+            index, offset = position["range"], position["offset"]
+        else:
+            index = feed_range["Range"]["min"] if feed_range else 0
+            changes = self._changes[index]
+            if isinstance(start_time, datetime):
+                offset = next(
+                    (
+                        i
+                        for i, change in enumerate(changes)
+                        if json.loads(change)["_ts"] >= start_time.timestamp()
+                    ),
+                    len(changes),
+                )
+            else:
+                offset = 0 if start_time == "Beginning" else len(changes)
+        return FakeChangeFeed(self, index, offset, max_item_count)
+
+    def _write(self, key: tuple[str, str], body: dict) -> dict:
+        etag = next(self._etags)
+        document = dict(body, _etag=f'"{etag}"', _lsn=etag, _ts=int(self.clock()))
+        self._items[key] = json.dumps(document)
+        index = zlib.crc32(key[0].encode()) % len(self._changes)
+        self._changes[index].append(self._items[key])
+        return json.loads(self._items[key])
+
+
+class FakeConnection(threading.local):
+    """Client connection holding the last response headers of each thread."""
+
+    def __init__(self):
+        self.last_response_headers: dict[str, str] = {}
+
+
+class FakeChangeFeed:
+    """Result of :meth:`FakeContainer.query_items_change_feed`, one page long."""
+
+    def __init__(self, container: FakeContainer, index: int, offset: int, size: int):
+        self.container = container
+        self.index = index
+        self.offset = offset
+        self.size = size
+
+    def by_page(self) -> Iterator[list[dict]]:
+        changes = self.container._changes[self.index]
+        page = [json.loads(c) for c in changes[self.offset : self.offset + self.size]]
+        position = {"range": self.index, "offset": self.offset + len(page)}
+        self.container.client_connection.last_response_headers = {
+            "etag": json.dumps(position)
+        }
+        return iter([page] if page else [])
+
+
+class FakeItemPaged:
+    """Result of :meth:`FakeContainer.query_items`."""
+
+    def __init__(self, records: list[dict], page_size: int):
+        self.records = records
+        self.page_size = page_size
+
+    def by_page(self, continuation_token: Optional[str] = None) -> "FakePager":
+        return FakePager(self.records, self.page_size, int(continuation_token or 0))
+
+
+class FakePager:
+    def __init__(self, records: list[dict], page_size: int, offset: int):
+        self.records = records
+        self.page_size = page_size
+        self.offset = offset
+        self.continuation_token: Optional[str] = None
+
+    def __iter__(self) -> Iterator[list[dict]]:
+        while self.offset < len(self.records):
+            page = self.records[self.offset : self.offset + self.page_size]
+            self.offset += len(page)
+            self.continuation_token = (
+                str(self.offset) if self.offset < len(self.records) else None
+            )
+            yield page
+
+
+class FakeResourceManagementClient:
+    """Stand-in for ``ResourceManagementClient`` holding a set of resource ids."""
+
+    def __init__(self, resource_ids: Optional[set[str]] = None):
+        self.resource_ids = {r.lower() for r in resource_ids or set()}
+        self.resources = SimpleNamespace(get_by_id=self._get_by_id)
+        self.requests = 0
+
+    def _get_by_id(self, resource_id: str, api_version: str, cls=None, **kwargs):
+        self.requests += 1
+        if resource_id.lower() not in self.resource_ids:
+            raise ResourceNotFoundError(f"{resource_id} not found")
+        resource = SimpleNamespace(
+            id=resource_id, properties={"provisioningState": "Succeeded"}
+        )
+        response = SimpleNamespace(http_response=SimpleNamespace(headers={}))
+        return cls(response, resource, {}) if cls else resource
+
+
+class FakeQueue:
+    """Stand-in for a storage ``QueueClient`` that only counts messages."""
+
+    def __init__(self):
+        self.messages: list[tuple[str, dict]] = []
+
+    def create_queue(self):
+        pass
+
+    def send_message(self, content: str, **kwargs):
+        self.messages.append((content, kwargs))
+
+
+class FakeLeaseStore:
+    """Stand-in for :class:`~bastion_handler.changefeed.BlobLeaseStore` in memory."""
+
+    lease_duration = 60
+
+    def __init__(self):
+        self.tokens: dict[str, Optional[str]] = {}
+        self.held: set[str] = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, feed_range: Any = None) -> Optional["FakeLease"]:
+        with self._lock:
+            if key in self.held:
+                return None
+            self.held.add(key)
+        return FakeLease(self, key, self.tokens.get(key))
+
+    def last_checkpoint(self, feed_range: Any) -> None:
+        return None
+
+
+class FakeLease:
+    def __init__(self, store: FakeLeaseStore, key: str, token: Optional[str]):
+        self.store = store
+        self.key = key
+        self.token = token
+
+    def checkpoint(self, token: str):
+        self.store.tokens[self.key] = token
+        self.token = token
+
+    def renew(self):
+        pass
+
+    def release(self):
+        self.store.held.discard(self.key)
+
+
+class FakeSingleFlight:
+    """Stand-in for :class:`~bastion_handler.lock.SingleFlight` without a lease."""
+
+    def submit(self, state: str, reconcile) -> bool:
+        reconcile(state)
+        return True
+
+
+def _http_error(cls: type[HttpResponseError], status_code: int, message: str):
+    error = cls(message=message)
+    error.status_code = status_code
+    return error
+
+
+class FakeBlobContainer:
+    """In-memory stand-in for a storage ``ContainerClient``.
+
+    Blob clients of the same name share their blob, so that several
+    instances of a class backed by the container see each other's writes,
+    leases and etags like separate function instances do.
+    """
+
+    def __init__(
+        self, clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc)
+    ):
+        self.blobs: dict[str, SimpleNamespace] = {}
+        self.created = False
+        self.clock = clock
+        self._etags = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_container(self):
+        with self._lock:
+            if self.created:
+                raise _http_error(ResourceExistsError, 409, "Container exists")
+            self.created = True
+
+    def get_blob_client(self, blob: str) -> "FakeBlobClient":
+        return FakeBlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with: str = "", **kwargs) -> list[SimpleNamespace]:
+        with self._lock:
+            if not self.created:
+                raise _http_error(ResourceNotFoundError, 404, "Container not found")
+            return [
+                SimpleNamespace(
+                    name=name,
+                    metadata=dict(blob.metadata),
+                    last_modified=blob.last_modified,
+                )
+                for name, blob in sorted(self.blobs.items())
+                if name.startswith(name_starts_with)
+            ]
+
+
+class FakeBlobClient:
+    """Blob client of a :class:`FakeBlobContainer`."""
+
+    def __init__(self, container: FakeBlobContainer, name: str):
+        self.container = container
+        self.name = name
+
+    def _get(self) -> SimpleNamespace:
+        try:
+            return self.container.blobs[self.name]
+        except KeyError:
+            raise _http_error(
+                ResourceNotFoundError, 404, f"{self.name} not found"
+            ) from None
+
+    def _check_lease(self, blob: SimpleNamespace, lease: Optional["FakeBlobLease"]):
+        if blob.lease is not None and (lease is None or lease.id != blob.lease):
+            raise _http_error(HttpResponseError, 412, f"{self.name} is leased")
+
+    def upload_blob(
+        self,
+        data: Any,
+        overwrite: bool = False,
+        etag: Optional[str] = None,
+        match_condition: Optional[MatchConditions] = None,
+        lease: Optional["FakeBlobLease"] = None,
+        metadata: Optional[dict[str, str]] = None,
+        **kwargs,
+    ):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.container._lock:
+            blob = self.container.blobs.get(self.name)
+            if blob is not None:
+                if not overwrite:
+                    raise _http_error(ResourceExistsError, 409, f"{self.name} exists")
+                if match_condition == MatchConditions.IfNotModified and (
+                    etag != blob.etag
+                ):
+                    raise _http_error(
+                        ResourceModifiedError, 412, f"{self.name} was modified"
+                    )
+                self._check_lease(blob, lease)
+            elif match_condition == MatchConditions.IfNotModified:
+                raise _http_error(ResourceModifiedError, 412, f"{self.name} is gone")
+            self.container.blobs[self.name] = SimpleNamespace(
+                data=bytes(data),
+                etag=f'"{next(self.container._etags)}"',
+                metadata=dict(metadata or {}),
+                lease=blob.lease if blob else None,
+                last_modified=self.container.clock(),
+            )
+            written = self.container.blobs[self.name]
+            return {"etag": written.etag, "last_modified": written.last_modified}
+
+    def download_blob(self, **kwargs) -> SimpleNamespace:
+        with self.container._lock:
+            blob = self._get()
+            data = blob.data
+            return SimpleNamespace(
+                readall=lambda: data, properties=SimpleNamespace(etag=blob.etag)
+            )
+
+    def get_blob_properties(self, **kwargs) -> SimpleNamespace:
+        with self.container._lock:
+            blob = self._get()
+            return SimpleNamespace(
+                etag=blob.etag,
+                metadata=dict(blob.metadata),
+                lease=SimpleNamespace(state="leased" if blob.lease else "available"),
+            )
+
+    def set_blob_metadata(
+        self, metadata: dict[str, str], lease: Optional["FakeBlobLease"] = None
+    ):
+        with self.container._lock:
+            blob = self._get()
+            self._check_lease(blob, lease)
+            blob.metadata = dict(metadata)
+            blob.etag = f'"{next(self.container._etags)}"'
+            blob.last_modified = self.container.clock()
+
+    def acquire_lease(self, lease_duration: int = -1, **kwargs) -> "FakeBlobLease":
+        with self.container._lock:
+            blob = self._get()
+            if blob.lease is not None:
+                raise _http_error(HttpResponseError, 409, f"{self.name} is leased")
+            blob.lease = uuid.uuid4().hex
+            return FakeBlobLease(self, blob.lease)
+
+
+class FakeBlobLease:
+    """Lease of a :class:`FakeBlobClient` blob, which never expires."""
+
+    def __init__(self, blob: FakeBlobClient, lease_id: str):
+        self.blob = blob
+        self.id = lease_id
+
+    def renew(self):
+        pass
+
+    def release(self):
+        with self.blob.container._lock:
+            blob = self.blob._get()
+            if blob.lease == self.id:
+                blob.lease = None
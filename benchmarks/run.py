@@ -0,0 +1,307 @@
+"""Offline benchmarks of the function app.
+
+Cosmos db, ARM and the pulumi CLI are replaced by the in-process fakes of
+:mod:`benchmarks.fakes` and the stub of :mod:`benchmarks.stub_pulumi`, so the
+suite runs without any Azure resource. Results are written as JSON.
+
+Usage::
+
+    python -m benchmarks.run --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000]
+
+# Settings of function_app, read when it is imported
+os.environ.setdefault("TARGET_SUBSCRIPTION_ID", "00000000-0000-0000-0000-000000000000")
+os.environ.setdefault("TARGET_RESOURCE_GROUP", "rg-bench")
+os.environ.setdefault("TARGET_RESOURCE_NAME", "bastion-bench")
+os.environ.setdefault("PULUMI_LOCAL_CACHE", "false")
+
+
+def measure(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] = None):
+    """Wall-clock durations of ``repeat`` calls of ``fn`` in seconds."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def summarize(name: str, samples: list[float], **params) -> dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        "name": name,
+        "params": params,
+        "unit": "s",
+        "samples": samples,
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[max(round(0.95 * len(ordered)) - 1, 0)],
+    }
+
+
+def bench_cold_import(repeat: int) -> list[dict[str, Any]]:
+    """Time to import function_app in a fresh interpreter."""
+    command = [sys.executable, "-c", "import function_app"]
+    samples = measure(
+        lambda: subprocess.run(command, cwd=ROOT, check=True, env=os.environ),
+        repeat,
+    )
+    baseline = measure(
+        lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), repeat
+    )
+    return [
+        summarize("cold_import", samples),
+        summarize("interpreter_startup", baseline),
+    ]
+
+
+def make_records(count: int) -> list[dict]:
+    """``count`` reservations, one of them active and the others upcoming."""
+    import function_app
+
+    now = function_app.utcnow().replace(tzinfo=None)
+    records = []
+    for i in range(count):
+        start = now + timedelta(hours=i) - timedelta(minutes=30)
+        records.append(
+            {
+                "id": f"reservation-{i}",
+                "title": f"user-{i % 50}",
+                "start": start.isoformat(),
+                "end": (start + timedelta(hours=1)).isoformat(),
+            }
+        )
+    return records
+
+
+def bench_decision(sizes: list[int], repeat: int) -> list[dict[str, Any]]:
+    """Latency of ``http_trigger`` deciding on batches of changed records.
+
+    The target resource exists, so the decision never provisions. Measured
+    are the bootstrap of the state document from the container, a batch of
+    unchanged records on a warm reconciler, a redelivered batch dropped by
+    the change-feed cache and a batch of new records.
+    """
+    import azure.functions as func
+
+    import function_app
+    from bastion_handler.dedup import ChangeFeedDeduplicator
+    from bastion_handler.leadtime import LeadTimeEstimator
+    from bastion_handler.state import Reconciler
+    from bastion_handler.wakeup import WakeupScheduler
+    from benchmarks.fakes import (
+        FakeContainer,
+        FakeQueue,
+        FakeResourceManagementClient,
+        FakeSingleFlight,
+    )
+
+    clients = function_app.clients
+    target = function_app.get_default_target()
+    key = partial(function_app.target_key, target=target)
+    clients.register(
+        f"resource:{target.subscription_id}",
+        lambda: FakeResourceManagementClient({target.resource_id}),
+    )
+    clients.register(
+        key("lead_time"), lambda: LeadTimeEstimator(None, timedelta(0), learn=False)
+    )
+    clients.register(key("wakeup"), lambda: WakeupScheduler(FakeQueue(), target.name))
+    clients.register(key("single_flight"), FakeSingleFlight)
+
+    results = []
+    for size in sizes:
+        records = make_records(size)
+        documents = func.DocumentList(map(func.Document.from_dict, records))
+
+        def reset(with_records: bool):
+            container = FakeContainer(records if with_records else [])
+            clients.register("container", lambda: container)
+            clients.register(
+                key("reconciler"),
+                lambda: Reconciler(
+                    container,
+                    query=partial(function_app.read_data_from_cosmos, target),
+                    document_id=target.state_document_id,
+                ),
+            )
+            clients.get(key("probe")).invalidate()
+            clients.register("change_feed_dedup", ChangeFeedDeduplicator)
+
+        bootstrap = measure(
+            lambda: function_app.reconcile_target(target, [], verify=False),
+            repeat,
+            setup=lambda: reset(True),
+        )
+        results.append(summarize("decision_bootstrap", bootstrap, records=size))
+
+        reset(False)
+        function_app.http_trigger(documents)
+        incremental = measure(lambda: function_app.http_trigger(documents), repeat)
+        results.append(summarize("decision_incremental", incremental, records=size))
+
+        versioned = func.DocumentList(
+            func.Document.from_dict({**record, "_etag": f'"{i}"'})
+            for i, record in enumerate(records)
+        )
+        reset(False)
+        function_app.http_trigger(versioned)
+        redelivered = measure(lambda: function_app.http_trigger(versioned), repeat)
+        results.append(summarize("decision_redelivered", redelivered, records=size))
+
+        reset(False)
+        cold = measure(
+            lambda: function_app.http_trigger(documents),
+            repeat,
+            setup=lambda: reset(False),
+        )
+        results.append(summarize("decision_new_batch", cold, records=size))
+    return results
+
+
+def bench_change_feed(sizes: list[int], repeat: int) -> list[dict[str, Any]]:
+    """Throughput of the pull-model change-feed processor over four feed ranges.
+
+    Measured is reading every change of the container in batches and
+    checkpointing them, with a handler that only counts the documents.
+    """
+    from bastion_handler.changefeed import ChangeFeedProcessor
+    from benchmarks.fakes import FakeContainer, FakeLeaseStore
+
+    results = []
+    for size in sizes:
+        container = FakeContainer(make_records(size), feed_ranges=4)
+        processed = []
+
+        def drain():
+            processor = ChangeFeedProcessor(
+                lambda: container,
+                FakeLeaseStore(),
+                lambda batch: processed.append(len(batch)),
+                max_items=100,
+                start_time="Beginning",
+            )
+            assert processor.run_once() == size
+
+        results.append(
+            summarize("change_feed_drain", measure(drain, repeat), records=size)
+        )
+    return results
+
+
+def install_stub_pulumi(directory: Path) -> Path:
+    """Put an executable ``pulumi`` running the stub CLI into ``directory``."""
+    executable = directory / "pulumi"
+    stub = ROOT / "benchmarks" / "stub_pulumi.py"
+    executable.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{stub}" "$@"\n')
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    return executable
+
+
+def bench_subprocess(repeat: int) -> list[dict[str, Any]]:
+    """Overhead of running the pulumi CLI through the provisioning driver."""
+    import function_app
+    from bastion_handler.provisioning import ProvisioningDriver
+    from benchmarks.fakes import FakeResourceManagementClient
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        bin_dir = tmp_dir / "bin"
+        work_dir = tmp_dir / "program"
+        bin_dir.mkdir()
+        work_dir.mkdir()
+        (work_dir / "Pulumi.yaml").write_text("name: bench\nruntime: python\n")
+        executable = install_stub_pulumi(bin_dir)
+
+        spawn = measure(
+            lambda: subprocess.run(
+                [str(executable), "version"], check=True, capture_output=True
+            ),
+            repeat,
+        )
+
+        driver = ProvisioningDriver(
+            work_dir, "bench", pulumi_root=str(bin_dir), pulumi_home=str(tmp_dir)
+        )
+        target = function_app.get_default_target()
+        function_app.clients.register(
+            function_app.target_key("driver", target), lambda: driver
+        )
+        function_app.clients.register(
+            f"resource:{target.subscription_id}", FakeResourceManagementClient
+        )
+        started = time.perf_counter()
+        driver.stack
+        select = time.perf_counter() - started
+
+        create = measure(partial(function_app.create_resources, target), repeat)
+        delete = measure(partial(function_app.delete_resources, target), repeat)
+    return [
+        summarize("pulumi_spawn", spawn),
+        summarize("pulumi_select_stack", [select]),
+        summarize("create_resources", create),
+        summarize("delete_resources", delete),
+    ]
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="JSON file, stdout by default")
+    parser.add_argument(
+        "--only",
+        choices=["import", "decision", "change_feed", "subprocess"],
+        nargs="+",
+        default=["import", "decision", "change_feed", "subprocess"],
+    )
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(ROOT))
+    results = []
+    if "import" in args.only:
+        results += bench_cold_import(args.repeat)
+    if "decision" in args.only:
+        results += bench_decision(args.sizes, args.repeat)
+    if "change_feed" in args.only:
+        results += bench_change_feed(args.sizes, args.repeat)
+    if "subprocess" in args.only:
+        results += bench_subprocess(args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Stub of the ``pulumi`` CLI answering the commands of the Automation API.
+
+Runs take ``STUB_PULUMI_DELAY`` seconds (0 by default), so that the measured
+time is the overhead of spawning the CLI and parsing its output. When the
+Automation API asks for an event log, one resource step and the closing
+cancel event are written to it.
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+VERSION = "v3.130.0"
+STUB_URN = "urn:pulumi:dev::stub::stub:index:Resource::stub"
+
+
+def write_events(path: str, op: str):
+    metadata = {"op": op, "urn": STUB_URN, "type": "stub:index:Resource"}
+    events = [
+        {"resourcePreEvent": {"metadata": metadata}},
+        {"resOutputsEvent": {"metadata": metadata}},
+        {"cancelEvent": {}},
+    ]
+    with open(path, "a", encoding="utf-8") as f:
+        for sequence, event in enumerate(events):
+            f.write(json.dumps({"sequence": sequence, "timestamp": 0, **event}) + "\n")
+
+
+def main(args: list[str]) -> int:
+    command = [arg for arg in args if not arg.startswith("-")][:2]
+    if command[:1] == ["version"]:
+        print(VERSION)
+    elif command[:1] in (["up"], ["destroy"], ["preview"], ["refresh"]):
+        time.sleep(float(os.getenv("STUB_PULUMI_DELAY", "0")))
+        if "--event-log" in args:
+            op = "delete" if command[0] == "destroy" else "create"
+            write_events(args[args.index("--event-log") + 1], op)
+        print(f"{command[0]}: stub run finished")
+    elif command == ["stack", "output"]:
+        print("{}")
+    elif command == ["stack", "history"]:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        print(
+            json.dumps(
+                [
+                    {
+                        "version": 1,
+                        "kind": "update",
+                        "startTime": now,
+                        "endTime": now,
+                        "message": "",
+                        "environment": {},
+                        "config": {},
+                        "result": "succeeded",
+                        "resourceChanges": {"same": 1},
+                    }
+                ]
+            )
+        )
+    elif command == ["stack", "export"]:
+        print(json.dumps({"version": 3, "deployment": {"resources": []}}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
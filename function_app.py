@@ -1,149 +1,1126 @@
+import asyncio
+import contextvars
 import json
 import os
-import subprocess
-from contextlib import contextmanager
-from datetime import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 from logging import getLogger
 from pathlib import Path
-from typing import TypedDict
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlparse
 
 import azure.functions as func
+from azure.core.exceptions import AzureError
 from azure.cosmos import CosmosClient
+from azure.functions.warmup import WarmUpContext
 from azure.identity import DefaultAzureCredential
 from azure.mgmt.resource import ResourceManagementClient
 
+from bastion_handler.changefeed import BlobLeaseStore, ChangeFeedProcessor
+from bastion_handler.clients import ClientRegistry
+from bastion_handler.dedup import ChangeFeedDeduplicator
+from bastion_handler.expiry import delete_expired, delete_expired_async
+from bastion_handler.jobs import (
+    Job,
+    JobQueue,
+    JobRunner,
+    JobStore,
+    Step,
+    verify,
+)
+from bastion_handler.leadtime import LeadTimeEstimator
+from bastion_handler.ledger import LedgerEntry, RunLedger, summarize
+from bastion_handler.localcache import BlobSnapshotCache, DirectoryMirror
+from bastion_handler.lock import SingleFlight
+from bastion_handler.probe import AsyncResourceProbe, ResourceProbe
+from bastion_handler.provisioning import (
+    ProvisioningDriver,
+    ProvisioningError,
+    ProvisioningResult,
+    TargetSpec,
+)
+from bastion_handler.query import iter_reservations
+from bastion_handler.schedule import Record, Reservation, parse_timestamp, utcnow
+from bastion_handler.state import Decision, Reconciler
+from bastion_handler.targets import (
+    DEFAULT_TARGET,
+    ReconcileError,
+    Target,
+    TargetRegistry,
+)
+from bastion_handler.telemetry import configure_telemetry, phase
+from bastion_handler.wakeup import WakeupScheduler, next_wakeup
+
 logger = getLogger(__name__)
+# Exporters are selected by OTEL_TRACES_EXPORTER and OTEL_METRICS_EXPORTER
+configure_telemetry()
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 TARGET_SUBSCRIPTION_ID = os.getenv("TARGET_SUBSCRIPTION_ID", "")
 TARGET_RESOURCE_GROUP = os.getenv("TARGET_RESOURCE_GROUP", "")
 TARGET_RESOURCE_NAME = os.getenv("TARGET_RESOURCE_NAME", "")
+TARGET_RESOURCE_TYPE = os.getenv(
+    "TARGET_RESOURCE_TYPE", "Microsoft.Network/bastionHosts"
+)
+TARGET_RESOURCE_API_VERSION = os.getenv("TARGET_RESOURCE_API_VERSION", "2024-01-01")
+TARGET_RESOURCE_STATE_TTL = float(os.getenv("TARGET_RESOURCE_STATE_TTL", "30"))
 TARGET_RESOURCE_ARM_TEMPLATE = os.getenv("TARGET_RESOURCE_ARM_TEMPLATE", "")
 TARGET_COSMOSDB_ACCOUNT = os.getenv("TARGET_COSMOSDB_ACCOUNT", "")
 TARGET_COSMOSDB_DATABASE = os.getenv("TARGET_COSMOSDB_DATABASE", "BastionManagement")
 TARGET_COSMOSDB_CONTAINER = os.getenv("TARGET_COSMOSDB_CONTAINER", "Entries")
+# Account key of the cosmos account, e.g. of the emulator, instead of Entra ID
+TARGET_COSMOSDB_KEY = os.getenv("TARGET_COSMOSDB_KEY", "")
+RESERVATION_HORIZON_DAYS = int(os.getenv("RESERVATION_HORIZON_DAYS", "300"))
+EXPIRY_MAX_WORKERS = int(os.getenv("EXPIRY_MAX_WORKERS", "4"))
 TARGET_ARNS = os.getenv("TARGET_ARNS", "").split(";")
+PULUMI_STACK_NAME = os.getenv("PULUMI_STACK_NAME", "dev")
+PULUMI_ROOT = os.getenv("PULUMI_ROOT", "/mnt/pulumi")
+# Files and directories of PULUMI_ROOT mirrored to the worker: the CLI, the
+# python language host and the provider plugins of the stacks
+PULUMI_MIRROR_INCLUDE = os.getenv(
+    "PULUMI_MIRROR_INCLUDE",
+    "pulumi;pulumi-language-python;plugins/resource-azure-native-*",
+).split(";")
+PULUMI_BACKEND_URL = os.getenv("PULUMI_BACKEND_URL", "")
+# https://<account>.blob.core.windows.net/<container>/<prefix>
+PULUMI_STATE_CONTAINER, _, PULUMI_STATE_PREFIX = (
+    urlparse(PULUMI_BACKEND_URL).path.lstrip("/").partition("/")
+)
+# Worker-local copies of the pulumi CLI, plugins and state snapshot
+PULUMI_LOCAL_CACHE = os.getenv("PULUMI_LOCAL_CACHE", "true").lower() == "true"
+PULUMI_CACHE_DIR = Path(
+    os.getenv("PULUMI_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pulumi-cache"))
+)
+# Keep the bastion's public IP allocated and toggle only the bastion host.
+# Must match the stack config bastion_retain_ip, which protects the IP; runs
+# fail with an error naming both values when they disagree.
+BASTION_RETAIN_IP = os.getenv("BASTION_RETAIN_IP", "false").lower() == "true"
+BASTION_TARGET = "azure-native:network:BastionHost::bastion-common-dev"
+BASTION_IP_TARGET = "azure-native:network:PublicIPAddress::ip-bastion-common-dev"
+PULUMI_TARGET_RESOURCES = os.getenv(
+    "PULUMI_TARGET_RESOURCES",
+    BASTION_TARGET if BASTION_RETAIN_IP else f"{BASTION_TARGET};{BASTION_IP_TARGET}",
+).split(";")
+PULUMI_PARALLEL = int(os.getenv("PULUMI_PARALLEL", "0")) or None
+# Deadlines of a pulumi run and of each of its resource steps, 0 to disable.
+# A cancelled run is interrupted first, and killed after the grace period.
+PULUMI_TIMEOUT_SECONDS = float(os.getenv("PULUMI_TIMEOUT_SECONDS", "1500")) or None
+PULUMI_STEP_TIMEOUT_SECONDS = (
+    float(os.getenv("PULUMI_STEP_TIMEOUT_SECONDS", "900")) or None
+)
+PULUMI_ABORT_GRACE_SECONDS = float(os.getenv("PULUMI_ABORT_GRACE_SECONDS", "10"))
+PROVISIONING_LOCK_CONNECTION_STRING = os.getenv(
+    "PROVISIONING_LOCK_CONNECTION_STRING",
+    os.getenv("AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true"),
+)
+PROVISIONING_LOCK_CONTAINER = os.getenv("PROVISIONING_LOCK_CONTAINER", "locks")
+PREPROVISION_LEAD_TIME_MINUTES = float(
+    os.getenv("PREPROVISION_LEAD_TIME_MINUTES", "15")
+)
+PREPROVISION_LEARN_LEAD_TIME = (
+    os.getenv("PREPROVISION_LEARN_LEAD_TIME", "true").lower() == "true"
+)
+SWEEP_SCHEDULE = os.getenv("SWEEP_SCHEDULE", "0 0 * * * *")
+WAKEUP_QUEUE_NAME = os.getenv("WAKEUP_QUEUE_NAME", "bastion-wakeup")
+WAKEUP_CONNECTION_STRING = os.getenv(
+    "AzureWebJobsStorage", "UseDevelopmentStorage=true"
+)
+# Enqueue provisioning jobs for the queue-triggered worker instead of running
+# pulumi in the triggering invocation, so that the trigger returns at once
+ASYNC_PROVISIONING = os.getenv("ASYNC_PROVISIONING", "false").lower() == "true"
+PROVISIONING_QUEUE_NAME = os.getenv("PROVISIONING_QUEUE_NAME", "bastion-provisioning")
+PROVISIONING_JOB_CONTAINER = os.getenv(
+    "PROVISIONING_JOB_CONTAINER", "provisioning-jobs"
+)
+PROVISIONING_MAX_ATTEMPTS = int(os.getenv("PROVISIONING_MAX_ATTEMPTS", "5"))
+# Seconds before a failed job is retried, doubled by each attempt, and before
+# a job waiting on a run in flight is checked again
+PROVISIONING_RETRY_SECONDS = float(os.getenv("PROVISIONING_RETRY_SECONDS", "30"))
+# Number of change-feed documents remembered to drop redeliveries, 0 to
+# disable, and whether to persist them next to the provisioning locks
+CHANGE_FEED_DEDUP_SIZE = int(os.getenv("CHANGE_FEED_DEDUP_SIZE", "10000"))
+CHANGE_FEED_DEDUP_PERSIST = (
+    os.getenv("CHANGE_FEED_DEDUP_PERSIST", "false").lower() == "true"
+)
+# Minimum seconds between writes of the persisted change-feed cache
+CHANGE_FEED_DEDUP_FLUSH_SECONDS = float(
+    os.getenv("CHANGE_FEED_DEDUP_FLUSH_SECONDS", "30")
+)
+# Read the change feed with the pull-model processor on a timer instead of
+# the cosmos db trigger, with control over batching and parallelism
+CHANGE_FEED_PULL = os.getenv("CHANGE_FEED_PULL", "false").lower() == "true"
+CHANGE_FEED_PULL_SCHEDULE = os.getenv("CHANGE_FEED_PULL_SCHEDULE", "*/30 * * * * *")
+CHANGE_FEED_LEASE_CONTAINER = os.getenv(
+    "CHANGE_FEED_LEASE_CONTAINER", "change-feed-leases"
+)
+CHANGE_FEED_MAX_ITEMS = int(os.getenv("CHANGE_FEED_MAX_ITEMS", "100"))
+CHANGE_FEED_MAX_WAIT_SECONDS = float(os.getenv("CHANGE_FEED_MAX_WAIT_SECONDS", "0"))
+CHANGE_FEED_MAX_WORKERS = int(os.getenv("CHANGE_FEED_MAX_WORKERS", "4"))
+# Time budget of one pull, below the function timeout
+CHANGE_FEED_MAX_DURATION_SECONDS = float(
+    os.getenv("CHANGE_FEED_MAX_DURATION_SECONDS", "240")
+)
+# Hourly cost of the target resource, for the run ledger's cost accounting
+BASTION_HOURLY_COST = float(os.getenv("BASTION_HOURLY_COST", "0.19"))
+USE_ASYNC_TRIGGER = os.getenv("USE_ASYNC_TRIGGER", "false").lower() == "true"
+# JSON list of targets (see bastion_handler.targets.Target), or a path to a
+# JSON file of them. By default, the one target of the settings above.
+BASTION_TARGETS = os.getenv("BASTION_TARGETS", "")
+TARGET_MAX_WORKERS = int(os.getenv("TARGET_MAX_WORKERS", "4"))
 
-credential = DefaultAzureCredential()
 
-client = CosmosClient(TARGET_COSMOSDB_ACCOUNT, credential)
-database = client.get_database_client(TARGET_COSMOSDB_DATABASE)
-container = database.get_container_client(TARGET_COSMOSDB_CONTAINER)
+def load_targets() -> TargetRegistry:
+    """Registry of the targets to reconcile."""
+    if not BASTION_TARGETS:
+        return TargetRegistry(
+            [
+                Target(
+                    name=DEFAULT_TARGET,
+                    subscription_id=TARGET_SUBSCRIPTION_ID,
+                    resource_group=TARGET_RESOURCE_GROUP,
+                    resource_name=TARGET_RESOURCE_NAME,
+                    resource_type=TARGET_RESOURCE_TYPE,
+                    api_version=TARGET_RESOURCE_API_VERSION,
+                    stack_name=PULUMI_STACK_NAME,
+                    target_resources=tuple(s for s in PULUMI_TARGET_RESOURCES if s),
+                    targets=tuple(arn for arn in TARGET_ARNS if arn),
+                    retain_ip=BASTION_RETAIN_IP,
+                )
+            ]
+        )
+    if BASTION_TARGETS.lstrip().startswith("["):
+        return TargetRegistry.from_json(BASTION_TARGETS)
+    return TargetRegistry.from_json(Path(BASTION_TARGETS).read_text())
 
-CURRENT_DIR = Path(__file__).parent
-PULUMI_DIR = CURRENT_DIR / "pulumi"
 
+targets = load_targets()
 
-@contextmanager
-def context_path(paths: list[str]):
-    """Context manager for changing the current working directory."""
-    try:
-        path = os.environ.get("PATH", "")
-        if os.name == "nt":
-            pathsep = ";"
-        else:
-            pathsep = ":"
-        os.environ["PATH"] = pathsep.join([path] + paths)
-    finally:
-        os.environ["PATH"] = path
+clients = ClientRegistry()
+clients.register("credential", DefaultAzureCredential)
+clients.register(
+    "cosmos",
+    lambda: CosmosClient(
+        TARGET_COSMOSDB_ACCOUNT, TARGET_COSMOSDB_KEY or clients.get("credential")
+    ),
+)
+clients.register(
+    "database",
+    lambda: clients.get("cosmos").get_database_client(TARGET_COSMOSDB_DATABASE),
+)
+clients.register(
+    "container",
+    lambda: clients.get("database").get_container_client(TARGET_COSMOSDB_CONTAINER),
+)
+
+
+def create_blob_container(connection_string: str, name: str):
+    """Client of a blob container, importing the storage SDK on first use."""
+    from azure.storage.blob import BlobServiceClient
 
+    return BlobServiceClient.from_connection_string(
+        connection_string
+    ).get_container_client(name)
 
-class Record(TypedDict):
-    id: str
-    title: str
-    start: str
-    end: str
 
+def create_queue(name: str):
+    """Client of a queue of the function app's storage account.
+
+    Messages are base64 encoded, as the queue trigger expects them. The
+    storage SDK is imported on first use.
+    """
+    from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+    return QueueClient.from_connection_string(
+        WAKEUP_CONNECTION_STRING,
+        name,
+        message_encode_policy=TextBase64EncodePolicy(),
+    )
 
-@app.cosmos_db_trigger(
-    arg_name="azcosmosdb",
-    container_name="BastionManagement",
-    database_name="Entries",
-    connection="DOCUMENTDB",
+
+# Clients of the asyncio trigger path, whose modules are imported on use only
+def create_credential_async():
+    from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+
+    return AsyncDefaultAzureCredential()
+
+
+def create_container_async():
+    from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+    return (
+        AsyncCosmosClient(
+            TARGET_COSMOSDB_ACCOUNT,
+            TARGET_COSMOSDB_KEY or clients.get("credential_async"),
+        )
+        .get_database_client(TARGET_COSMOSDB_DATABASE)
+        .get_container_client(TARGET_COSMOSDB_CONTAINER)
+    )
+
+
+def create_resource_client_async(subscription_id: str):
+    from azure.mgmt.resource.resources.aio import (
+        ResourceManagementClient as AsyncResourceManagementClient,
+    )
+
+    return AsyncResourceManagementClient(
+        clients.get("credential_async"), subscription_id
+    )
+
+
+clients.register("credential_async", create_credential_async)
+clients.register("container_async", create_container_async)
+clients.register(
+    "lock_container",
+    lambda: create_blob_container(
+        PROVISIONING_LOCK_CONNECTION_STRING, PROVISIONING_LOCK_CONTAINER
+    ),
+)
+clients.register(
+    "wakeup_queue",
+    lambda: create_queue(WAKEUP_QUEUE_NAME),
 )
+clients.register(
+    "change_feed_processor",
+    lambda: ChangeFeedProcessor(
+        create_container,
+        BlobLeaseStore(
+            create_blob_container(
+                PROVISIONING_LOCK_CONNECTION_STRING, CHANGE_FEED_LEASE_CONTAINER
+            )
+        ),
+        process_changes,
+        max_items=CHANGE_FEED_MAX_ITEMS,
+        max_wait=CHANGE_FEED_MAX_WAIT_SECONDS,
+        max_workers=CHANGE_FEED_MAX_WORKERS,
+    ),
+)
+clients.register(
+    "change_feed_dedup",
+    lambda: ChangeFeedDeduplicator(
+        CHANGE_FEED_DEDUP_SIZE,
+        blob=(
+            clients.get("lock_container").get_blob_client("change-feed.dedup")
+            if CHANGE_FEED_DEDUP_PERSIST
+            else None
+        ),
+        flush_interval=CHANGE_FEED_DEDUP_FLUSH_SECONDS,
+    ),
+)
+clients.register(
+    "provisioning_queue",
+    lambda: create_queue(PROVISIONING_QUEUE_NAME),
+)
+clients.register(
+    "job_store",
+    lambda: JobStore(
+        create_blob_container(
+            PROVISIONING_LOCK_CONNECTION_STRING, PROVISIONING_JOB_CONTAINER
+        )
+    ),
+)
+clients.register(
+    "job_queue",
+    lambda: JobQueue(clients.get("provisioning_queue"), clients.get("job_store")),
+)
+clients.register(
+    "job_runner",
+    lambda: JobRunner(
+        clients.get("job_store"),
+        fatal=(ProvisioningError,),
+        max_attempts=PROVISIONING_MAX_ATTEMPTS,
+        queue=clients.get("job_queue"),
+        retry_delay=PROVISIONING_RETRY_SECONDS,
+    ),
+)
+if PULUMI_STATE_CONTAINER:
+    clients.register(
+        "pulumi_state_cache",
+        lambda: BlobSnapshotCache(
+            create_blob_container(
+                os.getenv(
+                    "AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true"
+                ),
+                PULUMI_STATE_CONTAINER,
+            ),
+            PULUMI_CACHE_DIR / "state",
+        ),
+    )
+
+
+def target_key(name: str, target: Target) -> str:
+    """Registry name of the client ``name`` of ``target``."""
+    return f"{name}:{target.name}"
+
+
+def register_target(target: Target):
+    """Register the clients of a target.
+
+    Each target has its own lock, lead time, ledger, wake-ups, pulumi driver,
+    resource probes and reconciler state document, so targets are reconciled
+    independently of each other.
+    """
+    clients.register(
+        f"resource:{target.subscription_id}",
+        lambda: ResourceManagementClient(
+            clients.get("credential"), target.subscription_id
+        ),
+    )
+    clients.register(
+        f"resource_async:{target.subscription_id}",
+        lambda: create_resource_client_async(target.subscription_id),
+    )
+    clients.register(
+        target_key("single_flight", target),
+        lambda: SingleFlight(clients.get("lock_container"), target.stack_name),
+    )
+    clients.register(
+        target_key("lead_time", target),
+        lambda: LeadTimeEstimator(
+            clients.get("lock_container").get_blob_client(
+                f"{target.stack_name}.durations"
+            ),
+            timedelta(minutes=PREPROVISION_LEAD_TIME_MINUTES),
+            learn=PREPROVISION_LEARN_LEAD_TIME,
+        ),
+    )
+    clients.register(
+        target_key("ledger", target),
+        lambda: RunLedger(clients.get("lock_container"), target.stack_name),
+    )
+    clients.register(
+        target_key("wakeup", target),
+        lambda: WakeupScheduler(clients.get("wakeup_queue"), target=target.name),
+    )
+    clients.register(target_key("driver", target), lambda: create_driver(target))
+    clients.register(
+        target_key("probe", target),
+        lambda: ResourceProbe(
+            lambda: clients.get(f"resource:{target.subscription_id}"),
+            target.resource_id,
+            target.api_version,
+            ttl=TARGET_RESOURCE_STATE_TTL,
+        ),
+    )
+    clients.register(
+        target_key("probe_async", target),
+        lambda: AsyncResourceProbe(
+            lambda: clients.get(f"resource_async:{target.subscription_id}"),
+            target.resource_id,
+            target.api_version,
+            ttl=TARGET_RESOURCE_STATE_TTL,
+        ),
+    )
+    clients.register(
+        target_key("reconciler", target),
+        lambda: Reconciler(
+            clients.get("container"),
+            query=partial(read_data_from_cosmos, target),
+            document_id=target.state_document_id,
+        ),
+    )
+
+
+for _target in targets:
+    register_target(_target)
+
+CURRENT_DIR = Path(__file__).parent
+clients.register(
+    "pulumi_root",
+    lambda: str(
+        DirectoryMirror(
+            Path(PULUMI_ROOT),
+            PULUMI_CACHE_DIR / "cli",
+            include=[pattern for pattern in PULUMI_MIRROR_INCLUDE if pattern] or None,
+        ).sync()
+    ),
+)
+
+
+def create_driver(target: Target) -> ProvisioningDriver:
+    """Pulumi driver, running the CLI and plugins from the worker-local cache.
+
+    The mirror of PULUMI_ROOT is refreshed once per worker, copying only the
+    files of PULUMI_MIRROR_INCLUDE that changed on the share. A new worker
+    still copies all of them on its first run, mostly the azure-native plugin
+    of a few hundred MB, before pulumi starts.
+    """
+    pulumi_root = PULUMI_ROOT
+    pulumi_home = None
+    state_snapshot = None
+    if PULUMI_LOCAL_CACHE:
+        pulumi_root = clients.get("pulumi_root")
+        if (Path(pulumi_root) / "plugins").is_dir():
+            pulumi_home = pulumi_root
+        if PULUMI_STATE_CONTAINER:
+            state_snapshot = partial(read_state_snapshot, target)
+    return ProvisioningDriver(
+        CURRENT_DIR / target.pulumi_dir,
+        target.stack_name,
+        pulumi_root=pulumi_root,
+        targets=list(target.targets),
+        target_resources=[TargetSpec.parse(spec) for spec in target.target_resources],
+        parallel=PULUMI_PARALLEL,
+        pulumi_home=pulumi_home,
+        state_snapshot=state_snapshot,
+        timeout=PULUMI_TIMEOUT_SECONDS,
+        step_timeout=PULUMI_STEP_TIMEOUT_SECONDS,
+        abort_grace=PULUMI_ABORT_GRACE_SECONDS,
+        expected_config={"bastion_retain_ip": target.retain_ip},
+    )
+
+
+def read_state_snapshot(target: Target, project: str) -> Optional[dict]:
+    """Deployment of the stack's last state snapshot in the blob backend."""
+    data = clients.get("pulumi_state_cache").get(
+        f"{PULUMI_STATE_PREFIX}.pulumi/stacks/{project}/{target.stack_name}.json"
+    )
+    if data is None:
+        return None
+    return json.loads(data).get("checkpoint", {}).get("latest") or {}
+
+
+def create_container():
+    """New client of the reservations container, with a connection of its own."""
+    return (
+        CosmosClient(
+            TARGET_COSMOSDB_ACCOUNT, TARGET_COSMOSDB_KEY or clients.get("credential")
+        )
+        .get_database_client(TARGET_COSMOSDB_DATABASE)
+        .get_container_client(TARGET_COSMOSDB_CONTAINER)
+    )
+
+
+def get_container():
+    """Cosmos container client of the reservations."""
+    return clients.get("container")
+
+
+@app.warm_up_trigger("warmup_context")
+def warmup(warmup_context: WarmUpContext) -> None:
+    """Create the cheap clients of every trigger ahead of the first one.
+
+    Clients only some triggers use, or that are slow to create, like the
+    mirror of PULUMI_ROOT, are still created on first use.
+    """
+    timings = clients.warm_up(
+        ["credential", "container"]
+        + sorted({f"resource:{target.subscription_id}" for target in targets})
+    )
+    logger.info(f"Warm-up client initialisation: {timings}")
+
+
+def get_default_target() -> Target:
+    """Target of reservations without a ``target`` field."""
+    target = targets.get(targets.default)
+    if target is None:
+        raise KeyError(f"No default target {targets.default}")
+    return target
+
+
+def get_reconciler(target: Target) -> Reconciler:
+    """Reconciler of the target's state document."""
+    return clients.get(target_key("reconciler", target))
+
+
+def get_lead_time_estimator(target: Target) -> LeadTimeEstimator:
+    """Estimator of the target's pre-provisioning lead time."""
+    return clients.get(target_key("lead_time", target))
+
+
 def http_trigger(azcosmosdb: func.DocumentList) -> func.HttpResponse:
-    logger.info("Python HTTP trigger function processed a request.")
-    logger.info(f"TARGET_SUBSCRIPTION_ID: {TARGET_SUBSCRIPTION_ID}")
-    logger.info(f"TARGET_RESOURCE_GROUP: {TARGET_RESOURCE_GROUP}")
-    logger.info(f"TARGET_RESOURCE_NAME: {TARGET_RESOURCE_NAME}")
-    logger.info(f"TARGET_RESOURCE_ARM_TEMPLATE: {TARGET_RESOURCE_ARM_TEMPLATE}")
-    records = azcosmosdb.data
-    # records = read_data_from_cosmos()
-    now = datetime.now()
-    flag_create_resource = False
-    flag_delete_resource = False
+    log_targets()
+    message = process_changes(azcosmosdb.data)
+    return trigger_response(message, len(azcosmosdb.data))
+
+
+def process_changes(records: list[dict]) -> str:
+    """Reconcile a batch of changed documents not processed before."""
+    records = fresh_records(records)
+    message = reconcile(records)
+    remember_records(records)
+    return message
+
+
+def change_feed_pull(timer: func.TimerRequest) -> None:
+    """Process the pending changes with the pull-model change-feed processor."""
+    processor = clients.get("change_feed_processor")
+    processed = processor.run_once(max_duration=CHANGE_FEED_MAX_DURATION_SECONDS)
+    logger.info(f"Processed {processed} changes")
+
+
+@app.timer_trigger(schedule=SWEEP_SCHEDULE, arg_name="timer", run_on_startup=False)
+def sweep_timer(timer: func.TimerRequest) -> None:
+    """Safety-net sweep in case a scheduled wake-up was lost."""
+    message = reconcile([], verify=True)
+    logger.info(f"Sweep: {message}")
+
+
+@app.queue_trigger(
+    arg_name="msg", queue_name=WAKEUP_QUEUE_NAME, connection="AzureWebJobsStorage"
+)
+def wakeup_trigger(msg: func.QueueMessage) -> None:
+    """Reconcile at the next on/off transition scheduled by a previous run."""
+    body = json.loads(msg.get_body())
+    logger.info(f"Wake-up scheduled at {body['at']}")
+    names = [body["target"]] if "target" in body else None
+    message = reconcile([], verify=True, names=names)
+    logger.info(f"Wake-up: {message}")
+
+
+@app.queue_trigger(
+    arg_name="msg",
+    queue_name=PROVISIONING_QUEUE_NAME,
+    connection="AzureWebJobsStorage",
+)
+def provisioning_worker(msg: func.QueueMessage) -> None:
+    """Run a provisioning job enqueued by a reconcile.
+
+    The job is checkpointed after running pulumi and after verifying the
+    resource, so a redelivered message resumes where the previous attempt
+    stopped.
+    """
+    job_id = json.loads(msg.get_body())["job"]
+    with phase("provisioning.job", job=job_id) as span:
+        job = clients.get("job_runner").run(job_id, job_steps)
+        if job is not None:
+            span.set_attribute("status", job.status)
+            logger.info(f"Job {job_id}: {job.status}")
+
+
+def job_steps(job: Job) -> list[Step]:
+    """Steps of a provisioning job."""
+    target = targets.get(job.target)
+    if target is None:
+        raise ProvisioningError(f"Unknown target {job.target}")
+    return [
+        ("provision", lambda: {"ran": run_provisioning(target, job.state)}),
+        (
+            "verify",
+            lambda: verify(
+                job,
+                clients.get(target_key("single_flight", target)),
+                partial(read_target_resource, target),
+            ),
+        ),
+    ]
+
+
+def read_target_resource(target: Target) -> bool:
+    """Whether the target resource exists, read past the probe's cache."""
+    return clients.get(target_key("probe", target)).state(force=True).exists
+
+
+@app.route(route="jobs/{job_id?}", methods=["GET"])
+def job_status(req: func.HttpRequest) -> func.HttpResponse:
+    """Status of a provisioning job, or of the latest jobs without an id.
+
+    Without an id, the optional ``target`` query parameter restricts the jobs
+    to one target and ``limit`` sets their number, by default 10.
+    """
+    store = clients.get("job_store")
+    job_id = req.route_params.get("job_id")
+    if job_id:
+        job = store.get(job_id)
+        if job is None:
+            return func.HttpResponse("Unknown job", status_code=404)
+        body = job.to_dict()
+    else:
+        limit = req.params.get("limit", "10")
+        if not limit.isdecimal() or int(limit) < 1:
+            return func.HttpResponse(
+                "limit must be a positive integer", status_code=400
+            )
+        jobs = store.recent(limit=int(limit), target=req.params.get("target"))
+        body = [job.to_dict() for job in jobs]
+    return func.HttpResponse(
+        json.dumps(body), status_code=200, mimetype="application/json"
+    )
+
+
+@app.route(route="reconcile", methods=["POST"])
+def reconcile_now(req: func.HttpRequest) -> func.HttpResponse:
+    """Reconcile the target resources with the schedule immediately.
+
+    Idempotent: a resource is only created or deleted if the schedule says
+    it should be and it is not already in that state. The optional ``target``
+    query parameter restricts the reconcile to one target.
+    """
+    target = req.params.get("target")
+    message = reconcile([], verify=True, names=[target] if target else None)
+    return trigger_response(message, 0)
+
+
+@app.route(route="ledger", methods=["GET"])
+def ledger_summary(req: func.HttpRequest) -> func.HttpResponse:
+    """Provisioning percentiles, idle minutes and cost from the run ledger.
+
+    The optional ``since`` query parameter limits the summary to entries at or
+    after that ISO-8601 timestamp, and ``target`` selects the target, by
+    default the default target.
+    """
+    since = req.params.get("since")
+    target = targets.get(req.params.get("target") or targets.default)
+    if target is None:
+        return func.HttpResponse("Unknown target", status_code=404)
+    now = utcnow()
+    entries = clients.get(target_key("ledger", target)).entries(
+        since=parse_timestamp(since) if since else None
+    )
+    summary = summarize(entries, now, BASTION_HOURLY_COST)
+    return func.HttpResponse(
+        json.dumps(summary.to_dict()), status_code=200, mimetype="application/json"
+    )
+
+
+def select_targets(
+    groups: dict[str, list[dict]], verify: bool, names: Optional[list[str]]
+) -> list[Target]:
+    """Targets to reconcile: those named, all when verifying, else those changed."""
+    if names is None:
+        names = [target.name for target in targets] if verify else list(groups)
+    selected = []
+    for name in names:
+        target = targets.get(name)
+        if target is None:
+            logger.warning(f"Unknown target {name}")
+        else:
+            selected.append(target)
+    return selected
+
+
+def reconcile(
+    records: list[dict], verify: bool = False, names: Optional[list[str]] = None
+) -> str:
+    """Apply changed records and create or delete the target resources.
+
+    Records are routed to their targets, and the affected targets (``names``,
+    or every target with ``verify``) are reconciled concurrently on at most
+    TARGET_MAX_WORKERS threads. A failing target does not stop the others;
+    the failures are raised together once all targets are done.
+
+    Without ``verify`` a resource is only deleted when the desired state
+    turns to "destroy"; with it, a resource left over is deleted as well.
+    """
+    with phase("reconcile", records=len(records), verify=verify) as span:
+        groups = targets.group(records)
+        selected = select_targets(groups, verify, names)
+        span.set_attribute("targets", len(selected))
+        if len(selected) <= 1:
+            messages = {
+                target.name: reconcile_target(
+                    target, groups.get(target.name, []), verify
+                )
+                for target in selected
+            }
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(TARGET_MAX_WORKERS, len(selected))
+            ) as executor:
+                futures = {
+                    target.name: executor.submit(
+                        contextvars.copy_context().run,
+                        reconcile_target,
+                        target,
+                        groups.get(target.name, []),
+                        verify,
+                    )
+                    for target in selected
+                }
+            messages, errors = {}, {}
+            for name, future in futures.items():
+                try:
+                    messages[name] = future.result()
+                except Exception as e:
+                    logger.exception(f"Failed to reconcile {name}")
+                    errors[name] = e
+            if errors:
+                raise ReconcileError(errors)
+        message = format_messages(messages)
+        span.set_attribute("message", message)
+        return message
+
+
+def format_messages(messages: dict[str, str]) -> str:
+    """Message of a reconcile, prefixed by the target when there are several."""
+    if not messages:
+        return "No action required"
+    if len(targets) == 1:
+        return next(iter(messages.values()))
+    return "; ".join(f"{name}: {message}" for name, message in messages.items())
+
+
+def reconcile_target(target: Target, records: list[dict], verify: bool) -> str:
+    """Apply a target's changed records and create or delete its resource."""
+    with phase("reconcile.target", target=target.name) as span:
+        message = _reconcile(target, records, verify)
+        span.set_attribute("message", message)
+        return message
+
+
+def _reconcile(target: Target, records: list[dict], verify: bool) -> str:
+    now = utcnow()
+    with phase("lead_time"):
+        lead_time = get_lead_time_estimator(target).lead_time()
+    decision = apply_records(target, records, now, lead_time)
+    schedule_wakeup(target, decision, now, lead_time)
+
+    # Remove expired reservations
+    expired = decision.expired
+    if len(expired) > 0:
+        with phase("cosmos.delete_expired", expired=len(expired)) as span:
+            report = delete_expired(
+                get_container(), expired, max_workers=EXPIRY_MAX_WORKERS
+            )
+            span.set_attribute("deleted", len(report.deleted))
+            span.set_attribute("failed", len(report.failed))
+        logger.info(
+            f"Deleted {len(report.deleted)} expired reservations, "
+            f"{len(report.failed)} failed"
+        )
+        record_expired(target, expired, now)
+        ignore_deleted(report.deleted, now)
+
     # Check if the resource should be created
-    for record in records:
-        if datetime.fromisoformat(record["start"]) >= now:
-            flag_create_resource = True
-        if datetime.fromisoformat(record["end"]) >= now:
-            container.delete_item(record["id"], record["title"])
-            flag_delete_resource = True
+    flag_create_resource, flag_delete_resource = decide(decision, verify)
 
     if flag_create_resource:
         # Create resource if not available
-        if has_target_resource():
+        if has_target_resource(target):
             message = "Resource already exists"
         else:
             message = "Resource does not exist"
-            create_resources()
+            provision(target, "up")
+    elif flag_delete_resource:
+        if (verify or decision.bootstrapped) and not has_target_resource(target):
+            message = "No action required"
+        else:
+            message = "Resource deleted"
+            provision(target, "destroy")
+    else:
+        message = "No action required"
+    return message
+
+
+def apply_records(
+    target: Target, records: list[dict], now: datetime, lead_time: timedelta
+) -> Decision:
+    """Apply changed records to the target's reconciler state document."""
+    with phase("reconcile.apply", records=len(records)) as span:
+        decision = get_reconciler(target).apply(records, now, lead_time=lead_time)
+        span.set_attribute("active", decision.summary.active_count)
+        span.set_attribute("expired", len(decision.expired))
+        span.set_attribute("desired", decision.summary.desired)
+        span.set_attribute("transitioned", decision.transitioned)
+        return decision
+
+
+def schedule_wakeup(
+    target: Target, decision: Decision, now: datetime, lead_time: timedelta
+):
+    """Schedule a reconcile of the target at the next transition of its schedule."""
+    at = next_wakeup(decision.summary, now, lead_time)
+    if at is not None:
+        with phase("schedule_wakeup", at=at.isoformat()) as span:
+            scheduler = clients.get(target_key("wakeup", target))
+            span.set_attribute("sent", scheduler.schedule(at, now))
+
+
+def decide(decision: Decision, verify: bool = False) -> tuple[bool, bool]:
+    """Whether to create and whether to delete the target resource."""
+    flag_create_resource = decision.summary.desired == "up"
+    flag_delete_resource = decision.summary.desired == "destroy" and (
+        verify or decision.transitioned or len(decision.expired) > 0
+    )
+    return flag_create_resource, flag_delete_resource
+
+
+async def http_trigger_async(azcosmosdb: func.DocumentList) -> func.HttpResponse:
+    """Asyncio variant of :func:`http_trigger`.
+
+    Affected targets are reconciled concurrently, at most TARGET_MAX_WORKERS
+    at a time. Within a target, the expired-record cleanup and the existence
+    check run concurrently, and provisioning runs in a worker thread so that
+    the event loop stays free.
+
+    Only the cleanup and the existence check use the async clients. The
+    reconciler state document, the lead time and the wake-up message still
+    go through the synchronous clients, each in a worker thread of
+    ``asyncio.to_thread``, so a batch takes a thread per target for them.
+    """
+    log_targets()
+    records = fresh_records(azcosmosdb.data)
+    with phase("reconcile", records=len(records), verify=False) as span:
+        groups = targets.group(records)
+        selected = select_targets(groups, False, None)
+        span.set_attribute("targets", len(selected))
+        semaphore = asyncio.Semaphore(TARGET_MAX_WORKERS)
+
+        async def run(target: Target) -> str:
+            async with semaphore:
+                with phase("reconcile.target", target=target.name) as target_span:
+                    message = await _reconcile_async(target, groups[target.name])
+                    target_span.set_attribute("message", message)
+                    return message
+
+        results = await asyncio.gather(
+            *(run(target) for target in selected), return_exceptions=True
+        )
+        errors = {
+            target.name: result
+            for target, result in zip(selected, results)
+            if isinstance(result, BaseException)
+        }
+        for name, error in errors.items():
+            logger.error(f"Failed to reconcile {name}: {error}")
+        if errors:
+            raise ReconcileError(errors)
+        message = format_messages(
+            {target.name: result for target, result in zip(selected, results)}
+        )
+        span.set_attribute("message", message)
+    await asyncio.to_thread(remember_records, records)
+    return trigger_response(message, len(azcosmosdb.data))
+
+
+async def _reconcile_async(target: Target, records: list[dict]) -> str:
+    now = utcnow()
+    with phase("lead_time"):
+        lead_time = await asyncio.to_thread(get_lead_time_estimator(target).lead_time)
+    decision = await asyncio.to_thread(apply_records, target, records, now, lead_time)
+    await asyncio.to_thread(schedule_wakeup, target, decision, now, lead_time)
+
+    # Expired reservations are never active, so the decision does not wait for them
+    expired = decision.expired
+    flag_create_resource, flag_delete_resource = decide(decision)
+
+    async def remove_expired():
+        if len(expired) > 0:
+            with phase("cosmos.delete_expired", expired=len(expired)) as span:
+                report = await delete_expired_async(
+                    clients.get("container_async"),
+                    expired,
+                    max_concurrency=EXPIRY_MAX_WORKERS,
+                )
+                span.set_attribute("deleted", len(report.deleted))
+                span.set_attribute("failed", len(report.failed))
+            logger.info(
+                f"Deleted {len(report.deleted)} expired reservations, "
+                f"{len(report.failed)} failed"
+            )
+            await asyncio.to_thread(record_expired, target, expired, now)
+            await asyncio.to_thread(ignore_deleted, report.deleted, now)
+
+    async def target_exists() -> bool:
+        probe = clients.get(target_key("probe_async", target))
+        # A bootstrapped state only destroys a resource seen to exist
+        return (
+            flag_create_resource or (flag_delete_resource and decision.bootstrapped)
+        ) and await probe.exists()
+
+    _, exists = await asyncio.gather(remove_expired(), target_exists())
+
+    if flag_create_resource:
+        # Create resource if not available
+        if exists:
+            message = "Resource already exists"
+        else:
+            message = "Resource does not exist"
+            await asyncio.to_thread(provision, target, "up")
+    elif flag_delete_resource and decision.bootstrapped and not exists:
+        message = "No action required"
     elif flag_delete_resource:
         message = "Resource deleted"
-        delete_resources()
+        await asyncio.to_thread(provision, target, "destroy")
     else:
         message = "No action required"
+    return message
+
+
+if CHANGE_FEED_PULL:
+    app.timer_trigger(
+        schedule=CHANGE_FEED_PULL_SCHEDULE, arg_name="timer", run_on_startup=False
+    )(change_feed_pull)
+else:
+    app.cosmos_db_trigger(
+        arg_name="azcosmosdb",
+        container_name="BastionManagement",
+        database_name="Entries",
+        connection="DOCUMENTDB",
+    )(http_trigger_async if USE_ASYNC_TRIGGER else http_trigger)
+
+
+def log_targets():
+    logger.info("Python HTTP trigger function processed a request.")
+    logger.info(f"TARGET_SUBSCRIPTION_ID: {TARGET_SUBSCRIPTION_ID}")
+    logger.info(f"TARGET_RESOURCE_GROUP: {TARGET_RESOURCE_GROUP}")
+    logger.info(f"TARGET_RESOURCE_NAME: {TARGET_RESOURCE_NAME}")
+    logger.info(f"TARGET_RESOURCE_ARM_TEMPLATE: {TARGET_RESOURCE_ARM_TEMPLATE}")
+    logger.info(f"Targets: {[target.name for target in targets]}")
 
+
+def trigger_response(message: str, num_records: int) -> func.HttpResponse:
     logger.info(f"Execution: {message}")
     return func.HttpResponse(
         json.dumps(
             {
                 "status": "success",
                 "message": message,
-                "num_records": len(records),
+                "num_records": num_records,
             }
         ),
         status_code=200,
     )
 
 
-def read_data_from_cosmos() -> list[Record]:
-    """Read data from cosmos db"""
-    items = container.query_items(
-        query="SELECT * FROM c", enable_cross_partition_query=True
+def fresh_records(records: list[dict]) -> list[dict]:
+    """Records of a change-feed batch that were not processed before."""
+    if not CHANGE_FEED_DEDUP_SIZE:
+        return records
+    with phase("dedup", records=len(records)) as span:
+        try:
+            fresh = clients.get("change_feed_dedup").fresh(records)
+        except AzureError as e:
+            logger.warning(f"Failed to load the change-feed cache: {e}")
+            return records
+        span.set_attribute("fresh", len(fresh))
+    if len(fresh) < len(records):
+        logger.info(f"Dropped {len(records) - len(fresh)} redelivered or own documents")
+    return fresh
+
+
+def remember_records(records: list[dict]):
+    """Remember the records of a reconciled batch, to drop their redeliveries."""
+    if not CHANGE_FEED_DEDUP_SIZE or not records:
+        return
+    try:
+        clients.get("change_feed_dedup").remember(records)
+    except AzureError as e:
+        logger.warning(f"Failed to persist the change-feed cache: {e}")
+
+
+def ignore_deleted(ids: list[str], now: datetime):
+    """Drop later deliveries of the documents this invocation deleted."""
+    if not CHANGE_FEED_DEDUP_SIZE or not ids:
+        return
+    try:
+        clients.get("change_feed_dedup").mark_deleted(ids, now)
+    except AzureError as e:
+        logger.warning(f"Failed to persist the change-feed cache: {e}")
+
+
+def read_data_from_cosmos(
+    target: Target, since: Optional[datetime] = None
+) -> Iterator[Record]:
+    """Read data from cosmos db
+
+    Only the target's reservations ending at or after ``since`` (by default
+    now) and starting within RESERVATION_HORIZON_DAYS are streamed. Used to
+    recompute the target's reconciler state when it is out of date.
+    """
+    now = utcnow()
+    records = iter_reservations(
+        get_container(), since or now, now + timedelta(days=RESERVATION_HORIZON_DAYS)
+    )
+    return (record for record in records if targets.route(record) == target)
+
+
+def provision(target: Target, state: str) -> bool:
+    """Request the target resource in ``state`` ("up" or "destroy").
+
+    With ASYNC_PROVISIONING the request is enqueued as a job for the
+    provisioning worker, otherwise pulumi runs in this invocation.
+
+    Returns
+    -------
+    bool
+        True if this invocation ran pulumi.
+    """
+    if ASYNC_PROVISIONING:
+        with phase("provision.enqueue", state=state) as span:
+            job = clients.get("job_queue").enqueue(target.name, state)
+            span.set_attribute("job", job.id)
+        return False
+    return run_provisioning(target, state)
+
+
+def run_provisioning(target: Target, state: str) -> bool:
+    """Run pulumi to bring the target resource into ``state``.
+
+    Concurrent requests are coalesced by a blob lease per target, so only one
+    invocation runs pulumi for a target at a time and later requests merge
+    into the run in flight.
+
+    Returns
+    -------
+    bool
+        True if this invocation ran pulumi, False if the request was merged.
+    """
+    with phase("provision", state=state) as span:
+        single_flight = clients.get(target_key("single_flight", target))
+        ran = single_flight.submit(state, partial(apply_state, target))
+        span.set_attribute("ran", ran)
+    if not ran:
+        record_ledger(target, [LedgerEntry(kind=state, at=utcnow(), merged=True)])
+    return ran
+
+
+def apply_state(target: Target, state: str):
+    """Run pulumi to bring the target resource into ``state``."""
+    result = create_resources(target) if state == "up" else delete_resources(target)
+    record_ledger(
+        target,
+        [
+            LedgerEntry(
+                kind=result.operation,
+                at=utcnow(),
+                succeeded=result.succeeded,
+                duration=result.duration,
+            )
+        ],
     )
-    return items  # type: ignore
+    if not result.succeeded:
+        raise ProvisioningError(f"pulumi {result.operation} failed")
+    if result.operation == "up":
+        get_lead_time_estimator(target).record(result.duration)
+
+
+def record_expired(target: Target, expired: list[Reservation], now: datetime):
+    """Record the windows of expired reservations in the target's run ledger."""
+    record_ledger(target, (LedgerEntry.from_reservation(r, now) for r in expired))
+
+
+def record_ledger(target: Target, entries: Iterable[LedgerEntry]):
+    """Append entries to the target's run ledger, without failing the invocation."""
+    try:
+        clients.get(target_key("ledger", target)).append(entries)
+    except AzureError as e:
+        logger.warning(f"Failed to append to the run ledger: {e}")
 
 
-def format_arns(arns: list[str]) -> str:
-    """Format arns"""
-    return " ".join([f"--target {arn}" for arn in arns])
+def invalidate_probes(target: Target):
+    """Drop the cached state of the target resource after a pulumi run."""
+    clients.get(target_key("probe", target)).invalidate()
+    clients.get(target_key("probe_async", target)).invalidate()
 
 
-def create_resources():
+def create_resources(target: Target) -> ProvisioningResult:
     """Create resources using azure api"""
-    target_arn_opts = format_arns(TARGET_ARNS)
-    with context_path("/mnt/pulumi"):
-        subprocess.check_call("pulumi login", cwd=str(PULUMI_DIR), shell=True)
-        subprocess.check_call(
-            f"pulumi up -y {target_arn_opts}", cwd=str(PULUMI_DIR), shell=True
-        )
+    try:
+        return clients.get(target_key("driver", target)).create()
+    finally:
+        invalidate_probes(target)
 
 
-def delete_resources():
+def delete_resources(target: Target) -> ProvisioningResult:
     """Delete resources using azure api"""
-    target_arn_opts = format_arns(TARGET_ARNS)
-    with context_path("/mnt/pulumi"):
-        subprocess.check_call("pulumi login", cwd=str(PULUMI_DIR), shell=True)
-        subprocess.check_call(
-            f"pulumi destroy -y {target_arn_opts}", cwd=str(PULUMI_DIR), shell=True
-        )
+    try:
+        return clients.get(target_key("driver", target)).destroy()
+    finally:
+        invalidate_probes(target)
 
 
-def has_target_resource() -> bool:
+def has_target_resource(target: Target) -> bool:
     """Read resources using azure api"""
-    resource_client = ResourceManagementClient(credential, TARGET_SUBSCRIPTION_ID)
-    resources = resource_client.resource_groups.list_resources(TARGET_RESOURCE_GROUP)
-    for resource in resources:
-        if resource.name is not None and resource.name == TARGET_RESOURCE_NAME:
-            return True
-    return False
+    return clients.get(target_key("probe", target)).exists()
@@ -0,0 +1,138 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from bastion_handler.changefeed import (
+    BlobLeaseStore,
+    ChangeFeedProcessor,
+    feed_range_key,
+)
+from benchmarks.fakes import FakeBlobContainer, FakeContainer
+
+
+def reservation(i: int) -> dict:
+    return {
+        "id": f"r{i}",
+        "title": f"user{i}",
+        "start": "2024-08-08T00:00:00+00:00",
+        "end": "2024-08-08T01:00:00+00:00",
+    }
+
+
+class Clock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.now, timezone.utc)
+
+
+@pytest.fixture
+def leases() -> BlobLeaseStore:
+    return BlobLeaseStore(FakeBlobContainer())
+
+
+def processor(container, leases, batches, **kwargs) -> ChangeFeedProcessor:
+    return ChangeFeedProcessor(
+        lambda: container,
+        leases,
+        lambda batch: batches.append([item["id"] for item in batch]),
+        max_items=100,
+        **kwargs,
+    )
+
+
+def test_changes_are_handed_over_in_batches(leases: BlobLeaseStore):
+    container = FakeContainer([reservation(i) for i in range(250)])
+    batches: list[list[str]] = []
+
+    assert (
+        processor(container, leases, batches, start_time="Beginning").run_once() == 250
+    )
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+
+
+def test_failed_batch_is_read_again_from_the_checkpoint(leases: BlobLeaseStore):
+    container = FakeContainer([reservation(i) for i in range(250)])
+    batches: list[list[str]] = []
+
+    def handler(batch: list[dict]):
+        if batches:
+            raise RuntimeError("reconcile failed")
+        batches.append([item["id"] for item in batch])
+
+    failing = ChangeFeedProcessor(
+        lambda: container, leases, handler, max_items=100, start_time="Beginning"
+    )
+    with pytest.raises(RuntimeError):
+        failing.run_once()
+
+    resumed: list[list[str]] = []
+    assert processor(container, leases, resumed).run_once() == 150
+    assert resumed[0][0] == "r100"
+
+    container.create_item(reservation(250))
+    assert processor(container, leases, resumed).run_once() == 1
+    assert resumed[-1] == ["r250"]
+
+
+def test_range_leased_by_another_owner_is_skipped(leases: BlobLeaseStore):
+    container = FakeContainer([reservation(i) for i in range(10)], feed_ranges=2)
+    feed_range = container.read_feed_ranges()[0]
+    held = leases.acquire(feed_range_key(feed_range), feed_range)
+    batches: list[list[str]] = []
+    contended = processor(container, leases, batches, start_time="Beginning")
+
+    processed = contended.run_once()
+    assert 0 < processed < 10
+
+    held.release()
+    assert contended.run_once() == 10 - processed
+
+
+def test_range_without_checkpoint_starts_now(leases: BlobLeaseStore):
+    container = FakeContainer([reservation(i) for i in range(10)])
+    batches: list[list[str]] = []
+    fresh = processor(container, leases, batches)
+
+    assert fresh.run_once() == 0
+    container.create_item(reservation(10))
+    assert fresh.run_once() == 1
+    assert batches == [["r10"]]
+
+
+def test_child_range_resumes_from_the_parent_checkpoint():
+    clock = Clock(1_000)
+    leases = BlobLeaseStore(FakeBlobContainer(clock=clock.datetime))
+    container = FakeContainer(clock=clock)
+    container.create_item(reservation(0))
+    # The parent range was checkpointed before it split into the fake's range
+    parent = {"Range": {"min": 0, "max": 2}}
+    clock.now = 2_000
+    lease = leases.acquire(feed_range_key(parent), parent)
+    lease.checkpoint("parent-token")
+    lease.release()
+    clock.now = 3_000
+    container.create_item(reservation(1))
+    batches: list[list[str]] = []
+
+    assert processor(container, leases, batches).run_once() == 1
+    assert batches == [["r1"]]
+
+
+def test_range_clients_are_created_once(leases: BlobLeaseStore):
+    container = FakeContainer(feed_ranges=3)
+    created: list[FakeContainer] = []
+
+    def factory():
+        created.append(container)
+        return container
+
+    changes = ChangeFeedProcessor(factory, leases, lambda batch: None)
+    changes.run_once()
+    changes.run_once()
+
+    assert len(created) == 4
@@ -0,0 +1,127 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from bastion_handler.dedup import ChangeFeedDeduplicator
+from bastion_handler.state import STATE_DOCUMENT_ID
+from benchmarks.fakes import FakeBlobContainer
+
+
+def change(reservation_id: str, **version) -> dict:
+    return {
+        "id": reservation_id,
+        "title": "user",
+        "start": "2024-08-08T10:00:00",
+        "end": "2024-08-08T11:00:00",
+        **version,
+    }
+
+
+def ids(records: list[dict]) -> list[str]:
+    return [record["id"] for record in records]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def blob():
+    return FakeBlobContainer().get_blob_client("change-feed.dedup")
+
+
+def persisted(blob) -> dict:
+    return json.loads(blob.download_blob().readall())
+
+
+def test_redelivered_versions_are_dropped():
+    dedup = ChangeFeedDeduplicator()
+    dedup.remember([change("a", _lsn=5), change("b", _etag='"x"')])
+
+    fresh = dedup.fresh(
+        [
+            change("a", _lsn=5),
+            change("a", _lsn=4),
+            change("b", _etag='"x"'),
+            change("a", _lsn=6),
+            change("b", _etag='"y"'),
+            change("c", _lsn=1),
+            change("d"),
+        ]
+    )
+
+    assert ids(fresh) == ["a", "b", "c", "d"]
+    assert [record.get("_lsn") for record in fresh[:1]] == [6]
+
+
+def test_own_state_documents_are_dropped_before_the_cache(blob):
+    dedup = ChangeFeedDeduplicator(blob=blob)
+    state = {"id": STATE_DOCUMENT_ID, "title": STATE_DOCUMENT_ID, "_lsn": 9}
+
+    fresh = dedup.fresh([state, change("a", _lsn=1)])
+    dedup.remember(fresh)
+
+    assert ids(fresh) == ["a"]
+    assert persisted(blob)["seen"] == [["a", 1]]
+
+
+def test_deleted_documents_are_not_brought_back():
+    dedup = ChangeFeedDeduplicator()
+    deleted_at = datetime(2024, 8, 8, 12, tzinfo=timezone.utc)
+    dedup.mark_deleted(["a", "b"], deleted_at)
+
+    fresh = dedup.fresh(
+        [
+            change("a", _lsn=1, _ts=int(deleted_at.timestamp())),
+            change("b", _lsn=2, _ts=int(deleted_at.timestamp()) + 1),
+        ]
+    )
+
+    assert ids(fresh) == ["b"]
+
+
+def test_least_recently_seen_documents_are_forgotten():
+    dedup = ChangeFeedDeduplicator(max_size=2)
+    dedup.remember([change("a", _lsn=1), change("b", _lsn=2)])
+    dedup.fresh([change("a", _lsn=1)])
+    dedup.remember([change("c", _lsn=3)])
+
+    assert ids(dedup.fresh([change(i, _lsn=n) for n, i in enumerate("abc", 1)])) == [
+        "b"
+    ]
+
+
+def test_concurrent_writes_of_the_blob_are_merged(blob):
+    first = ChangeFeedDeduplicator(blob=blob)
+    second = ChangeFeedDeduplicator(blob=blob)
+    first.fresh([])
+    second.fresh([])
+
+    first.remember([change("a", _lsn=1)])
+    # Created by the first instance in the meantime
+    second.remember([change("b", _lsn=2), change("a", _lsn=3)])
+    # Modified by the second instance since the first one wrote it
+    first.remember([change("c", _lsn=4)])
+
+    assert dict(persisted(blob)["seen"]) == {"a": 3, "b": 2, "c": 4}
+    restarted = ChangeFeedDeduplicator(blob=blob)
+    assert restarted.fresh([change("a", _lsn=3), change("b", _lsn=2)]) == []
+
+
+def test_writes_of_the_blob_are_throttled(blob):
+    clock = Clock()
+    dedup = ChangeFeedDeduplicator(blob=blob, flush_interval=30, clock=clock)
+
+    dedup.remember([change("a", _lsn=1)])
+    clock.now = 10
+    dedup.remember([change("b", _lsn=2)])
+    assert dict(persisted(blob)["seen"]) == {"a": 1}
+
+    clock.now = 31
+    dedup.remember([change("c", _lsn=3)])
+    assert dict(persisted(blob)["seen"]) == {"a": 1, "b": 2, "c": 3}
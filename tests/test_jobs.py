@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+from bastion_handler.jobs import (
+    JobDeferred,
+    JobQueue,
+    JobRunner,
+    JobStore,
+    VerificationError,
+    verify,
+)
+from bastion_handler.lock import SingleFlight
+from benchmarks.fakes import FakeBlobContainer, FakeQueue
+
+
+@pytest.fixture
+def queue() -> JobQueue:
+    return JobQueue(FakeQueue(), JobStore(FakeBlobContainer()))
+
+
+def requeued(queue: JobQueue) -> list[tuple[str, int]]:
+    return [
+        (json.loads(content)["job"], kwargs["visibility_timeout"])
+        for content, kwargs in queue.queue.messages
+        if "visibility_timeout" in kwargs
+    ]
+
+
+def test_enqueue_saves_the_job_before_sending_it(queue: JobQueue):
+    job = queue.enqueue("default", "up")
+
+    assert queue.store.get(job.id).status == "queued"
+    assert [json.loads(content) for content, _ in queue.queue.messages] == [
+        {"job": job.id}
+    ]
+    assert queue.store.recent(target="default") == [queue.store.get(job.id)]
+    assert queue.store.recent(target="other") == []
+
+
+def test_redelivered_job_resumes_after_its_last_completed_step(queue: JobQueue):
+    job = queue.enqueue("default", "up")
+    runner = JobRunner(queue.store)
+    calls: list[str] = []
+
+    def steps(job):
+        def verify():
+            calls.append("verify")
+            if calls.count("verify") == 1:
+                raise RuntimeError("not yet")
+            return {"exists": True}
+
+        return [("provision", lambda: calls.append("provision")), ("verify", verify)]
+
+    with pytest.raises(RuntimeError):
+        runner.run(job.id, steps)
+    assert queue.store.get(job.id).completed == ("provision",)
+
+    job = runner.run(job.id, steps)
+    assert job.status == "succeeded"
+    assert job.attempts == 2
+    assert job.result == {"exists": True}
+    assert calls == ["provision", "verify", "verify"]
+    assert runner.run(job.id, steps).attempts == 2
+
+
+def test_fatal_error_fails_the_job_at_once(queue: JobQueue):
+    job = queue.enqueue("default", "up")
+
+    def fail():
+        raise ValueError("bad target")
+
+    job = JobRunner(queue.store, fatal=(ValueError,), queue=queue).run(
+        job.id, lambda job: [("provision", fail)]
+    )
+
+    assert (job.status, job.error, job.attempts) == ("failed", "bad target", 1)
+    assert requeued(queue) == []
+
+
+def test_failed_attempts_are_requeued_with_backoff(queue: JobQueue):
+    job = queue.enqueue("default", "up")
+    runner = JobRunner(queue.store, max_attempts=3, queue=queue, retry_delay=30)
+
+    def fail():
+        raise VerificationError("still exists")
+
+    statuses = [runner.run(job.id, lambda job: [("verify", fail)]) for _ in range(3)]
+
+    assert [job.status for job in statuses] == ["queued", "queued", "failed"]
+    assert statuses[-1].error == "still exists"
+    assert requeued(queue) == [(job.id, 30), (job.id, 60)]
+
+
+def test_deferred_job_is_requeued_without_counting_the_attempt(queue: JobQueue):
+    job = queue.enqueue("default", "up")
+    runner = JobRunner(queue.store, max_attempts=1, queue=queue, retry_delay=30)
+
+    def wait():
+        raise JobDeferred("in flight")
+
+    for _ in range(3):
+        job = runner.run(job.id, lambda job: [("verify", wait)])
+
+    assert (job.status, job.attempts) == ("queued", 0)
+    assert requeued(queue) == [(job.id, 30)] * 3
+
+
+def test_verify_skips_a_job_superseded_by_the_other_state(queue: JobQueue):
+    flight = SingleFlight(FakeBlobContainer(), "dev")
+    job = queue.enqueue("default", "up")
+    flight.submit("up", lambda state: None)
+    flight.submit("destroy", lambda state: None)
+
+    assert verify(job, flight, lambda: False) == {"superseded": True}
+
+
+def test_verify_waits_for_the_run_in_flight(queue: JobQueue):
+    container = FakeBlobContainer()
+    flight = SingleFlight(container, "dev")
+    job = queue.enqueue("default", "up")
+    results: list = []
+
+    def reconcile(state: str):
+        if results:
+            return
+        # The request of the job is merged into this run
+        results.append(SingleFlight(container, "dev").submit("up", reconcile))
+        with pytest.raises(JobDeferred):
+            verify(job, flight, lambda: False)
+
+    flight.submit("up", reconcile)
+
+    assert results == [False]
+    assert verify(job, flight, lambda: True) == {"exists": True}
+
+
+def test_verify_fails_when_no_run_brought_the_resource_up(queue: JobQueue):
+    flight = SingleFlight(FakeBlobContainer(), "dev")
+    job = queue.enqueue("default", "destroy")
+    flight.submit("destroy", lambda state: None)
+
+    with pytest.raises(VerificationError):
+        verify(job, flight, lambda: True)
+    assert verify(job, flight, lambda: False) == {"exists": False}
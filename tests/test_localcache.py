@@ -0,0 +1,55 @@
+from pathlib import Path
+
+from bastion_handler.localcache import DirectoryMirror
+
+
+def write(path: Path, content: str = "x") -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path
+
+
+def files(directory: Path) -> list[str]:
+    return sorted(
+        path.relative_to(directory).as_posix()
+        for path in directory.rglob("*")
+        if path.is_file() and path.name != ".manifest.json"
+    )
+
+
+def test_only_included_paths_are_mirrored(tmp_path: Path):
+    share, local = tmp_path / "share", tmp_path / "local"
+    for name in (
+        "pulumi",
+        "pulumi-language-python",
+        "pulumi-language-nodejs",
+        "plugins/resource-azure-native-v2.0.0/pulumi-resource-azure-native",
+        "plugins/resource-aws-v6.0.0/pulumi-resource-aws",
+    ):
+        write(share / name)
+    mirror = DirectoryMirror(
+        share, local, include=["pulumi", "pulumi-language-python", "plugins/*azure*"]
+    )
+
+    assert mirror.sync() == local
+    assert files(local) == [
+        "plugins/resource-azure-native-v2.0.0/pulumi-resource-azure-native",
+        "pulumi",
+        "pulumi-language-python",
+    ]
+
+
+def test_only_changed_files_are_copied_again(tmp_path: Path):
+    share, local = tmp_path / "share", tmp_path / "local"
+    write(share / "pulumi", "v1")
+    write(share / "bin/other", "v1")
+    mirror = DirectoryMirror(share, local)
+    mirror.sync()
+    (local / "bin/other").write_text("local")
+
+    write(share / "pulumi", "v2")
+    (share / "bin/other").unlink()
+    mirror.sync()
+
+    assert (local / "pulumi").read_text() == "v2"
+    assert files(local) == ["pulumi"]
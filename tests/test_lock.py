@@ -0,0 +1,73 @@
+import threading
+
+from bastion_handler.lock import SingleFlight
+from benchmarks.fakes import FakeBlobContainer
+
+
+def applied(flight: SingleFlight) -> dict[str, str]:
+    return flight.lock_blob.get_blob_properties().metadata
+
+
+def test_submit_reconciles_the_requested_state():
+    flight = SingleFlight(FakeBlobContainer(), "dev")
+    calls: list[str] = []
+
+    assert flight.submit("up", calls.append)
+    assert calls == ["up"]
+    assert applied(flight) == {"generation": "1", "state": "up"}
+
+
+def test_request_in_flight_is_merged_into_the_running_reconcile():
+    container = FakeBlobContainer()
+    first, second = SingleFlight(container, "dev"), SingleFlight(container, "dev")
+    started, resume = threading.Event(), threading.Event()
+    calls: list[str] = []
+
+    def reconcile(state: str):
+        calls.append(state)
+        if len(calls) == 1:
+            started.set()
+            assert resume.wait(5)
+
+    results: list[bool] = []
+    runner = threading.Thread(
+        target=lambda: results.append(first.submit("up", reconcile))
+    )
+    runner.start()
+    assert started.wait(5)
+    merged = second.submit("destroy", reconcile)
+    resume.set()
+    runner.join(5)
+
+    assert not merged
+    assert results == [True]
+    assert calls == ["up", "destroy"]
+    assert applied(first) == {"generation": "2", "state": "destroy"}
+
+
+def test_request_published_during_release_is_reconciled():
+    container = FakeBlobContainer()
+    first, second = SingleFlight(container, "dev"), SingleFlight(container, "dev")
+    calls: list[str] = []
+    merged: list[bool] = []
+    acquire = first.lock_blob.acquire_lease
+
+    def acquire_lease(**kwargs):
+        lease = acquire(**kwargs)
+        release = lease.release
+
+        def publish_then_release():
+            # Published after the drain, while the lease is still held
+            if not merged:
+                merged.append(second.submit("destroy", calls.append))
+            release()
+
+        lease.release = publish_then_release
+        return lease
+
+    first.lock_blob.acquire_lease = acquire_lease
+
+    assert first.submit("up", calls.append)
+    assert merged == [False]
+    assert calls == ["up", "destroy"]
+    assert applied(first) == {"generation": "2", "state": "destroy"}
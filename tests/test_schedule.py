@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bastion_handler.schedule import Reservation, ReservationIndex, is_reservation
+
+T0 = datetime(2024, 8, 8, tzinfo=timezone.utc)
+
+
+def at(hours: float) -> datetime:
+    return T0 + timedelta(hours=hours)
+
+
+def record(reservation_id: str, start: float, end: float) -> dict:
+    return {
+        "id": reservation_id,
+        "title": "user",
+        "start": at(start).isoformat(),
+        "end": at(end).isoformat(),
+    }
+
+
+@pytest.fixture
+def index() -> ReservationIndex:
+    # a and b overlap, c touches b's end, d is separate
+    return ReservationIndex(
+        [record("a", 1, 3), record("b", 2, 4), record("c", 4, 5), record("d", 7, 8)]
+    )
+
+
+@pytest.mark.parametrize(
+    "hours, active",
+    [(0, 0), (1, 1), (2.5, 2), (3, 1), (4, 1), (5, 0), (6, 0), (7, 1), (8, 0)],
+)
+def test_count_active_treats_intervals_as_half_open(index, hours, active):
+    assert index.count_active(at(hours)) == active
+    assert index.is_active(at(hours)) == (active > 0)
+
+
+def test_next_start_and_end_are_strictly_after(index):
+    assert index.next_start(at(0)) == at(1)
+    assert index.next_start(at(1)) == at(2)
+    assert index.next_start(at(4)) == at(7)
+    assert index.next_start(at(7)) is None
+    assert index.next_end(at(0)) == at(3)
+    assert index.next_end(at(4)) == at(5)
+    assert index.next_end(at(8)) is None
+
+
+def test_next_transition_merges_touching_intervals(index):
+    assert index.next_transition(at(0)) == (at(1), True)
+    assert index.next_transition(at(2)) == (at(5), False)
+    assert index.next_transition(at(4)) == (at(5), False)
+    assert index.next_transition(at(5)) == (at(7), True)
+    assert index.next_transition(at(8)) is None
+
+
+def test_expired_reservations_end_at_or_before(index):
+    assert index.expired(at(2.5)) == []
+    assert [r.id for r in index.expired(at(3))] == ["a"]
+    assert [r.id for r in index.expired(at(4))] == ["a", "b"]
+    assert [r.id for r in index.expired(at(9))] == ["a", "b", "c", "d"]
+
+
+def test_update_replaces_an_existing_id(index):
+    assert index.update([record("a", 5, 6), record("d", 7, 8)]) == 1
+
+    assert index.get("a") == Reservation.from_record(record("a", 5, 6))
+    assert index.count_active(at(1)) == 0
+    assert index.count_active(at(5.5)) == 1
+    assert index.next_end(at(0)) == at(4)
+    assert len(index) == 4
+
+
+def test_remove_drops_an_existing_id(index):
+    assert index.remove("b").id == "b"
+    assert index.remove("b") is None
+
+    assert "b" not in index
+    assert index.count_active(at(3.5)) == 0
+    assert index.next_transition(at(1)) == (at(3), False)
+
+
+@pytest.mark.parametrize("start, end", [(2, 2), (3, 2)])
+def test_empty_or_reversed_records_remove_the_reservation(index, start, end):
+    assert index.update([record("a", start, end)]) == 1
+
+    assert "a" not in index
+    assert index.count_active(at(1.5)) == 0
+    assert len(index) == 3
+
+
+def test_documents_other_than_reservations_are_ignored():
+    index = ReservationIndex([{"id": "__reconciler_state__", "title": "x"}])
+
+    assert len(index) == 0
+    assert not is_reservation({"id": "a", "title": "t", "start": None, "end": ""})
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+from bastion_handler.query import iter_reservations
+from bastion_handler.state import STATE_DOCUMENT_ID, Reconciler
+from benchmarks.fakes import FakeContainer
+
+NOW = datetime(2024, 8, 8, 12, tzinfo=timezone.utc)
+
+
+def at(hours: float) -> datetime:
+    return NOW + timedelta(hours=hours)
+
+
+def record(reservation_id: str, start: float, end: float) -> dict:
+    # Stored like the Logic App does, as naive UTC timestamps
+    return {
+        "id": reservation_id,
+        "title": f"user-{reservation_id}",
+        "start": at(start).replace(tzinfo=None).isoformat(),
+        "end": at(end).replace(tzinfo=None).isoformat(),
+    }
+
+
+class Query:
+    """Windowed reservation query recording the times it was run since."""
+
+    def __init__(self, container: FakeContainer):
+        self.container = container
+        self.calls: list[datetime] = []
+
+    def __call__(self, since: datetime):
+        self.calls.append(since)
+        return iter_reservations(self.container, since, since + timedelta(days=300))
+
+
+def write(container: FakeContainer, body: dict) -> dict:
+    container.delete_item(body["id"], body["title"])
+    return container.create_item(body)
+
+
+@pytest.fixture
+def container() -> FakeContainer:
+    return FakeContainer(
+        [record("active", -1, 1), record("next", 2, 3), record("later", 4, 5)]
+    )
+
+
+@pytest.fixture
+def query(container: FakeContainer) -> Query:
+    return Query(container)
+
+
+def test_bootstrap_recomputes_the_state_from_the_container(container, query):
+    container.create_item(record("ended", -3, -2))
+
+    decision = Reconciler(container, query).apply([], NOW)
+
+    assert decision.bootstrapped and decision.transitioned
+    assert decision.summary.active_count == 1
+    assert (decision.summary.next_start, decision.summary.next_end) == (at(2), at(1))
+    assert decision.summary.desired == "up"
+    assert query.calls == [NOW]
+    document = container.read_item(STATE_DOCUMENT_ID, STATE_DOCUMENT_ID)
+    assert list(document["active"]) == ["active"]
+    assert document["next_start_ids"] == ["next"]
+
+
+def test_changes_are_applied_without_querying(container, query):
+    reconciler = Reconciler(container, query)
+    reconciler.apply([], NOW)
+
+    decision = reconciler.apply([record("sooner", 1.5, 6), record("now", -0.5, 7)], NOW)
+    assert not decision.bootstrapped and not decision.transitioned
+    assert decision.summary.active_count == 2
+    assert decision.summary.next_start == at(1.5)
+
+    etag = container.read_item(STATE_DOCUMENT_ID, STATE_DOCUMENT_ID)["_etag"]
+    reconciler.apply([{"id": "other", "title": "other"}], NOW)
+    assert container.read_item(STATE_DOCUMENT_ID, STATE_DOCUMENT_ID)["_etag"] == etag
+    assert query.calls == [NOW]
+
+
+def test_moved_reservation_of_the_next_start_is_recomputed(container, query):
+    reconciler = Reconciler(container, query)
+    reconciler.apply([], NOW)
+
+    moved = write(container, record("next", 6, 7))
+    decision = reconciler.apply([moved], NOW)
+
+    assert decision.summary.next_start == at(4)
+    assert query.calls == [NOW, NOW]
+
+
+def test_cancelled_active_reservation_is_recomputed(container, query):
+    reconciler = Reconciler(container, query)
+    reconciler.apply([], NOW)
+
+    cancelled = write(container, record("active", -1, -1))
+    decision = reconciler.apply([cancelled], NOW)
+
+    assert decision.transitioned
+    assert decision.summary.active_count == 0
+    assert decision.summary.next_end == at(3)
+    assert decision.summary.desired == "destroy"
+    assert query.calls == [NOW, NOW]
+
+
+def test_stale_state_is_recomputed_since_its_last_update(container, query):
+    reconciler = Reconciler(container, query)
+    reconciler.apply([], NOW)
+
+    decision = reconciler.apply([], at(2.5))
+
+    assert query.calls == [NOW, NOW]
+    assert [r.id for r in decision.expired] == ["active"]
+    assert decision.summary.active_count == 1
+    assert (decision.summary.next_start, decision.summary.next_end) == (at(4), at(3))
+
+
+def test_batch_is_applied_again_on_top_of_a_concurrent_update(container, query):
+    first, second = Reconciler(container, query), Reconciler(container, query)
+    first.apply([], NOW)
+    replace_item = container.replace_item
+
+    def concurrent_replace(*args, **kwargs):
+        container.replace_item = replace_item
+        second.apply([record("concurrent", -0.5, 6)], NOW)
+        return replace_item(*args, **kwargs)
+
+    container.replace_item = concurrent_replace
+    decision = first.apply([record("sooner", 1.25, 6)], NOW)
+
+    assert decision.summary.next_start == at(1.25)
+    document = container.read_item(STATE_DOCUMENT_ID, STATE_DOCUMENT_ID)
+    assert sorted(document["active"]) == ["active", "concurrent"]
+    assert document["next_start_ids"] == ["sooner"]
+    assert query.calls == [NOW]
+
+
+def test_persistent_conflict_is_raised_after_the_retries(container, query):
+    reconciler = Reconciler(container, query, max_retries=2)
+    reconciler.apply([], NOW)
+    attempts = []
+
+    def conflict(*args, **kwargs):
+        attempts.append(args)
+        raise CosmosAccessConditionFailedError(status_code=412, message="modified")
+
+    container.replace_item = conflict
+    with pytest.raises(CosmosAccessConditionFailedError):
+        reconciler.apply([record("sooner", 1.5, 6)], NOW)
+    assert len(attempts) == 3